@@ -0,0 +1,141 @@
+import numpy as np
+from PIL import Image
+
+from embeddings_manager import EmbeddingsManager
+from images_manager import ImageCleaner
+
+# Étiquettes CLIP enregistrées pour toutes les images, avec leur traduction anglaise (CLIP fonctionne mieux en anglais qu'en français)
+CLIP_TAGS = {
+    "Ville": "a photo of a city with buildings and streets",
+    "Plage": "a photo of a beach with sea and sand",
+    "Montagne": "a photo of mountains",
+    "Forêt": "a photo of a forest with trees",
+    "Neige": "a photo of snow in winter",
+    "Nourriture": "a photo of food or a meal",
+    "Personnes": "a photo of people",
+    "Animal": "a photo of an animal",
+    "Monument": "a photo of a monument or a famous building",
+    "Intérieur": "a photo of the inside of a house or a room",
+    "Véhicule": "a photo of a car or a vehicle",
+    "Capture d'écran": "a screenshot of a computer or phone screen",
+    "Document": "a photo of a document, a receipt or a text page",
+}
+
+# Images sans intérêt pour une description détaillée : les étiquettes CLIP suffisent
+LOW_VALUE_TAGS = {"Capture d'écran", "Document"}
+
+
+class CaptioningCascade(EmbeddingsManager):
+    def __init__(self, duplicate_threshold=0.95, ambiguous_threshold=0.90, phash_threshold=8, low_value_confidence=0.6,
+                 window=20, top_tags=3, batch_size=32):
+        """
+        Cascade avant l'appel au LLM : seules les images représentatives et les cas ambigus sont décrits par le LLM.
+
+        :param duplicate_threshold: Similarité cosinus CLIP à partir de laquelle une image est un quasi-doublon d'une image déjà décrite.
+        :param ambiguous_threshold: Entre ce seuil et duplicate_threshold, le pHash décide : quasi-doublon ou nouvelle image à décrire.
+        :param phash_threshold: Distance pHash maximale entre deux quasi-doublons.
+        :param low_value_confidence: Probabilité CLIP à partir de laquelle une capture d'écran ou un document n'est pas envoyé au LLM.
+        :param window: Nombre d'images représentatives récentes comparées à chaque image (les rafales sont des images consécutives).
+        :param top_tags: Nombre d'étiquettes CLIP gardées par image.
+        :param batch_size: Taille des lots pour le calcul des embeddings.
+        """
+        super().__init__()
+        self.duplicate_threshold = duplicate_threshold
+        self.ambiguous_threshold = ambiguous_threshold
+        self.phash_threshold = phash_threshold
+        self.low_value_confidence = low_value_confidence
+        self.window = window
+        self.top_tags = top_tags
+        self.batch_size = batch_size
+        self.image_cleaner = ImageCleaner()
+        self._tag_embeddings = None
+        self._phashes = {}
+
+    @property
+    def tag_embeddings(self):
+        if self._tag_embeddings is None:
+            self._tag_embeddings = self.text_embedding(list(CLIP_TAGS.values()))
+        return self._tag_embeddings
+
+    def plan(self, image_paths):
+        """
+        Décide comment chaque image sera décrite.
+
+        :param image_paths: Images à décrire, dans l'ordre du traitement (ordre des noms : les rafales se suivent).
+        :return: Dictionnaire {chemin : décision}. Une décision contient "mode" ("llm", "inherit" ou "tags"),
+                 "tags" (liste de tuples (étiquette, probabilité)) et, pour "inherit", "representative" (image dont la description est reprise).
+                 Les images illisibles sont envoyées au LLM.
+        """
+        names = list(CLIP_TAGS)
+        decisions = {}
+        representatives = []   # (chemin, embedding) des images envoyées au LLM, les plus récentes à la fin
+
+        for batch_start in range(0, len(image_paths), self.batch_size):
+            batch_paths, batch_images = self._load_batch(image_paths[batch_start:batch_start + self.batch_size], decisions)
+            if not batch_images:
+                continue
+            embeddings = self.image_embedding(images=batch_images)
+            # Zero-shot : probabilités des étiquettes (softmax des similarités, avec l'échelle de CLIP)
+            logits = 100 * embeddings @ self.tag_embeddings.T
+            probabilities = np.exp(logits - logits.max(axis=1, keepdims=True))
+            probabilities = probabilities / probabilities.sum(axis=1, keepdims=True)
+
+            for path, embedding, tag_probabilities in zip(batch_paths, embeddings, probabilities):
+                best_indices = np.argsort(tag_probabilities)[::-1][:self.top_tags]
+                tags = [(names[i], float(tag_probabilities[i])) for i in best_indices]
+
+                if tags[0][0] in LOW_VALUE_TAGS and tags[0][1] >= self.low_value_confidence:
+                    decisions[path] = {"mode": "tags", "tags": tags}
+                    continue
+
+                representative = self._find_representative(path, embedding, representatives[-self.window:])
+                if representative is not None:
+                    decisions[path] = {"mode": "inherit", "tags": tags, "representative": representative}
+                else:
+                    decisions[path] = {"mode": "llm", "tags": tags}
+                    representatives.append((path, embedding))
+
+        modes = [decision["mode"] for decision in decisions.values()]
+        print(f"Cascade : {modes.count('llm')} images envoyées au LLM, {modes.count('inherit')} quasi-doublons, "
+              f"{modes.count('tags')} images décrites par les étiquettes CLIP")
+        self._phashes = {}
+        return decisions
+
+    def _find_representative(self, path, embedding, representatives):
+        if not representatives:
+            return None
+        similarities = np.array([float(embedding @ rep_embedding) for _, rep_embedding in representatives])
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.duplicate_threshold:
+            return representatives[best][0]
+        if similarities[best] < self.ambiguous_threshold:
+            return None
+
+        # Cas ambigu : le pHash (structure de l'image) confirme ou non le quasi-doublon
+        phash = self._get_phash(path)
+        for index in np.argsort(similarities)[::-1]:
+            if similarities[index] < self.ambiguous_threshold:
+                break
+            rep_phash = self._get_phash(representatives[index][0])
+            if phash is not None and rep_phash is not None and phash - rep_phash <= self.phash_threshold:
+                return representatives[index][0]
+        return None
+
+    def _get_phash(self, path):
+        if path not in self._phashes:
+            self._phashes[path] = self.image_cleaner.get_phash(path)
+        return self._phashes[path]
+
+    def _load_batch(self, paths, decisions):
+        loaded_paths, images = [], []
+        for path in paths:
+            try:
+                image = Image.open(path)
+                # CLIP travaille en 224x224 : décodage JPEG directement à une résolution réduite
+                image.draft("RGB", (448, 448))
+                images.append(image.convert("RGB"))
+                loaded_paths.append(path)
+            except Exception as e:
+                print(f"Erreur lors du chargement de l'image {path}: {e}")
+                decisions[path] = {"mode": "llm", "tags": []}
+        return loaded_paths, images
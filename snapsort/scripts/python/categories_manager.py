@@ -1,33 +1,47 @@
-import os
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from PIL import Image
 from tabulate import tabulate
 import numpy as np
-import torch
 from sklearn.metrics.pairwise import cosine_similarity
 
 from dataframe_completion import DataframeCompletion
 from clustering_manager import ClusteringManager
 from embeddings_manager import EmbeddingsManager
 from images_manager import ImageCleaner
+from checkpoint_manager import CheckpointManager
+from directory_scanner import scan_images
+from pipeline_profiler import PipelineProfiler
 
 class CategoriesManager(EmbeddingsManager):
-    def __init__(self, directory, allowed_extensions=None):
-        super().__init__()
+    def __init__(self, directory, allowed_extensions=None, checkpoints=None, workers=1, profiler=None, embedding_dtype="float32", pca_dimensions=None,
+                 known_metadata=None, memory_budget=None):
+        super().__init__(memory_budget=memory_budget)
         if allowed_extensions is None:
             allowed_extensions = {".jpg", ".jpeg", ".png", ".gif"}
         self.allowed_extensions = allowed_extensions
         self.directory = directory
+        self.workers = workers
+        self.embedding_dtype = embedding_dtype
+        self.pca_dimensions = pca_dimensions
 
         self.image_paths = self.get_image_paths(directory)
         self.image_cleaner = ImageCleaner()
+        self.checkpoints = checkpoints if checkpoints is not None else CheckpointManager()
+        self.profiler = profiler if profiler is not None else PipelineProfiler()
 
-        self.dataframe_manager = DataframeCompletion(self.image_paths)
-        self.df = DataframeCompletion(self.image_paths).get_dataframe()
+        # Etape 0 : tableau des métadonnées EXIF
+        if self.checkpoints.is_completed("metadata"):
+            self.dataframe_manager = DataframeCompletion(self.image_paths, df=self.checkpoints.load("metadata"))
+        else:
+            with self.profiler.stage("metadata"):
+                self.dataframe_manager = DataframeCompletion(self.image_paths, known_metadata=known_metadata)
+            self.checkpoints.save("metadata", self.dataframe_manager.get_dataframe())
+        self.df = self.dataframe_manager.get_dataframe()
 
     def get_image_paths(self, directory):
-        image_paths = [os.path.join(directory, filename) for filename in os.listdir(directory) if os.path.splitext(filename)[1].lower() in self.allowed_extensions]
+        image_paths = [entry.path for entry in scan_images(directory, self.allowed_extensions)]
         return image_paths
 
     def get_predifined_categories(self):
@@ -56,19 +70,19 @@ class CategoriesManager(EmbeddingsManager):
 
         return en_categories, predefined_categories
 
-    def get_cluster_images(self, image_paths, duplicates_to_remove):
-        # Obtenir les images nettoyées (sans doublons ni floues)
-        cleaned_paths = self.image_cleaner.clean_cluster(image_paths)
+    def get_category_embeddings(self, en_categories):
+        return self.text_embedding(en_categories)
+
+    def get_cluster_images(self, image_paths, cleaned_paths):
+        # cleaned_paths : images du cluster conservées après nettoyage (sans doublons ni floues)
         print(f"Images après nettoyage : {cleaned_paths}")
         
         if not cleaned_paths:
             print("Aucune image retenue après nettoyage!")
-            # Marquer toutes les images du cluster comme doublons à éliminer
-            duplicates_to_remove.extend(image_paths)
                 
-        # Identifier les doublons pour ce cluster
-        removed_images = set(image_paths) - set(cleaned_paths)
-        duplicates_to_remove.extend(removed_images)
+        # Identifier les doublons pour ce cluster (toutes les images si aucune n'est retenue)
+        kept_images = set(cleaned_paths)
+        removed_images = [path for path in image_paths if path not in kept_images]
 
         # Charger les images nettoyées
         cluster_images = []
@@ -80,7 +94,32 @@ class CategoriesManager(EmbeddingsManager):
                 print(f"Erreur lors du chargement de l'image {path}: {e}")
                 continue
 
-        return cluster_images, duplicates_to_remove
+        return cluster_images, removed_images
+
+    def clean_clusters_parallel(self, clusters_by_day, cleaned_clusters, categorised_clusters):
+        """
+        Nettoie en parallèle (un processus par cluster) tous les clusters qui ne l'ont pas encore été.
+        Les résultats sont rangés par cluster : la suite du pipeline est identique à l'exécution en série.
+        """
+        pending = {}
+        for day, day_clusters in clusters_by_day.items():
+            for cluster_name, image_paths in day_clusters.items():
+                cluster_key = f"{day}/{cluster_name}"
+                if image_paths and cluster_key not in cleaned_clusters and cluster_key not in categorised_clusters:
+                    pending[cluster_key] = image_paths
+
+        if not pending:
+            return cleaned_clusters
+
+        print(f"Nettoyage de {len(pending)} clusters sur {self.workers} processus")
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.image_cleaner.clean_cluster, image_paths): cluster_key for cluster_key, image_paths in pending.items()}
+            for future in as_completed(futures):
+                cluster_key = futures[future]
+                cleaned_clusters[cluster_key] = future.result()
+                self.checkpoints.save_partial("cleaning", cluster_key, cleaned_clusters[cluster_key])
+
+        return cleaned_clusters
 
     def best_cluster_category(self, all_embeddings, category_embeddings, predefined_categories, threshold=0.10):
         cluster_embeddings = np.vstack(all_embeddings)
@@ -128,7 +167,7 @@ class CategoriesManager(EmbeddingsManager):
 
         return best_cat, best_cat_score
 
-    def pipeline_categories_embedding_with_clusters(self, threshold_category=0.05, threshold_clustering=0.55, batch_size=10, predefined_categories=None):
+    def pipeline_categories_embedding_with_clusters(self, threshold_category=0.05, threshold_clustering=0.55, batch_size=None, predefined_categories=None):
         """
         Attribue des catégories en utilisant les clusters comme unité de base.
         Toutes les images d'un même cluster reçoivent la même catégorie.
@@ -138,7 +177,14 @@ class CategoriesManager(EmbeddingsManager):
         else:
             en_categories = predefined_categories
 
-        clustering_manager = ClusteringManager(self.df)
+        if self.checkpoints.is_completed("categories"):
+            self.df = self.checkpoints.load("categories")
+            return self.df
+
+        clustering_manager = ClusteringManager(self.df, checkpoints=self.checkpoints, workers=self.workers, profiler=self.profiler,
+                                               clip_model=self.clip_model, clip_processor=self.clip_processor,
+                                               embedding_dtype=self.embedding_dtype, pca_dimensions=self.pca_dimensions,
+                                               batch_scheduler=self.batch_scheduler)
 
         # Choix de la méthode de clustering
         clustered_df, clusters_by_day = clustering_manager.perform_neighbors_clustering(threshold=threshold_clustering, n_neighbors=3)
@@ -146,75 +192,117 @@ class CategoriesManager(EmbeddingsManager):
         self.df = clustered_df
         #print(f"Clustering terminé: {len(clusters_by_day)} jours traités")
 
-        # Liste pour suivre les doublons à éliminer
-        duplicates_to_remove = []
-
-        # Encodage des catégories
-        text_inputs = self.clip_processor(text=en_categories, return_tensors="pt", padding=True).to(self.device)
-        with torch.no_grad():
-            category_embeddings = self.clip_model.get_text_features(**text_inputs)
-        category_embeddings = category_embeddings / category_embeddings.norm(p=2, dim=-1, keepdim=True)
-        category_embeddings = category_embeddings.cpu().numpy()
-
-        #print(clusters_by_day)
-
-        # Traitement de chaque cluster
-        print(f"ETAPE 3 - Association des noms aux clusters :\n")
-        total_clusters = sum(len(clusters) for clusters in clusters_by_day.values())
-        cluster_counter = 0
-        for day, day_clusters in clusters_by_day.items():
-            for cluster_name, image_paths in day_clusters.items():
-                cluster_counter += 1
-                print(f"\nEtape [3/4] : [{cluster_counter}/{total_clusters}]")
-                print(f"Images du cluster : {image_paths}")
-
-                if not image_paths:
-                    continue
-
-                #print(f"\nTraitement du cluster {cluster_name} avec {len(image_paths)} images")
-
-                cluster_images, duplicates_to_remove = self.get_cluster_images(image_paths, duplicates_to_remove)
-                if not cluster_images:
-                    continue
-    
-                # Traitement des images par lots pour éviter les problèmes de mémoire
-                all_embeddings = []
-                for i in range(0, len(cluster_images), batch_size):
-                    batch_images = cluster_images[i:i + batch_size]
-                    image_embeddings = self.image_embedding(images=batch_images)
-                    all_embeddings.append(image_embeddings)
-
-                # Combinaison de tous les embeddings du cluster
-                if all_embeddings:
-                    best_cat, best_cat_score = self.best_cluster_category(all_embeddings,category_embeddings,predefined_categories, threshold=threshold_category)
-
-                    is_single_image = len(image_paths) == 1
-                    #is_ambiguous = (diff_with_best < threshold and best_cat != "Autres")
-                    formatted_date = day.replace(":", "_")
-                    category = formatted_date + "_" + best_cat
-
-                    # Attribuer "Autres" si:
-                        # - soit son score est suffisamment proche du meilleur score (diff < threshold) et qu'il n'est pas déjà le meilleur
-                        # - soit c'est déjà la meilleure catégorie (best_cat == "Autres")
-                        # - soit le cluster ne contient qu'une seule image
-
-                    '''if is_ambiguous:
-                        category = "Autres/Autres"'''
-
-                    if best_cat == "Autres" or is_single_image:
-                        category = f"Autres/{best_cat}" # Sous dossier dans "Autres" avec la catégorie précédemment attribuée
-
-                    print(f"Cluster {cluster_counter}: catégorie attribuée = {category} (score: {best_cat_score:.3f})\n")
-
-                    # Mise à jour du DataFrame
-                    for path in image_paths:
-                        self.df.loc[self.df["path"] == path, "categories"] = category
+        with self.profiler.stage("categories"):
+            # Liste pour suivre les doublons à éliminer
+            duplicates_to_remove = []
+            categories_mapping = {}
+
+            # Clusters déjà nettoyés / catégorisés lors d'une exécution interrompue
+            cleaned_clusters = self.checkpoints.load_partial("cleaning")
+            categorised_clusters = self.checkpoints.load_partial("categories")
+            if self.workers > 1:
+                self.clean_clusters_parallel(clusters_by_day, cleaned_clusters, categorised_clusters)
+
+            # Encodage des catégories
+            category_embeddings = self.get_category_embeddings(en_categories)
+
+            # Les scores de catégorie réutilisent les embeddings du clustering, dans le même espace (projection, précision)
+            embedding_store = clustering_manager.embedding_store
+            store_category_embeddings = None
+            if embedding_store is not None:
+                store_category_embeddings = embedding_store.project(category_embeddings)
+                if embedding_store.is_compressed:
+                    embedding_store.check_category_accuracy(category_embeddings)
+
+            #print(clusters_by_day)
+
+            # Traitement de chaque cluster
+            print(f"ETAPE 3 - Association des noms aux clusters :\n")
+            total_clusters = sum(len(clusters) for clusters in clusters_by_day.values())
+            cluster_counter = 0
+            for day, day_clusters in clusters_by_day.items():
+                for cluster_name, image_paths in day_clusters.items():
+                    cluster_counter += 1
+                    print(f"\nEtape [3/4] : [{cluster_counter}/{total_clusters}]")
+                    print(f"Images du cluster : {image_paths}")
+
+                    if not image_paths:
+                        continue
+
+                    #print(f"\nTraitement du cluster {cluster_name} avec {len(image_paths)} images")
+
+                    cluster_key = f"{day}/{cluster_name}"
+                    if cluster_key in categorised_clusters:
+                        result = categorised_clusters[cluster_key]
+                        duplicates_to_remove.extend(result["duplicates"])
+                        if result["category"] is not None:
+                            for path in image_paths:
+                                categories_mapping[path] = result["category"]
+                        continue
+
+                    cleaned_paths = cleaned_clusters.get(cluster_key)
+                    if cleaned_paths is None:
+                        cleaned_paths = self.image_cleaner.clean_cluster(image_paths)
+                        self.checkpoints.save_partial("cleaning", cluster_key, cleaned_paths)
+
+                    stored_embeddings = embedding_store.get(cleaned_paths) if embedding_store is not None and cleaned_paths else None
+                    if stored_embeddings is not None:
+                        # Embeddings déjà calculés pour le clustering : les images ne sont pas relues
+                        kept_images = set(cleaned_paths)
+                        removed_images = [path for path in image_paths if path not in kept_images]
+                        all_embeddings = [stored_embeddings]
+                        cluster_category_embeddings = store_category_embeddings
+                    else:
+                        cluster_images, removed_images = self.get_cluster_images(image_paths, cleaned_paths)
+                        all_embeddings = None
+                        cluster_category_embeddings = category_embeddings
+                    duplicates_to_remove.extend(removed_images)
+                    category = None
+                    if all_embeddings is None and not cluster_images:
+                        self.checkpoints.save_partial("categories", cluster_key, {"category": category, "duplicates": removed_images})
+                        continue
+
+                    if all_embeddings is None:
+                        # Traitement des images par lots pour éviter les problèmes de mémoire
+                        image_embeddings = self.batched_image_embedding(images=cluster_images, batch_size=batch_size)
+                        all_embeddings = [image_embeddings] if image_embeddings is not None else []
+
+                    # Combinaison de tous les embeddings du cluster
+                    if all_embeddings:
+                        best_cat, best_cat_score = self.best_cluster_category(all_embeddings, cluster_category_embeddings, predefined_categories, threshold=threshold_category)
+
+                        is_single_image = len(image_paths) == 1
+                        #is_ambiguous = (diff_with_best < threshold and best_cat != "Autres")
+                        formatted_date = day.replace(":", "_")
+                        category = formatted_date + "_" + best_cat
+
+                        # Attribuer "Autres" si:
+                            # - soit son score est suffisamment proche du meilleur score (diff < threshold) et qu'il n'est pas déjà le meilleur
+                            # - soit c'est déjà la meilleure catégorie (best_cat == "Autres")
+                            # - soit le cluster ne contient qu'une seule image
+
+                        '''if is_ambiguous:
+                            category = "Autres/Autres"'''
+
+                        if best_cat == "Autres" or is_single_image:
+                            category = f"Autres/{best_cat}" # Sous dossier dans "Autres" avec la catégorie précédemment attribuée
+
+                        print(f"Cluster {cluster_counter}: catégorie attribuée = {category} (score: {best_cat_score:.3f})\n")
+
+                        for path in image_paths:
+                            categories_mapping[path] = category
+
+                    self.checkpoints.save_partial("categories", cluster_key, {"category": category, "duplicates": removed_images})
+
+        # Mise à jour du DataFrame
+        self.df["categories"] = self.df["path"].map(categories_mapping)
 
         # Supprimer les doublons du DataFrame
         if duplicates_to_remove:
             print(f"Suppression de {len(duplicates_to_remove)} doublons du DataFrame final")
             self.df = self.df[~self.df["path"].isin(duplicates_to_remove)]
 
+        self.checkpoints.save("categories", self.df)
         return self.df
 
     def pipeline(self, starting_time):
@@ -223,7 +311,7 @@ class CategoriesManager(EmbeddingsManager):
         categories_time = time.time() - starting_time
         #print(tabulate(self.df, headers="keys", tablefmt="psql"))
         print(f"Temps de recherche des catégories : {categories_time:.2f} secondes")
+        self.profiler.add_summary("clip_batches", self.batch_scheduler.report())
 
         self.dataframe_manager.df = self.df
-        print(f"ETAPE 4 - Copie des images triées :\n")
-        self.dataframe_manager.save_to_csv(self.directory + ".csv")
\ No newline at end of file
+        return self.df
\ No newline at end of file
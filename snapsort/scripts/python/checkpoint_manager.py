@@ -0,0 +1,131 @@
+import os
+import json
+import shutil
+import pickle
+import hashlib
+
+
+class CheckpointManager:
+    def __init__(self, checkpoint_directory=None, resume=False, inputs=None):
+        """
+        Sauvegarde sur disque des résultats de chaque étape du pipeline, pour pouvoir reprendre un tri interrompu.
+
+        :param checkpoint_directory: Dossier des checkpoints (None pour désactiver les checkpoints).
+        :param resume: Reprendre depuis les checkpoints existants au lieu de repartir de zéro.
+        :param inputs: Liste des fichiers d'entrée, pour vérifier que la reprise porte sur les mêmes images.
+        """
+        self.checkpoint_directory = checkpoint_directory
+        self.inputs_fingerprint = self._get_inputs_fingerprint(inputs)
+        self.state = {"inputs": self.inputs_fingerprint, "completed": []}
+
+        if not self.enabled:
+            return
+
+        state = self._load_state()
+        if resume and state is not None and state.get("inputs") == self.inputs_fingerprint:
+            self.state = state
+            print(f"Reprise depuis les checkpoints : étapes terminées {self.state['completed']}")
+        else:
+            if resume:
+                print("Aucun checkpoint utilisable pour ces images, le tri repart de zéro.")
+            self.clear()
+        os.makedirs(self.checkpoint_directory, exist_ok=True)
+        self._save_state()
+
+    @property
+    def enabled(self):
+        return self.checkpoint_directory is not None
+
+    def is_completed(self, stage):
+        return stage in self.state["completed"]
+
+    def save(self, stage, data):
+        """
+        Sauvegarde le résultat complet d'une étape et la marque comme terminée.
+        """
+        if not self.enabled:
+            return
+        self._write(os.path.join(self.checkpoint_directory, f"{stage}.pkl"), data)
+        if stage not in self.state["completed"]:
+            self.state["completed"].append(stage)
+        self._save_state()
+        # Les résultats partiels de l'étape ne servent plus
+        shutil.rmtree(self._get_partial_directory(stage), ignore_errors=True)
+
+    def load(self, stage):
+        with open(os.path.join(self.checkpoint_directory, f"{stage}.pkl"), "rb") as f:
+            return pickle.load(f)
+
+    def save_partial(self, stage, key, data):
+        """
+        Sauvegarde le résultat d'un lot (jour, cluster...) à l'intérieur d'une étape non terminée.
+        """
+        if not self.enabled:
+            return
+        partial_directory = self._get_partial_directory(stage)
+        os.makedirs(partial_directory, exist_ok=True)
+        file_name = hashlib.md5(str(key).encode("utf-8")).hexdigest() + ".pkl"
+        self._write(os.path.join(partial_directory, file_name), (key, data))
+
+    def load_partial(self, stage):
+        """
+        :return: Dictionnaire {clé du lot : résultat} des lots déjà terminés de l'étape.
+        """
+        partials = {}
+        if not self.enabled:
+            return partials
+        partial_directory = self._get_partial_directory(stage)
+        if not os.path.isdir(partial_directory):
+            return partials
+        for file_name in os.listdir(partial_directory):
+            if not file_name.endswith(".pkl"):
+                continue
+            with open(os.path.join(partial_directory, file_name), "rb") as f:
+                key, data = pickle.load(f)
+            partials[key] = data
+        if partials:
+            print(f"Reprise de l'étape {stage} : {len(partials)} lots déjà terminés")
+        return partials
+
+    def clear(self):
+        if self.enabled and os.path.exists(self.checkpoint_directory):
+            shutil.rmtree(self.checkpoint_directory)
+        self.state = {"inputs": self.inputs_fingerprint, "completed": []}
+
+    def _get_partial_directory(self, stage):
+        return os.path.join(self.checkpoint_directory, f"{stage}_partial")
+
+    def _write(self, path, data):
+        # Écriture dans un fichier temporaire puis renommage : un checkpoint n'est jamais à moitié écrit
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    def _save_state(self):
+        state_path = os.path.join(self.checkpoint_directory, "state.json")
+        temp_path = state_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(temp_path, state_path)
+
+    def _load_state(self):
+        state_path = os.path.join(self.checkpoint_directory, "state.json")
+        if not os.path.exists(state_path):
+            return None
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _get_inputs_fingerprint(self, inputs):
+        if inputs is None:
+            return None
+        fingerprint = hashlib.md5()
+        for path in sorted(inputs):
+            size = os.path.getsize(path) if os.path.exists(path) else -1
+            fingerprint.update(f"{os.path.basename(path)}:{size}\n".encode("utf-8"))
+        return fingerprint.hexdigest()
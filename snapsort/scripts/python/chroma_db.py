@@ -1,41 +1,389 @@
 from contextlib import closing
+from itertools import islice
 import sqlite3
 from langchain_ollama import OllamaEmbeddings
 from langchain_chroma import Chroma
 import shutil
+import uuid
 import os
 
+from functions import get_timestamp
+
+# Marqueur de la migration des filtres de recherche (date_timestamp et country), dans les métadonnées de la collection
+FILTERS_BACKFILLED_KEY = "snapsort:filters_backfilled"
+
+# Paramètres HNSW : clé des métadonnées (Chroma < 0.6 et création de collection) -> clé de la configuration (Chroma >= 0.6)
+HNSW_CONFIGURATION_KEYS = {"hnsw:space": "space", "hnsw:M": "max_neighbors", "hnsw:construction_ef": "ef_construction", "hnsw:search_ef": "ef_search"}
+HNSW_DEFAULTS = {"hnsw:space": "l2", "hnsw:M": 16, "hnsw:construction_ef": 100, "hnsw:search_ef": 10}
+HNSW_BUILD_KEYS = ("hnsw:space", "hnsw:M", "hnsw:construction_ef")
+
+# Jointure des requêtes sqlite sur les métadonnées (alias m) : seulement les documents d'une collection (la base peut en contenir d'autres)
+COLLECTION_DOCUMENTS_SQL = ("join embeddings e on e.id = m.id "
+                            "join segments s on s.id = e.segment_id and s.collection = ? ")
+
 class ChromaDatabase:
-    def __init__(self, db_name="db_photos", db_collection_name="photo_collection", embedding_model="mxbai-embed-large", path="/scripts/database", new=False):
+    def __init__(self, db_name="db_photos", db_collection_name="photo_collection", embedding_model="mxbai-embed-large", path="/scripts/database", new=False,
+                 embedding_function=None, hnsw_space=None, hnsw_m=None, hnsw_construction_ef=None, hnsw_search_ef=None, ollama_pool=None):
+        """
+        :param embedding_function: Fonction d'embedding à utiliser à la place d'Ollama (ex : embedding local déterministe des benchmarks).
+        :param ollama_pool: OllamaPool sur lequel répartir les embeddings (None pour le serveur Ollama par défaut).
+        :param hnsw_space: Métrique de l'index ("l2", "cosine" ou "ip"). Les seuils de get_similar_pictures sont prévus pour "l2".
+        Pour chaque paramètre HNSW, None garde la valeur de la collection existante (valeur par défaut de Chroma pour une nouvelle collection, l2 pour la métrique).
+        :param hnsw_m: Nombre de voisins de chaque nœud du graphe HNSW (None : valeur par défaut de Chroma, 16).
+        :param hnsw_construction_ef: Taille de la liste de candidats à la construction de l'index (None : 100).
+        :param hnsw_search_ef: Taille de la liste de candidats à la recherche, plus grande = meilleur rappel mais plus lent (None : 10).
+        La métrique, M et construction_ef ne s'appliquent qu'à la création de la collection, ou après rebuild ;
+        search_ef peut être changé sur une collection existante.
+        """
         if new : 
             self._clean_db(db_name=db_name)
         self.db_name = db_name
         self.db_collection_name = db_collection_name
-        os.makedirs(path, exist_ok=True)
         current_path = os.getcwd()
+        os.makedirs(f"{current_path}{path}", exist_ok=True)
         print(f"{current_path}{path}/{self.db_name}")
         path_to_db = f"{current_path}{path}/{self.db_name}"
         self.path = path_to_db
 
-        self.db = Chroma(collection_name=self.db_collection_name,
-                        embedding_function=OllamaEmbeddings(model=embedding_model),
-                        persist_directory=f"{self.path}")
+        # Paramètres demandés, None pour ceux à ne pas changer
+        self.hnsw_params = {"hnsw:space": hnsw_space, "hnsw:M": hnsw_m, "hnsw:construction_ef": hnsw_construction_ef,
+                            "hnsw:search_ef": hnsw_search_ef}
+
+        if embedding_function is not None:
+            self.embedding_function = embedding_function
+        elif ollama_pool is not None:
+            self.embedding_function = ollama_pool.get_embeddings(embedding_model)
+        else:
+            self.embedding_function = OllamaEmbeddings(model=embedding_model)
+        self.db = self._open_collection()
+        self._create_content_hash_index()
+        self._backfill_filter_metadata()
 
     def get_processed_files(self):
         db_file = f"{self.path}/chroma.sqlite3"
         with closing(sqlite3.connect(db_file)) as connection:
-            sql = "select string_value from embedding_metadata where key='image_name'"
-            rows = connection.execute(sql).fetchall()
+            sql = ("select m.string_value from embedding_metadata m " + COLLECTION_DOCUMENTS_SQL +
+                   "where m.key='image_name'")
+            rows = connection.execute(sql, (self._collection_id(),)).fetchall()
             processed_files = [file_name for file_name, in rows]
         return processed_files
+
+    def get_processed_hashes(self):
+        # Dictionnaire {empreinte du contenu : noms des images déjà analysées avec ce contenu}
+        db_file = f"{self.path}/chroma.sqlite3"
+        with closing(sqlite3.connect(db_file)) as connection:
+            sql = ("select m.string_value, n.string_value from embedding_metadata m "
+                   "join embedding_metadata n on n.id = m.id and n.key='image_name' " + COLLECTION_DOCUMENTS_SQL +
+                   "where m.key='content_hash'")
+            rows = connection.execute(sql, (self._collection_id(),)).fetchall()
+        processed_hashes = {}
+        for content_hash, file_name in rows:
+            processed_hashes.setdefault(content_hash, set()).add(file_name)
+        return processed_hashes
+
+    def get_unhashed_files(self):
+        # Images ajoutées avant l'ajout de l'empreinte : on ne peut les identifier que par leur nom
+        db_file = f"{self.path}/chroma.sqlite3"
+        with closing(sqlite3.connect(db_file)) as connection:
+            sql = ("select m.string_value from embedding_metadata m " + COLLECTION_DOCUMENTS_SQL +
+                   "where m.key='image_name' and m.id not in (select id from embedding_metadata where key='content_hash')")
+            rows = connection.execute(sql, (self._collection_id(),)).fetchall()
+        return {file_name for file_name, in rows}
+
+    def copy_document(self, content_hash, image_path):
+        # Copie la description d'une image déjà analysée (même contenu) sous un nouveau nom, sans nouvel appel au LLM
+        existing = self.db.get(where={"content_hash": content_hash}, limit=1, include=["documents", "metadatas", "embeddings"])
+        if not existing["ids"]:
+            return None
+
+        metadata = dict(existing["metadatas"][0])
+        metadata["image_name"] = os.path.basename(image_path)
+        metadata["image_path"] = image_path
+        doc_id = str(uuid.uuid4())
+        self.db._collection.add(ids=[doc_id],
+                                embeddings=[existing["embeddings"][0]],
+                                metadatas=[metadata],
+                                documents=[existing["documents"][0]])
+        return doc_id
     
-    def get_similar_pictures(self, prompt, threshold=2, k=100, printing=True):
-        results = self.db.similarity_search_with_score(prompt, k=k)
-        filtered = [(doc, score) for doc, score in results if score <= threshold] # Métrique L2 donc on cherche le plus petit score 
+    def get_similar_pictures(self, prompt, threshold=2, k=100, printing=True, filters=None, page_size=25):
+        # Les résultats arrivent par pages : la recherche s'arrête dès qu'un score dépasse le seuil
+        filtered = list(islice(self.iter_similar_pictures(prompt, threshold, filters, page_size), k))
         if printing :
             for doc, score in filtered:
                 print(f"{doc.metadata['image_name']} (score: {score:.3f})")
         return filtered
 
+    def search_page(self, prompt, threshold=2, filters=None, cursor=0, page_size=25):
+        """
+        Une page de résultats de la recherche.
+
+        :param cursor: Position de la page dans les résultats (0 pour la première page, sinon le curseur renvoyé par la page précédente).
+        :return: Liste de tuples (document, score) et curseur de la page suivante (None s'il n'y a plus de résultats sous le seuil).
+        """
+        cursor = cursor or 0
+        page = list(islice(self.iter_similar_pictures(prompt, threshold, filters, page_size, cursor), page_size))
+        next_cursor = cursor + len(page) if len(page) == page_size else None
+        return page, next_cursor
+
+    def iter_similar_pictures(self, prompt, threshold=2, filters=None, page_size=25, offset=0):
+        """
+        Parcours des images les plus proches du prompt, par score croissant (métrique L2 donc on cherche le plus petit score).
+        Le filtre est appliqué par Chroma avant la recherche des plus proches voisins : seules les images correspondantes sont comparées.
+
+        :param filters: Clause where de Chroma, voir build_filters.
+        :param page_size: Nombre de résultats demandés à Chroma à la première requête (doublé à chaque requête suivante).
+        :param offset: Nombre de résultats à sauter.
+        """
+        # Le prompt n'est transformé en embedding qu'une seule fois pour toutes les pages
+        embedding = self.db.embeddings.embed_query(prompt)
+        seen_ids = set()
+        k = offset + page_size
+        while True:
+            results = self.db.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=filters)
+            for doc, score in results[offset:]:
+                if score > threshold:
+                    return
+                if doc.id in seen_ids:
+                    continue
+                seen_ids.add(doc.id)
+                yield doc, score
+            if len(results) < k:
+                return
+            offset = k
+            k *= 2
+
+    @staticmethod
+    def build_filters(date_from=None, date_to=None, localisation=None, country=None, generated_with=None):
+        """
+        Clause where de Chroma à partir des filtres de recherche.
+
+        :param date_from: Date de début incluse, au format AAAA-MM-JJ.
+        :param date_to: Date de fin incluse, au format AAAA-MM-JJ.
+        :param localisation: Lieu exact ("cc, région, ville") ou liste de lieux.
+        :param country: Code du pays (ex : "CA") ou liste de codes.
+        :param generated_with: Modèle ayant généré la description.
+        :return: Dictionnaire where, ou None sans filtre.
+        """
+        conditions = []
+        for date, operator, shift in ((date_from, "$gte", 0), (date_to, "$lt", 24 * 3600)):
+            if not date:
+                continue
+            timestamp = get_timestamp(date, "%Y-%m-%d")
+            if timestamp is None:
+                raise ValueError(f"Date invalide : {date} (format attendu : AAAA-MM-JJ)")
+            # La date de fin est incluse : on compare au début du jour suivant
+            conditions.append({"date_timestamp": {operator: timestamp + shift}})
+        for key, value in (("localisation", localisation), ("country", country), ("generated_with", generated_with)):
+            if isinstance(value, (list, tuple, set)):
+                conditions.append({key: {"$in": list(value)}})
+            elif value:
+                conditions.append({key: value})
+
+        if not conditions:
+            return None
+        if len(conditions) == 1:
+            return conditions[0]
+        return {"$and": conditions}
+
+    def _create_content_hash_index(self):
+        db_file = f"{self.path}/chroma.sqlite3"
+        if not os.path.exists(db_file):
+            return
+        with closing(sqlite3.connect(db_file)) as connection:
+            sql = "create index if not exists embedding_metadata_content_hash on embedding_metadata (string_value) where key='content_hash'"
+            connection.execute(sql)
+            connection.commit()
+
+    def _backfill_filter_metadata(self):
+        # Images ajoutées avant les filtres de recherche : ajout de la date numérique et du pays à partir des métadonnées existantes.
+        # Migration faite une seule fois par collection (marqueur dans les métadonnées de la collection)
+        if (self.db._collection.metadata or {}).get(FILTERS_BACKFILLED_KEY):
+            return
+        db_file = f"{self.path}/chroma.sqlite3"
+        if not os.path.exists(db_file):
+            return
+        with closing(sqlite3.connect(db_file)) as connection:
+            sql = ("select e.embedding_id, m.key, m.string_value from embedding_metadata m " + COLLECTION_DOCUMENTS_SQL +
+                   "where (m.key='date_time' and m.id not in (select id from embedding_metadata where key='date_timestamp')) "
+                   "or (m.key='localisation' and m.id not in (select id from embedding_metadata where key='country'))")
+            rows = connection.execute(sql, (self._collection_id(),)).fetchall()
+
+        updates = {}
+        for doc_id, key, value in rows:
+            if key == "date_time":
+                timestamp = get_timestamp(value)
+                if timestamp is not None:
+                    updates.setdefault(doc_id, {})["date_timestamp"] = timestamp
+            elif value:
+                updates.setdefault(doc_id, {})["country"] = value.split(", ")[0]
+
+        if updates:
+            ids = list(updates)
+            self.db._collection.update(ids=ids, metadatas=[updates[doc_id] for doc_id in ids])
+            print(f"Filtres de recherche ajoutés à {len(ids)} images existantes")
+        # Les dates illisibles ne seront pas relues à la prochaine ouverture
+        self._update_collection_metadata(self.db._collection, {FILTERS_BACKFILLED_KEY: True})
+
+    def get_size(self):
+        # Taille sur le disque de la base (sqlite et fichiers des index HNSW), en octets
+        size = 0
+        for root, _, files in os.walk(self.path):
+            for file_name in files:
+                size += os.path.getsize(os.path.join(root, file_name))
+        return size
+
+    def get_orphaned_ids(self, batch_size=1000):
+        # Documents dont l'image n'existe plus (les documents sans chemin d'image sont gardés)
+        orphaned_ids = []
+        for batch in self._iter_collection(self.db._collection, ["metadatas"], batch_size):
+            orphaned_ids += [doc_id for doc_id, metadata in zip(batch["ids"], batch["metadatas"]) if not self._image_exists(metadata)]
+        return orphaned_ids
+
+    def rebuild(self, batch_size=1000):
+        """
+        Reconstruit la collection avec les paramètres HNSW demandés (ceux de la collection pour les autres) et sans les documents dont l'image n'existe plus.
+        Les embeddings stockés sont recopiés tels quels : aucun nouvel appel au modèle d'embedding.
+        L'index HNSW est construit à neuf (les suppressions successives laissent des nœuds inutilisés) et le fichier sqlite est compacté.
+
+        :param batch_size: Nombre de documents recopiés à la fois.
+        :return: Dictionnaire du nombre de documents gardés et supprimés.
+        """
+        client = self.db._client
+        rebuild_name = f"{self.db_collection_name}_rebuild"
+        existing_names = {collection if isinstance(collection, str) else collection.name for collection in client.list_collections()}
+        if rebuild_name in existing_names:
+            if self.db._collection.count() == 0:
+                # Reconstruction précédente interrompue après la suppression de la collection : la copie est complète
+                print(f"Reprise de la reconstruction interrompue de {self.db_collection_name}")
+                client.delete_collection(self.db_collection_name)
+                client.get_collection(rebuild_name).modify(name=self.db_collection_name)
+                self.db = self._open_collection()
+            else:
+                client.delete_collection(rebuild_name)
+
+        # La métrique et les paramètres non précisés sont ceux de la collection actuelle
+        metadata = self._get_build_metadata(self._get_hnsw_params(self.db._collection))
+        rebuilt = client.create_collection(rebuild_name, metadata=metadata, embedding_function=None)
+        kept, removed = 0, 0
+        for batch in self._iter_collection(self.db._collection, ["documents", "metadatas", "embeddings"], batch_size):
+            indices = [i for i, metadata in enumerate(batch["metadatas"]) if self._image_exists(metadata)]
+            removed += len(batch["ids"]) - len(indices)
+            if not indices:
+                continue
+            rebuilt.add(ids=[batch["ids"][i] for i in indices],
+                        embeddings=[batch["embeddings"][i] for i in indices],
+                        metadatas=[batch["metadatas"][i] for i in indices],
+                        documents=[batch["documents"][i] for i in indices])
+            kept += len(indices)
+
+        client.delete_collection(self.db_collection_name)
+        rebuilt.modify(name=self.db_collection_name)
+        self.db = self._open_collection()
+        self._remove_unused_segments()
+        self._vacuum()
+        print(f"Collection reconstruite : {kept} documents gardés, {removed} documents sans image supprimés")
+        return {"kept": kept, "removed": removed}
+
+    def _open_collection(self):
+        if not self._collection_exists():
+            return Chroma(collection_name=self.db_collection_name, embedding_function=self.embedding_function,
+                          persist_directory=f"{self.path}", collection_metadata=self._get_build_metadata())
+
+        # Collection existante : la métrique et les paramètres de construction sont ceux de sa création
+        db = Chroma(collection_name=self.db_collection_name, embedding_function=self.embedding_function, persist_directory=f"{self.path}")
+        stored = self._get_hnsw_params(db._collection)
+        if any(self.hnsw_params[key] is not None and stored[key] != self.hnsw_params[key] for key in HNSW_BUILD_KEYS):
+            print("Les paramètres de construction de l'index HNSW diffèrent de ceux de la collection : ils seront appliqués par rebuild")
+        search_ef = self.hnsw_params["hnsw:search_ef"]
+        if search_ef is not None and stored["hnsw:search_ef"] != search_ef:
+            try:
+                db._collection.modify(configuration={"hnsw": {"ef_search": search_ef}})
+                # Collection créée avec des métadonnées hnsw:* : l'ancienne clé est mise à jour aussi, pour que les deux valeurs concordent
+                legacy_metadata = "hnsw:search_ef" in (db._collection.metadata or {})
+            except TypeError:
+                # Chroma < 0.6 : ef_search est lu dans les métadonnées de la collection
+                legacy_metadata = True
+            if legacy_metadata:
+                self._update_collection_metadata(db._collection, {"hnsw:search_ef": search_ef})
+        return db
+
+    def _get_build_metadata(self, stored=None):
+        # Métadonnées de création de la collection : paramètres demandés, sinon ceux de la collection reconstruite.
+        # Une nouvelle collection n'a pas d'images à migrer
+        metadata = {"hnsw:space": HNSW_DEFAULTS["hnsw:space"], **(stored or {})}
+        metadata.update({key: value for key, value in self.hnsw_params.items() if value is not None})
+        metadata = {key: value for key, value in metadata.items() if value is not None}
+        metadata[FILTERS_BACKFILLED_KEY] = True
+        return metadata
+
+    @staticmethod
+    def _get_hnsw_params(collection):
+        # Paramètres HNSW d'une collection existante : configuration (Chroma >= 0.6), sinon métadonnées
+        configuration = getattr(collection, "configuration", None)
+        hnsw = configuration.get("hnsw") if isinstance(configuration, dict) else None
+        if hnsw:
+            return {key: hnsw.get(name) for key, name in HNSW_CONFIGURATION_KEYS.items()}
+        metadata = collection.metadata or {}
+        return {key: metadata.get(key, default) for key, default in HNSW_DEFAULTS.items()}
+
+    @staticmethod
+    def _update_collection_metadata(collection, values):
+        # modify remplace toutes les métadonnées de la collection : les autres clés sont recopiées.
+        # La métrique n'est pas recopiée, Chroma refuse toute métadonnée hnsw:space après la création
+        metadata = {key: value for key, value in (collection.metadata or {}).items() if key != "hnsw:space"}
+        collection.modify(metadata={**metadata, **values})
+
+    def _collection_id(self):
+        return str(self.db._collection.id)
+
+    def _collection_exists(self):
+        db_file = f"{self.path}/chroma.sqlite3"
+        if not os.path.exists(db_file):
+            return False
+        with closing(sqlite3.connect(db_file)) as connection:
+            try:
+                row = connection.execute("select id from collections where name=?", (self.db_collection_name,)).fetchone()
+            except sqlite3.OperationalError:
+                return False
+        return row is not None
+
+    def _iter_collection(self, collection, include, batch_size):
+        offset = 0
+        while True:
+            batch = collection.get(include=include, limit=batch_size, offset=offset)
+            if not batch["ids"]:
+                return
+            yield batch
+            offset += len(batch["ids"])
+
+    @staticmethod
+    def _image_exists(metadata):
+        image_path = (metadata or {}).get("image_path")
+        return image_path is None or os.path.exists(image_path)
+
+    def _remove_unused_segments(self):
+        # Dossiers des index HNSW des collections supprimées (certaines versions de Chroma ne les suppriment pas)
+        db_file = f"{self.path}/chroma.sqlite3"
+        with closing(sqlite3.connect(db_file)) as connection:
+            try:
+                segment_ids = {segment_id for segment_id, in connection.execute("select id from segments").fetchall()}
+            except sqlite3.OperationalError:
+                return
+        for name in os.listdir(self.path):
+            directory = os.path.join(self.path, name)
+            if not os.path.isdir(directory) or name in segment_ids:
+                continue
+            try:
+                uuid.UUID(name)
+            except ValueError:
+                continue
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _vacuum(self):
+        db_file = f"{self.path}/chroma.sqlite3"
+        with closing(sqlite3.connect(db_file)) as connection:
+            connection.execute("vacuum")
+
     def _clean_db(self, db_name):
         shutil.rmtree(f"./{db_name}")
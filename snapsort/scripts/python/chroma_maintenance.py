@@ -0,0 +1,68 @@
+import os
+import json
+import time
+import random
+
+import numpy as np
+
+from functions import set_parser_chroma_maintenance
+from chroma_db import ChromaDatabase
+from retrieval_benchmark import percentiles
+
+
+def sample_query_embeddings(database, count, seed):
+    # Embeddings de documents de la collection utilisés comme requêtes : pas d'appel au modèle d'embedding
+    total = database.db._collection.count()
+    if total == 0:
+        return []
+    rng = random.Random(seed)
+    embeddings = []
+    for offset in rng.sample(range(total), min(count, total)):
+        batch = database.db._collection.get(include=["embeddings"], limit=1, offset=offset)
+        embeddings.append(np.asarray(batch["embeddings"][0], dtype=np.float32).tolist())
+    return embeddings
+
+
+def measure_latency(database, query_embeddings, k):
+    latencies = []
+    for embedding in query_embeddings:
+        start = time.perf_counter()
+        database.db.similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+        latencies.append(time.perf_counter() - start)
+    return percentiles(latencies) if latencies else None
+
+
+def report(database, query_embeddings, k):
+    return {"documents": database.db._collection.count(), "size_mb": database.get_size() / 2**20,
+            "latency": measure_latency(database, query_embeddings, k)}
+
+
+def print_report(name, result):
+    latency = result["latency"]
+    latency_text = "" if latency is None else f", p50 {latency['p50_ms']:.2f} ms, p95 {latency['p95_ms']:.2f} ms"
+    print(f"{name} : {result['documents']} documents, {result['size_mb']:.1f} Mo{latency_text}")
+
+
+if __name__ == "__main__":
+    args = set_parser_chroma_maintenance()
+    database = ChromaDatabase(db_name=args.db_name, hnsw_space=args.hnsw_space, hnsw_m=args.hnsw_m,
+                              hnsw_construction_ef=args.hnsw_construction_ef, hnsw_search_ef=args.hnsw_search_ef)
+
+    query_embeddings = sample_query_embeddings(database, args.queries, args.seed)
+    results = {"before": report(database, query_embeddings, args.k)}
+    print_report("Avant", results["before"])
+
+    if args.dry_run:
+        orphaned_ids = database.get_orphaned_ids()
+        results["orphaned"] = len(orphaned_ids)
+        print(f"{len(orphaned_ids)} documents dont l'image n'existe plus")
+    else:
+        results.update(database.rebuild())
+        results["after"] = report(database, query_embeddings, args.k)
+        print_report("Après", results["after"])
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Résultats écrits dans {args.output}")
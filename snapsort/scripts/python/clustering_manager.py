@@ -1,167 +1,162 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
+import pandas as pd
 
 from embeddings_manager import EmbeddingsManager
+from embedding_store import EmbeddingStore
+from checkpoint_manager import CheckpointManager
+from pipeline_profiler import PipelineProfiler
 
 class ClusteringManager(EmbeddingsManager):
-    def __init__(self, df):
-        super().__init__()
+    def __init__(self, df, checkpoints=None, workers=1, profiler=None, clip_model=None, clip_processor=None,
+                 embedding_dtype="float32", pca_dimensions=None, batch_scheduler=None):
+        super().__init__(clip_model=clip_model, clip_processor=clip_processor, batch_scheduler=batch_scheduler)
         self.df = df
+        self.checkpoints = checkpoints if checkpoints is not None else CheckpointManager()
+        self.workers = workers
+        self.profiler = profiler if profiler is not None else PipelineProfiler()
+        self.embedding_dtype = embedding_dtype
+        self.pca_dimensions = pca_dimensions
+        self.embedding_store = None
 
-    def day_sorting(self):
-        days = {}
-        no_date_images = []
-        for index, row in self.df.iterrows():
-            date = row["date_time"]
-            if date:
-                day = date.split(" ")[0]
-                if day not in days:
-                    days[day] = []
-                days[day].append(row["path"])
-            else:
-                no_date_images.append(row["path"])
-                
+    def __getstate__(self):
+        # Le stockage des embeddings, le profileur (verrous, profil en cours) et les checkpoints ne sont pas envoyés aux processus de calcul
+        state = super().__getstate__()
+        state["embedding_store"] = None
+        state["profiler"] = None
+        state["checkpoints"] = None
+        return state
+
+    def day_sorting(self, max_bucket_size=500):
+        """
+        Regroupe les images par jour de prise de vue, dans l'ordre chronologique.
+        Les images sans date sont triées par date de modification du fichier et découpées en lots de max_bucket_size images.
+
+        :return: Dictionnaire {jour : liste des chemins triés par heure de prise de vue}
+        """
+        # Date EXIF au format "AAAA:MM:JJ HH:MM:SS" : le jour sert de clé, l'horodatage d'ordre de tri.
+        # Une date illisible (ex : "0000:00:00 00:00:00") est traitée comme une image sans date
+        dates = self.df["date_time"].fillna("").astype(str)
+        timestamps = pd.to_datetime(dates, format="%Y:%m:%d %H:%M:%S", errors="coerce")
+        has_date = timestamps.notna()
+
+        dated = pd.DataFrame({
+            "path": self.df["path"],
+            "day": dates.str.split(" ", n=1).str[0],
+            "timestamp": timestamps
+        })[has_date]
+        dated = dated.sort_values(["day", "timestamp"], kind="stable", na_position="last")
+        days = {day: paths.tolist() for day, paths in dated.groupby("day", sort=False)["path"]}
+
+        no_date_images = self.df.loc[~has_date, "path"].tolist()
         if no_date_images:
-            days["no_date"] = no_date_images
+            mtimes = np.array([self._get_mtime(path) for path in no_date_images])
+            no_date_images = [no_date_images[i] for i in np.argsort(mtimes, kind="stable")]
+            for chunk_index, start in enumerate(range(0, len(no_date_images), max_bucket_size)):
+                bucket = "no_date" if chunk_index == 0 else f"no_date_{chunk_index + 1}"
+                days[bucket] = no_date_images[start:start + max_bucket_size]
             print(f"Images sans date trouvées: {len(no_date_images)}")
         
         return days
 
-    def days_embedding(self, days_dict):
+    def _get_mtime(self, path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0.0
+
+    def days_embedding(self, days_dict, batch_size=None):
+        """
+        :return: Dictionnaire {jour : (liste des chemins, tableau des embeddings)}
+        """
         embeddings_dict = {}
         total_images = sum(len(images) for images in days_dict.values())
         image_counter = 0
+        # Jours déjà traités lors d'une exécution interrompue
+        done_days = self.checkpoints.load_partial("embeddings")
         for day, images in days_dict.items():
-            # Génération des embeddings pour chaque image
-            embeddings = self.image_embedding(images)
+            if day in done_days:
+                image_counter += len(images)
+                if done_days[day] is not None:
+                    embeddings_dict[day] = done_days[day]
+                continue
+
+            # Génération des embeddings pour chaque image, par lots pour borner la mémoire (taille choisie par le BatchScheduler)
+            # Les images illisibles sont sautées : chaque embedding est associé au chemin de l'image dont il provient
+            embeddings, encoded_paths = self.batched_image_embedding(paths=images, batch_size=batch_size, return_paths=True)
             
             if embeddings is None:
+                self.checkpoints.save_partial("embeddings", day, None)
                 continue
                 
-            embeddings_dict[day] = []
             for i, image in enumerate(images):
                 image_counter += 1
                 print(f"Etape [1/4] : [{image_counter}/{total_images}]")
-                if i < len(embeddings):  # Protection contre les indices hors limites
-                    embeddings_dict[day].append({
-                        'path': image,
-                        'embedding': embeddings[i]
-                    })
+            embeddings_dict[day] = (encoded_paths, embeddings)
+            self.checkpoints.save_partial("embeddings", day, embeddings_dict[day])
         return embeddings_dict
 
-    def neighbors_similarity_clustering(self, embeddings_dict, threshold, n_neighbors=3):
+    def neighbors_similarity_clustering(self, embedding_store, threshold, n_neighbors=3):
         clusters_by_day = {}
         self.global_cluster_id = 0
 
-        total_images = sum(len(images) for images in embeddings_dict.values())
+        total_images = len(embedding_store.paths)
         last_number = 1
-        for day, image_list in embeddings_dict.items():
-            clusters = self._cluster_day_embeddings(image_list, threshold, n_neighbors, total_images, last_number)
-            last_number += len(image_list)
+        if self.workers > 1 and len(embedding_store.day_ranges) > 1:
+            # Les jours sont indépendants : un jour par tâche, puis renumérotation des clusters dans l'ordre des jours
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = {}
+                for day in embedding_store.day_ranges:
+                    paths, embeddings = embedding_store.get_day(day)
+                    futures[day] = executor.submit(cluster_day, paths, embeddings, threshold, n_neighbors, total_images, last_number)
+                    last_number += len(paths)
+                for day, future in futures.items():
+                    clusters_by_day[day] = self._renumber_clusters(future.result())
+            return clusters_by_day
+
+        for day in embedding_store.day_ranges:
+            paths, embeddings = embedding_store.get_day(day)
+            clusters = cluster_day(paths, embeddings, threshold, n_neighbors, total_images, last_number, self.global_cluster_id)
+            self.global_cluster_id += sum(cluster_name != "others" for cluster_name in clusters)
+            last_number += len(paths)
             clusters_by_day[day] = clusters
 
         return clusters_by_day
 
-    def _cluster_day_embeddings(self, image_list, threshold, n_neighbors, total_images, last_number):
-        paths = [image['path'] for image in image_list]
-        embeddings = np.array([image['embedding'] for image in image_list])
-        N = len(paths)
-
-        clusters = {}
-        current_cluster = []        # Liste pour stocker les images du cluster en cours
-        already_clustered = set()   # Ensemble pour suivre les images déjà clustérisées
-        all_outliers = []
-        last_index_added = -1
-
-        for i in range(N):
-            print(f"Etape [2/4] : [{i + last_number}/{total_images}]\n")
-            current_img = paths[i]
-            #print(f"Traitement de l'image {current_img}")
-
-            end_idx = min(i + n_neighbors + 1, N)
-            checking_paths = paths[i:end_idx]
-            checking_embeddings = embeddings[i:end_idx]
-
-            photos, outliers = self._photos_to_add(checking_paths, checking_embeddings, threshold)
-            if outliers:
-                all_outliers.append(outliers[0])
-
-            if photos and current_img not in already_clustered:
-                current_cluster.append(current_img)
-                already_clustered.add(current_img)
-                last_index_added = max(last_index_added, i)
-                print(f"Ajout de {current_img} au cluster {self.global_cluster_id}")
-
-            for elem in photos:
-                path = elem[0]
-                idx = paths.index(path)  # Trouver l'index de l'image dans la liste des chemins
-                if path not in already_clustered:
-                    current_cluster.append(path)
-                    already_clustered.add(path)
-                    last_index_added = max(last_index_added, idx) # Mettre à jour l'index du dernier ajout
-                    print(f"Ajout de {path} au cluster {self.global_cluster_id}")
-
-            # Si aucune image similaire trouvée et qu'on a un cluster en cours, finaliser le cluster
-            if not photos and current_cluster and i >= last_index_added:
-                self._finalize_cluster(clusters, current_cluster)
-
-        # Traitement du dernier cluster s'il n'est pas vide
-        if current_cluster:
-            self._finalize_cluster(clusters, current_cluster)
-
-        # Collecter les images non clustérisées dans "others"
-        other_cluster = self._find_unclustered_images(paths, clusters)
-        if other_cluster:
-            clusters["others"] = other_cluster
-
-        return clusters
-
-    def _photos_to_add(self, paths, embeddings, threshold):
-        photos = []
-        outliers = []
-        all_photos = False
-
-        # Vérification de la similarité entre la première et la dernière image pour accepter un outlier si nécessaire
-        sim_furthest = np.dot(embeddings[0], embeddings[-1])
-        if sim_furthest >= threshold:
-            all_photos = True
-
-        for i in range(1, len(paths)):
-            sim = np.dot(embeddings[0], embeddings[i])
-            #print(f"Les photos {paths[0]} et {paths[i]} ont une similarité de {sim:.2f}")
-            if sim >= threshold:
-                photos.append((paths[i], sim))
-            elif all_photos:
-                photos.append((paths[i], sim))
-                outliers.append(paths[i])
-
-        return photos, outliers
-
-    def _finalize_cluster(self, clusters, cluster_images):
-        cluster_name = f"cluster_{self.global_cluster_id}"
-        clusters[cluster_name] = cluster_images.copy()
-        cluster_images.clear()
-        self.global_cluster_id += 1
-
-    def _find_unclustered_images(self, paths, clusters):
-        other_cluster = []
-        for path in paths:
-            found = False
-            for cluster_name, cluster_images in clusters.items():
-                if path in cluster_images:
-                    found = True
-                    break
-            if not found:
-                other_cluster.append(path)
-
-        return other_cluster
+    def _renumber_clusters(self, day_clusters):
+        # Même numérotation que l'exécution en série : les clusters se suivent d'un jour à l'autre
+        renumbered = {}
+        for cluster_name, cluster_images in day_clusters.items():
+            if cluster_name == "others":
+                renumbered[cluster_name] = cluster_images
+            else:
+                renumbered[f"cluster_{self.global_cluster_id}"] = cluster_images
+                self.global_cluster_id += 1
+        return renumbered
 
     def perform_neighbors_clustering(self, threshold, n_neighbors=3):
         #print("CLUSTERING DES IMAGES PAR VOISINS PROCHES...")
         days_dict = self.day_sorting()
-        print(f"ETAPE 1 - Génération des embeddings : \n")
-        embeddings_dict = self.days_embedding(days_dict)
-        print(f"ETAPE 2 - Clustering des images :\n")
-        clusters = self.neighbors_similarity_clustering(embeddings_dict, threshold, n_neighbors)
+        if self.checkpoints.is_completed("embeddings"):
+            # Les embeddings servent aussi aux scores de catégorie, même si le clustering est déjà fait
+            self.embedding_store = self.checkpoints.load("embeddings")
+        if self.checkpoints.is_completed("clusters"):
+            clusters = self.checkpoints.load("clusters")
+        else:
+            print(f"ETAPE 1 - Génération des embeddings : \n")
+            if self.embedding_store is None:
+                with self.profiler.stage("embeddings"):
+                    embeddings_dict = self.days_embedding(days_dict)
+                    store = EmbeddingStore(dtype=self.embedding_dtype, pca_dimensions=self.pca_dimensions)
+                    self.embedding_store = store.build(embeddings_dict, threshold=threshold, n_neighbors=n_neighbors)
+                    del embeddings_dict
+                self.checkpoints.save("embeddings", self.embedding_store)
+            print(f"ETAPE 2 - Clustering des images :\n")
+            with self.profiler.stage("clustering"):
+                clusters = self.neighbors_similarity_clustering(self.embedding_store, threshold, n_neighbors)
+            self.checkpoints.save("clusters", clusters)
         
         # Mise à jour du DataFrame avec les informations de cluster
         cluster_mapping = {}
@@ -172,4 +167,103 @@ class ClusteringManager(EmbeddingsManager):
         
         self.df['cluster'] = self.df['path'].map(cluster_mapping)
         
-        return self.df, clusters
\ No newline at end of file
+        return self.df, clusters
+
+
+def cluster_day(paths, embeddings, threshold, n_neighbors, total_images, last_number, first_cluster_id=0):
+    """
+    Clustering des images d'un jour par similarité avec leurs n_neighbors voisines suivantes.
+    Fonction du module : les processus de calcul ne reçoivent que les chemins et les embeddings du jour.
+
+    :param first_cluster_id: Numéro du premier cluster du jour.
+    :return: Dictionnaire {nom du cluster : liste des chemins}, avec les images isolées dans "others"
+    """
+    N = len(paths)
+
+    clusters = {}
+    current_cluster = []        # Liste pour stocker les images du cluster en cours
+    already_clustered = set()   # Ensemble pour suivre les images déjà clustérisées
+    all_outliers = []
+    last_index_added = -1
+    cluster_id = first_cluster_id
+
+    for i in range(N):
+        print(f"Etape [2/4] : [{i + last_number}/{total_images}]\n")
+        current_img = paths[i]
+        #print(f"Traitement de l'image {current_img}")
+
+        end_idx = min(i + n_neighbors + 1, N)
+        checking_paths = paths[i:end_idx]
+        checking_embeddings = embeddings[i:end_idx]
+
+        photos, outliers = photos_to_add(checking_paths, checking_embeddings, threshold)
+        if outliers:
+            all_outliers.append(outliers[0])
+
+        if photos and current_img not in already_clustered:
+            current_cluster.append(current_img)
+            already_clustered.add(current_img)
+            last_index_added = max(last_index_added, i)
+            print(f"Ajout de {current_img} au cluster {cluster_id}")
+
+        for elem in photos:
+            path = elem[0]
+            idx = paths.index(path)  # Trouver l'index de l'image dans la liste des chemins
+            if path not in already_clustered:
+                current_cluster.append(path)
+                already_clustered.add(path)
+                last_index_added = max(last_index_added, idx) # Mettre à jour l'index du dernier ajout
+                print(f"Ajout de {path} au cluster {cluster_id}")
+
+        # Si aucune image similaire trouvée et qu'on a un cluster en cours, finaliser le cluster
+        if not photos and current_cluster and i >= last_index_added:
+            clusters[f"cluster_{cluster_id}"] = current_cluster.copy()
+            current_cluster.clear()
+            cluster_id += 1
+
+    # Traitement du dernier cluster s'il n'est pas vide
+    if current_cluster:
+        clusters[f"cluster_{cluster_id}"] = current_cluster.copy()
+
+    # Collecter les images non clustérisées dans "others"
+    other_cluster = find_unclustered_images(paths, clusters)
+    if other_cluster:
+        clusters["others"] = other_cluster
+
+    return clusters
+
+
+def photos_to_add(paths, embeddings, threshold):
+    photos = []
+    outliers = []
+    all_photos = False
+
+    # Vérification de la similarité entre la première et la dernière image pour accepter un outlier si nécessaire
+    sim_furthest = np.dot(embeddings[0], embeddings[-1])
+    if sim_furthest >= threshold:
+        all_photos = True
+
+    for i in range(1, len(paths)):
+        sim = np.dot(embeddings[0], embeddings[i])
+        #print(f"Les photos {paths[0]} et {paths[i]} ont une similarité de {sim:.2f}")
+        if sim >= threshold:
+            photos.append((paths[i], sim))
+        elif all_photos:
+            photos.append((paths[i], sim))
+            outliers.append(paths[i])
+
+    return photos, outliers
+
+
+def find_unclustered_images(paths, clusters):
+    other_cluster = []
+    for path in paths:
+        found = False
+        for cluster_name, cluster_images in clusters.items():
+            if path in cluster_images:
+                found = True
+                break
+        if not found:
+            other_cluster.append(path)
+
+    return other_cluster
@@ -0,0 +1,98 @@
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def get_unique_path(path, used_paths):
+    """
+    Premier chemin libre parmi path, puis nom_1.ext, nom_2.ext... ; le chemin retenu est ajouté à used_paths.
+    """
+    name, extension = os.path.splitext(path)
+    candidate, index = path, 0
+    while candidate in used_paths:
+        index += 1
+        candidate = f"{name}_{index}{extension}"
+    used_paths.add(candidate)
+    return candidate
+
+
+class CopyManager:
+    def __init__(self, max_workers=8, step_label="Etape [4/4]"):
+        """
+        Copie parallèle des images vers les albums.
+
+        :param max_workers: Nombre de copies simultanées (à adapter au support : ~4 pour un disque dur, 8-16 pour un SSD ou un NAS).
+        :param step_label: Préfixe des messages de progression.
+        """
+        self.max_workers = max_workers
+        self.step_label = step_label
+        self._lock = threading.Lock()
+        self._done = 0
+
+    def copy_groups(self, groups, destination_directory):
+        """
+        Copie chaque groupe d'images dans son dossier.
+
+        :param groups: Dictionnaire {sous-dossier : liste des chemins des images sources}
+        :param destination_directory: Dossier racine des albums
+        :return: Dictionnaire du nombre d'images copiées, déjà présentes, introuvables et en erreur
+        """
+        tasks = []
+        for folder, source_paths in groups.items():
+            category_folder = os.path.join(destination_directory, folder)
+            os.makedirs(category_folder, exist_ok=True)
+            used_paths = set()
+            for source_path in source_paths:
+                # Images de même nom venant de sous-dossiers différents : suffixe _1, _2... (dans l'ordre des images, stable d'un lancement à l'autre)
+                tasks.append((source_path, get_unique_path(os.path.join(category_folder, os.path.basename(source_path)), used_paths)))
+
+        print(f"{len(groups)} dossiers créés, {len(tasks)} images à copier")
+
+        stats = {"copied": 0, "skipped": 0, "missing": 0, "errors": 0}
+        self._done = 0
+        total = len(tasks)
+        progress_step = max(1, total // 100)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for status in executor.map(lambda task: self._copy_task(task, total, progress_step), tasks):
+                stats[status] += 1
+
+        print(f"Copie terminée : {stats['copied']} copiées, {stats['skipped']} déjà présentes, "
+              f"{stats['missing']} introuvables, {stats['errors']} erreurs")
+        return stats
+
+    def copy_file(self, source_path, destination_path):
+        if not os.path.exists(source_path):
+            print(f"Fichier non trouvé : {source_path}")
+            return "missing"
+
+        if self.is_same_file(source_path, destination_path):
+            return "skipped"
+
+        try:
+            # copy2 conserve la date de modification, ce qui permet de reconnaître la copie au prochain lancement
+            shutil.copy2(source_path, destination_path)
+        except OSError as e:
+            print(f"Erreur lors de la copie de {source_path} : {e}")
+            return "errors"
+        return "copied"
+
+    def is_same_file(self, source_path, destination_path):
+        try:
+            source_stat = os.stat(source_path)
+            destination_stat = os.stat(destination_path)
+        except OSError:
+            return False
+        # Tolérance de 2 secondes sur la date : certains systèmes de fichiers (FAT, SMB) arrondissent les dates
+        return (source_stat.st_size == destination_stat.st_size
+                and abs(source_stat.st_mtime - destination_stat.st_mtime) <= 2)
+
+    def _copy_task(self, task, total, progress_step):
+        status = self.copy_file(*task)
+        with self._lock:
+            self._done += 1
+            done = self._done
+        if done % progress_step == 0 or done == total:
+            print(f"{self.step_label} : [{done}/{total}]")
+        return status
@@ -6,13 +6,18 @@ import pandas as pd
 from image_details import ImageDetails  
 
 class DataframeCompletion:
-    def __init__(self, image_paths):
+    def __init__(self, image_paths, df=None, known_metadata=None):
         self.image_paths = image_paths
-        self.df = self.create_df()
+        # known_metadata : {chemin : (date_time, latitude, longitude)} déjà lus à l'import
+        self.known_metadata = known_metadata if known_metadata is not None else {}
+        self.df = df if df is not None else self.create_df()
 
     def create_df(self):
         image_list = []
         for path in self.image_paths:
+            if path in self.known_metadata:
+                image_list.append((os.path.basename(path), path, *self.known_metadata[path]))
+                continue
             image = ImageDetails(path)
             image_list.append((image.image_name, path, image.date_time, image.latitude, image.longitude))
 
@@ -23,6 +28,22 @@ class DataframeCompletion:
     def get_dataframe(self):
         return self.df
 
+    def save(self, file_path="result.parquet", output_format="parquet"):
+        try:
+            if output_format == "parquet":
+                self.df.to_parquet(file_path, index=False)
+            elif output_format == "feather":
+                self.df.reset_index(drop=True).to_feather(file_path)
+            elif output_format == "csv":
+                self.df.to_csv(file_path, index=False)
+            else:
+                print(f"Format de sauvegarde inconnu : {output_format}")
+                return
+            print(f"DataFrame sauvegardé sous {file_path}")
+
+        except Exception as e:
+            print(f"Erreur lors de la sauvegarde : {e}")
+
     def save_to_csv(self, file_path="result.csv"):
         try:
             self.df.to_csv(file_path, index=False)
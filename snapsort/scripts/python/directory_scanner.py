@@ -0,0 +1,118 @@
+import os
+import json
+from collections import namedtuple
+
+# Index du dossier de copie : empreintes et EXIF enregistrés à l'import, réutilisés par llm_call.py
+SCAN_INDEX_PATH = "./scripts/database/scan_index.json"
+
+ImageEntry = namedtuple("ImageEntry", ["path", "size", "mtime"])
+
+# Premiers octets des formats d'image acceptés (JPEG, PNG, GIF)
+IMAGE_SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a")
+
+
+def has_image_signature(path):
+    try:
+        with open(path, "rb") as f:
+            header = f.read(12)
+    except OSError:
+        return False
+    if header.startswith(IMAGE_SIGNATURES):
+        return True
+    # WEBP : conteneur RIFF
+    return header[:4] == b"RIFF" and header[8:12] == b"WEBP"
+
+
+def scan_images(directory, allowed_extensions=None, recursive=True, check_magic=True):
+    """
+    Parcours paresseux d'un dossier (et de ses sous-dossiers) avec os.scandir.
+    Les fichiers sont renvoyés au fur et à mesure : les étapes suivantes peuvent commencer avant la fin du parcours.
+
+    :param allowed_extensions: Ensemble des extensions acceptées (None pour tous les fichiers).
+    :param recursive: Parcourir aussi les sous-dossiers.
+    :param check_magic: Vérifier les premiers octets du fichier en plus de l'extension.
+    :return: Générateur de ImageEntry (chemin, taille, date de modification).
+    """
+    directories = [directory]
+    while directories:
+        current_directory = directories.pop()
+        try:
+            with os.scandir(current_directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            directories.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                    if allowed_extensions is not None and os.path.splitext(entry.name)[1].lower() not in allowed_extensions:
+                        continue
+                    if check_magic and not has_image_signature(entry.path):
+                        continue
+                    # Le stat de DirEntry est mis en cache : pas d'appel système supplémentaire sous Windows
+                    stat = entry.stat()
+                    yield ImageEntry(entry.path, stat.st_size, stat.st_mtime)
+        except OSError as e:
+            print(f"Impossible de parcourir le dossier {current_directory} : {e}")
+
+
+class DirectoryScanner:
+    def __init__(self, directory, allowed_extensions=None, recursive=True, check_magic=True, index_path=None):
+        """
+        Parcours d'un dossier avec un index persistant {chemin : taille, date de modification, informations calculées}.
+        L'index permet de savoir quels fichiers ont changé depuis le dernier parcours, et de réutiliser ce qui a déjà été calculé pour les autres (ex : empreinte du contenu).
+
+        :param index_path: Fichier json de l'index (None pour un index en mémoire seulement).
+        """
+        self.directory = directory
+        self.allowed_extensions = allowed_extensions
+        self.recursive = recursive
+        self.check_magic = check_magic
+        self.index_path = index_path
+        self.index = self._load_index()
+        self.entries = {}   # chemin -> ImageEntry du dernier parcours
+
+    def scan(self):
+        for entry in scan_images(self.directory, self.allowed_extensions, self.recursive, self.check_magic):
+            self.entries[entry.path] = entry
+            yield entry
+
+    def scan_changes(self):
+        # Seulement les fichiers nouveaux ou modifiés depuis le dernier parcours
+        for entry in self.scan():
+            if not self.is_unchanged(entry):
+                yield entry
+
+    def is_unchanged(self, entry):
+        info = self.index.get(entry.path)
+        return info is not None and info["size"] == entry.size and info["mtime"] == entry.mtime
+
+    def get_info(self, entry, key):
+        # Information calculée lors d'un précédent parcours, si le fichier n'a pas changé depuis
+        if not self.is_unchanged(entry):
+            return None
+        return self.index[entry.path].get(key)
+
+    def update(self, entry, **info):
+        if not self.is_unchanged(entry):
+            self.index[entry.path] = {"size": entry.size, "mtime": entry.mtime}
+        self.index[entry.path].update(info)
+
+    def save_index(self):
+        if self.index_path is None:
+            return
+        os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(temp_path, self.index_path)
+
+    def _load_index(self):
+        if self.index_path is None or not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Index du dossier illisible, il sera reconstruit : {e}")
+            return {}
@@ -0,0 +1,158 @@
+import sys
+
+import numpy as np
+
+
+class EmbeddingStore:
+    def __init__(self, dtype="float32", pca_dimensions=None, pca_sample_size=20000, reference_size=2000, seed=0):
+        """
+        Embeddings CLIP de toutes les images dans un seul tableau contigu, avec un index parallèle des chemins.
+        Les images d'un même jour occupent des lignes consécutives.
+
+        :param dtype: "float32" ou "float16" (moitié moins de mémoire).
+        :param pca_dimensions: Nombre de dimensions gardées après projection (ex : 128 ou 256), None pour garder les 768 dimensions.
+        :param pca_sample_size: Nombre maximal d'embeddings utilisés pour apprendre la projection.
+        :param reference_size: Nombre d'embeddings gardés en pleine précision pour vérifier la précision des scores de catégorie.
+        """
+        self.dtype = np.dtype(dtype)
+        self.pca_dimensions = pca_dimensions
+        self.pca_sample_size = pca_sample_size
+        self.reference_size = reference_size
+        self.seed = seed
+
+        self.paths = []         # Chemin de chaque ligne (chaînes internées)
+        self.index = {}         # chemin -> ligne
+        self.day_ranges = {}    # jour -> (première ligne, dernière ligne + 1)
+        self.vectors = None
+        self.components = None  # Matrice de projection (dimensions gardées x 768)
+        self.accuracy = {}
+        self._reference_rows = None
+        self._reference_vectors = None
+
+    @property
+    def is_compressed(self):
+        return self.components is not None or self.dtype != np.float32
+
+    @property
+    def nbytes(self):
+        return 0 if self.vectors is None else self.vectors.nbytes
+
+    def build(self, days_embeddings, threshold=None, n_neighbors=3):
+        """
+        Construit le tableau à partir des embeddings de chaque jour.
+
+        :param days_embeddings: Dictionnaire {jour : (liste des chemins, tableau des embeddings normalisés)}.
+        :param threshold: Seuil de similarité du clustering ; si le stockage est compressé, les décisions du clustering
+                          sont comparées à celles obtenues en pleine précision.
+        :param n_neighbors: Nombre de voisins comparés par le clustering.
+        """
+        chunks = []
+        start = 0
+        for day, (paths, embeddings) in days_embeddings.items():
+            for path in paths:
+                path = sys.intern(path)
+                self.index[path] = len(self.paths)
+                self.paths.append(path)
+            chunks.append(np.asarray(embeddings, dtype=np.float32))
+            self.day_ranges[day] = (start, start + len(paths))
+            start += len(paths)
+
+        full_vectors = np.concatenate(chunks) if chunks else np.zeros((0, 0), dtype=np.float32)
+        del chunks
+
+        if self.pca_dimensions is not None:
+            self._fit_projection(full_vectors)
+        self.vectors = np.ascontiguousarray(self._compress(full_vectors))
+
+        if self.is_compressed and len(full_vectors):
+            rng = np.random.default_rng(self.seed)
+            self._reference_rows = np.sort(rng.choice(len(full_vectors), min(self.reference_size, len(full_vectors)), replace=False))
+            self._reference_vectors = full_vectors[self._reference_rows].copy()
+            if threshold is not None:
+                self.accuracy["clustering"] = self.check_clustering_accuracy(full_vectors, threshold, n_neighbors)
+
+        print(f"Embeddings : {len(self.paths)} images, {self.nbytes / 2**20:.1f} Mo ({self.vectors.shape[1] if self.vectors.ndim == 2 else 0} dimensions, {self.dtype.name})")
+        return self
+
+    def get(self, paths):
+        """
+        :return: Embeddings (float32) des chemins demandés, ou None si l'un d'eux n'est pas dans le stockage.
+        """
+        rows = [self.index.get(path) for path in paths]
+        if any(row is None for row in rows):
+            return None
+        return self.vectors[rows].astype(np.float32)
+
+    def get_day(self, day):
+        start, end = self.day_ranges[day]
+        return self.paths[start:end], self.vectors[start:end].astype(np.float32)
+
+    def project(self, vectors):
+        """
+        Projette d'autres vecteurs (ex : embeddings texte des catégories) dans l'espace du stockage,
+        pour que leurs produits scalaires avec les images restent comparables.
+        """
+        return self._compress(np.asarray(vectors, dtype=np.float32)).astype(np.float32)
+
+    def check_clustering_accuracy(self, full_vectors, threshold, n_neighbors=3):
+        """
+        Compare les similarités utilisées par le clustering (chaque image et ses n_neighbors suivantes du même jour)
+        en pleine précision et dans le stockage compressé.
+
+        :return: Dictionnaire : erreur moyenne et maximale sur la similarité, proportion de décisions (>= threshold) identiques.
+        """
+        compressed = self.vectors.astype(np.float32)
+        errors, same_decisions = [], []
+        for start, end in self.day_ranges.values():
+            for offset in range(1, n_neighbors + 1):
+                if end - start <= offset:
+                    continue
+                full = np.einsum("ij,ij->i", full_vectors[start:end - offset], full_vectors[start + offset:end])
+                reduced = np.einsum("ij,ij->i", compressed[start:end - offset], compressed[start + offset:end])
+                errors.append(np.abs(full - reduced))
+                same_decisions.append((full >= threshold) == (reduced >= threshold))
+        if not errors:
+            return {}
+
+        errors = np.concatenate(errors)
+        same_decisions = np.concatenate(same_decisions)
+        result = {"pairs": int(len(errors)), "mean_error": float(errors.mean()), "max_error": float(errors.max()),
+                  "same_decision_rate": float(same_decisions.mean())}
+        print(f"Précision du clustering sur les embeddings compressés : {100 * result['same_decision_rate']:.2f} % de décisions identiques, "
+              f"erreur moyenne {result['mean_error']:.4f} (max {result['max_error']:.4f}) sur {result['pairs']} paires")
+        return result
+
+    def check_category_accuracy(self, category_embeddings):
+        """
+        Compare la catégorie la plus proche de chaque image de référence en pleine précision et dans le stockage compressé.
+
+        :return: Dictionnaire : proportion de catégories identiques et erreur moyenne sur les similarités.
+        """
+        if self._reference_rows is None:
+            return {}
+        category_embeddings = np.asarray(category_embeddings, dtype=np.float32)
+        full = self._reference_vectors @ category_embeddings.T
+        reduced = self.vectors[self._reference_rows].astype(np.float32) @ self.project(category_embeddings).T
+        result = {"images": int(len(full)), "same_category_rate": float((full.argmax(axis=1) == reduced.argmax(axis=1)).mean()),
+                  "mean_error": float(np.abs(full - reduced).mean())}
+        print(f"Précision des scores de catégorie sur les embeddings compressés : {100 * result['same_category_rate']:.2f} % de catégories identiques, "
+              f"erreur moyenne {result['mean_error']:.4f} sur {result['images']} images")
+        self.accuracy["categories"] = result
+        return result
+
+    def _fit_projection(self, full_vectors):
+        if len(full_vectors) <= self.pca_dimensions:
+            print(f"Pas assez d'images ({len(full_vectors)}) pour une projection à {self.pca_dimensions} dimensions, dimensions conservées")
+            return
+        sample = full_vectors
+        if len(sample) > self.pca_sample_size:
+            rng = np.random.default_rng(self.seed)
+            sample = full_vectors[rng.choice(len(full_vectors), self.pca_sample_size, replace=False)]
+        # Projection sans centrage : les produits scalaires (et donc les seuils de similarité) sont conservés au mieux
+        _, _, vt = np.linalg.svd(sample, full_matrices=False)
+        self.components = np.ascontiguousarray(vt[:self.pca_dimensions])
+
+    def _compress(self, vectors):
+        if self.components is not None:
+            vectors = vectors @ self.components.T
+        return vectors.astype(self.dtype)
@@ -1,33 +1,167 @@
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+import numpy as np
 from PIL import Image
 import torch
 from transformers import CLIPProcessor, CLIPModel
 
+from pipeline_profiler import RssMonitor, get_available_memory
+
+
+CLIP_MODEL_NAME = "laion/CLIP-ViT-L-14-laion2B-s32B-b82K"
+
+# Estimation de départ de la mémoire par image (image décodée + activations de CLIP ViT-L), corrigée par les mesures
+DEFAULT_BYTES_PER_IMAGE = 64 * 2**20
+
+
+class BatchScheduler:
+    def __init__(self, device="cpu", memory_budget=None, initial_batch_size=8, min_batch_size=1, max_batch_size=128, min_speedup=1.1):
+        """
+        Choix de la taille des lots envoyés à CLIP, d'après un budget mémoire et la durée mesurée de chaque lot.
+        La taille double tant que le temps par image diminue d'au moins min_speedup et que la mémoire mesurée le permet,
+        et elle est divisée par deux en cas de manque de mémoire.
+
+        :param memory_budget: Mémoire (octets) utilisable par un lot. None : 80 % de la mémoire GPU libre, ou 25 % de la mémoire disponible sur CPU.
+        """
+        self.device = device
+        self.memory_budget = memory_budget if memory_budget is not None else self._default_memory_budget()
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.min_speedup = min_speedup
+        self.bytes_per_image = DEFAULT_BYTES_PER_IMAGE
+        self.batch_size = max(min_batch_size, min(initial_batch_size, self._memory_limit()))
+        self.growing = True
+        self.seconds_per_image = {}   # taille de lot -> meilleur temps par image mesuré
+        self.used_sizes = Counter()
+        self.backoffs = 0
+
+    def record(self, batch_size, seconds, memory_used):
+        # Mesure d'un lot réussi : mise à jour de l'estimation mémoire et de la taille des prochains lots
+        self.used_sizes[batch_size] += 1
+        if memory_used > 0:
+            self.bytes_per_image = max(self.bytes_per_image * 0.5, memory_used / batch_size)
+        per_image = seconds / batch_size
+        self.seconds_per_image[batch_size] = min(per_image, self.seconds_per_image.get(batch_size, per_image))
+
+        if self.growing and batch_size == self.batch_size:
+            previous = self.seconds_per_image.get(batch_size // 2)
+            if previous is not None and previous < per_image * self.min_speedup:
+                # Plus de gain à doubler : on garde la taille qui donne le meilleur temps par image
+                self.growing = False
+                self.batch_size = min(self.seconds_per_image, key=self.seconds_per_image.get)
+            else:
+                self.batch_size = min(batch_size * 2, self.max_batch_size)
+        self.batch_size = max(self.min_batch_size, min(self.batch_size, self._memory_limit()))
+
+    def backoff(self, batch_size):
+        """
+        Manque de mémoire pendant un lot : les lots suivants seront deux fois plus petits.
+
+        :return: False si la taille minimale est déjà atteinte (l'erreur doit alors être remontée).
+        """
+        if batch_size <= self.min_batch_size:
+            return False
+        self.backoffs += 1
+        self.growing = False
+        self.batch_size = max(self.min_batch_size, batch_size // 2)
+        self.bytes_per_image = max(self.bytes_per_image, self.memory_budget / batch_size)
+        print(f"Mémoire insuffisante pour un lot de {batch_size} images, passage à {self.batch_size}")
+        return True
+
+    def report(self):
+        report = {
+            "batch_size": self.batch_size,
+            "used_batch_sizes": {str(size): count for size, count in sorted(self.used_sizes.items())},
+            "backoffs": self.backoffs,
+            "memory_budget_bytes": int(self.memory_budget),
+            "bytes_per_image": int(self.bytes_per_image),
+        }
+        print(f"Lots CLIP : taille retenue {self.batch_size}, tailles utilisées {report['used_batch_sizes']}, "
+              f"{self.backoffs} réductions après manque de mémoire")
+        return report
+
+    def _memory_limit(self):
+        return max(1, int(self.memory_budget // self.bytes_per_image))
+
+    def _default_memory_budget(self):
+        if self.device == "cuda":
+            free, _ = torch.cuda.mem_get_info()
+            return 0.8 * free
+        available = get_available_memory()
+        return 0.25 * available if available is not None else 2 * 2**30
+
+
+def is_out_of_memory(error):
+    if isinstance(error, MemoryError):
+        return True
+    message = str(error).lower()
+    return isinstance(error, RuntimeError) and ("out of memory" in message or "can't allocate memory" in message)
+
 
 class EmbeddingsManager:
-    def __init__(self, clip_model=None, clip_processor=None):
+    def __init__(self, clip_model=None, clip_processor=None, batch_scheduler=None, memory_budget=None):
+        """
+        :param batch_scheduler: BatchScheduler partagé avec un autre EmbeddingsManager (la taille des lots apprise est conservée).
+        :param memory_budget: Mémoire (octets) utilisable par un lot d'images, None pour une valeur adaptée à la machine.
+        """
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        if clip_model is None:
-            self.clip_model = CLIPModel.from_pretrained("laion/CLIP-ViT-L-14-laion2B-s32B-b82K").to(self.device)
-        else:
-            self.clip_model = clip_model.to(self.device)
-        if clip_processor is None:
-            self.clip_processor = CLIPProcessor.from_pretrained("laion/CLIP-ViT-L-14-laion2B-s32B-b82K")
-        else:
-            self.clip_processor = clip_processor
-
-    def image_embedding(self, paths=None, images=None):
+        # Le modèle CLIP est chargé à la première utilisation
+        self._clip_model = clip_model.to(self.device) if clip_model is not None else None
+        self._clip_processor = clip_processor
+        self._batch_scheduler = batch_scheduler
+        self.memory_budget = memory_budget
+
+    @property
+    def batch_scheduler(self):
+        if self._batch_scheduler is None:
+            self._batch_scheduler = BatchScheduler(self.device, self.memory_budget)
+        return self._batch_scheduler
+
+    @property
+    def clip_model(self):
+        if self._clip_model is None:
+            self._clip_model = CLIPModel.from_pretrained(CLIP_MODEL_NAME).to(self.device)
+        return self._clip_model
+
+    @property
+    def clip_processor(self):
+        if self._clip_processor is None:
+            self._clip_processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+        return self._clip_processor
+
+    def load_model(self):
+        # Chargement immédiat du modèle et du processeur, sinon chargés à leur première utilisation
+        return self.clip_model, self.clip_processor
+
+    def __getstate__(self):
+        # Le modèle n'est pas copié vers les processus de calcul, il y est rechargé seulement si besoin
+        state = self.__dict__.copy()
+        state["_clip_model"] = None
+        state["_clip_processor"] = None
+        state["_batch_scheduler"] = None
+        return state
+
+    def image_embedding(self, paths=None, images=None, return_paths=False):
+        """
+        :param return_paths: Renvoyer aussi les chemins des images lisibles, dans l'ordre des embeddings (les images illisibles sont sautées).
+        :return: Tableau des embeddings (ou None si aucune image n'est lisible), et la liste des chemins avec return_paths.
+        """
+        loaded_paths = paths
         if images is None:
-            images = []
+            images, loaded_paths = [], []
             for path in paths:
                 try:
                     image = Image.open(path).convert("RGB")
                     images.append(image)
+                    loaded_paths.append(path)
                 except Exception as e:
                     print(f"Erreur lors du chargement de l'image {path}: {e}")
                     continue
 
             if not images:
-                return None
+                return (None, []) if return_paths else None
 
         # Prétraitement des images en batch
         image_inputs = self.clip_processor(images=images, return_tensors="pt", padding=True).to(self.device)
@@ -39,5 +173,66 @@ class EmbeddingsManager:
         image_embeddings = image_embeddings / image_embeddings.norm(p=2, dim=-1, keepdim=True)
         image_embeddings = image_embeddings.cpu().numpy()
 
-        return image_embeddings
+        return (image_embeddings, loaded_paths) if return_paths else image_embeddings
+
+    def batched_image_embedding(self, paths=None, images=None, batch_size=None, return_paths=False):
+        """
+        Embeddings d'un grand nombre d'images, par lots dont la taille est choisie par le BatchScheduler
+        (ou fixée par batch_size). Un lot qui manque de mémoire est recommencé avec une taille plus petite.
+
+        :param return_paths: Renvoyer aussi les chemins des images lisibles, alignés sur les embeddings.
+        :return: Tableau des embeddings des images lisibles, ou None (et la liste de leurs chemins avec return_paths).
+        """
+        items = paths if images is None else images
+        # Modèle chargé avant le BatchScheduler et le premier lot : le budget mémoire par défaut est lu une fois le modèle sur le GPU,
+        # et le chargement n'est compté ni dans la durée ni dans la mémoire du premier lot
+        self.load_model()
+        scheduler = self.batch_scheduler
+        batches = []
+        encoded_paths = []
+        start = 0
+        while start < len(items):
+            size = batch_size or scheduler.batch_size
+            batch = items[start:start + size]
+            if self.device == "cuda":
+                torch.cuda.reset_peak_memory_stats()
+                memory_before = torch.cuda.memory_allocated()
+            # Sur CPU : hausse de la mémoire résidente pendant ce lot seulement
+            rss_monitor = RssMonitor() if self.device != "cuda" else nullcontext()
+            batch_start = time.perf_counter()
+            try:
+                with rss_monitor:
+                    if images is not None:
+                        embeddings, batch_paths = self.image_embedding(images=batch), []
+                    else:
+                        embeddings, batch_paths = self.image_embedding(paths=batch, return_paths=True)
+            except (RuntimeError, MemoryError) as e:
+                if not is_out_of_memory(e) or batch_size is not None or not scheduler.backoff(len(batch)):
+                    raise
+                if self.device == "cuda":
+                    torch.cuda.empty_cache()
+                continue
+            seconds = time.perf_counter() - batch_start
+
+            if self.device == "cuda":
+                memory_used = torch.cuda.max_memory_allocated() - memory_before
+            else:
+                memory_used = rss_monitor.increase
+            if batch_size is None:
+                scheduler.record(len(batch), seconds, memory_used)
+
+            if embeddings is not None:
+                batches.append(embeddings)
+                encoded_paths += batch_paths
+            start += len(batch)
+
+        embeddings = np.concatenate(batches) if batches else None
+        return (embeddings, encoded_paths) if return_paths else embeddings
+
+    def text_embedding(self, texts):
+        text_inputs = self.clip_processor(text=texts, return_tensors="pt", padding=True).to(self.device)
+        with torch.no_grad():
+            text_embeddings = self.clip_model.get_text_features(**text_inputs)
+        text_embeddings = text_embeddings / text_embeddings.norm(p=2, dim=-1, keepdim=True)
+        return text_embeddings.cpu().numpy()
 
@@ -1,10 +1,18 @@
 import os
 import shutil
 import argparse
+import hashlib
+import calendar
+from datetime import datetime
 
-import pandas as pd
-import numpy as np
-import reverse_geocoder as rg
+from copy_manager import CopyManager
+from directory_scanner import scan_images
+from lazy_imports import lazy_import
+
+# Chargés à la première utilisation : les scripts qui n'utilisent que les parsers démarrent plus vite
+pd = lazy_import("pandas")
+geocoding = lazy_import("geocoding_service")
+ingest = lazy_import("ingest_manager")
 
 def set_parser_main():
     parser = argparse.ArgumentParser()
@@ -13,6 +21,16 @@ def set_parser_main():
     parser.add_argument('--directory', type=str, default="unsorted_images")
     parser.add_argument('--destination_directory', type=str, default="albums")
     parser.add_argument('--copy_directory', type=str, default="all_images")
+    parser.add_argument('--copy_workers', type=int, default=8)
+    parser.add_argument('--output_format', type=str, default="parquet", choices=["parquet", "feather", "csv"])
+    parser.add_argument('--resume', action='store_true', help="Reprendre un tri interrompu depuis le dernier checkpoint")
+    parser.add_argument('--workers', type=int, default=1, help="Nombre de processus pour le clustering et le nettoyage des clusters")
+    parser.add_argument('--watch', action='store_true', help="Import en continu : trie les photos au fur et à mesure de leur arrivée dans --directory")
+    parser.add_argument('--profile', action='store_true', help="Profil CPU et mémoire de chaque étape, écrit dans <directory>_profile")
+    parser.add_argument('--thumbnails', action='store_true', help="Génère les miniatures des images de --copy_directory pour la galerie")
+    parser.add_argument('--embedding_dtype', type=str, default="float32", choices=["float32", "float16"], help="Précision de stockage des embeddings CLIP")
+    parser.add_argument('--pca_dimensions', type=int, default=None, help="Projection des embeddings CLIP sur N dimensions (ex : 128 ou 256)")
+    parser.add_argument('--memory_budget_mb', type=int, default=None, help="Mémoire utilisable par un lot d'images CLIP (par défaut, selon la mémoire libre)")
 
     args = parser.parse_args()
 
@@ -22,24 +40,28 @@ def set_parser_main():
 
     return args
 
-def get_image_paths(directory, allowed_extensions=None):
+def get_image_paths(directory, allowed_extensions=None, recursive=True):
     if not allowed_extensions :
         allowed_extensions={".jpg", ".jpeg", ".png"}
-        image_paths = [os.path.join(directory, filename) for filename in os.listdir(directory) if os.path.splitext(filename)[1].lower() in allowed_extensions]
+        entries = scan_images(directory, allowed_extensions, recursive=recursive)
     elif allowed_extensions == "All":
-        image_paths = [os.path.join(directory, filename) for filename in os.listdir(directory) if os.path.isfile(os.path.join(directory, filename))]
+        entries = scan_images(directory, recursive=recursive, check_magic=False)
+    else:
+        entries = scan_images(directory, allowed_extensions, recursive=recursive)
+    image_paths = [entry.path for entry in entries]
     return image_paths
 
-def copy_all_images(source_directory, destination_directory):
-    if not os.path.exists(destination_directory):
-        os.makedirs(destination_directory)
-
-    image_paths = get_image_paths(source_directory, allowed_extensions="All")
+def get_file_hash(path, chunk_size=1024 * 1024):
+    # Empreinte du contenu du fichier : deux fichiers identiques ont le même hash, quel que soit leur nom
+    file_hash = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
 
-    for image_path in image_paths:
-        destination_path = os.path.join(destination_directory, os.path.basename(image_path))
-        shutil.copy(image_path, destination_path)
-        print(f"Copié : {image_path} -> {destination_path}")
+def copy_all_images(source_directory, destination_directory, max_workers=4):
+    # Copie au fur et à mesure du parcours (sous-dossiers compris) ; l'empreinte et l'EXIF sont calculés pendant la même lecture
+    return ingest.IngestManager(max_workers=max_workers).ingest(source_directory, destination_directory)
 
 def empty_directory(directory):
     if os.path.exists(directory):
@@ -51,6 +73,15 @@ def set_parser_image_retrieval():
 
     # Training arguments
     parser.add_argument('--prompt', type=str, default=" ")
+    parser.add_argument('--date_from', type=str, default=None, help="Seulement les photos prises à partir de cette date (AAAA-MM-JJ)")
+    parser.add_argument('--date_to', type=str, default=None, help="Seulement les photos prises jusqu'à cette date incluse (AAAA-MM-JJ)")
+    parser.add_argument('--localisation', type=str, nargs='*', default=None, help="Lieux exacts, au format 'cc, région, ville'")
+    parser.add_argument('--country', type=str, nargs='*', default=None, help="Codes des pays (ex : CA FR)")
+    parser.add_argument('--generated_with', type=str, default=None, help="Modèle ayant généré les descriptions")
+    parser.add_argument('--page_size', type=int, default=None, help="Nombre de résultats par page (sans cette option, tous les résultats sous le seuil)")
+    parser.add_argument('--cursor', type=int, default=0, help="Curseur de la page à récupérer, affiché avec la page précédente")
+    parser.add_argument('--hnsw_search_ef', type=int, default=None, help="Paramètre ef_search de l'index HNSW (meilleur rappel mais recherche plus lente)")
+    parser.add_argument('--profile', action='store_true', help="Profil CPU et mémoire de chaque étape, écrit dans scripts/temp_files/profile_image_retrieval")
 
     args = parser.parse_args()
 
@@ -65,6 +96,127 @@ def set_parser_fill_database():
 
     # Training arguments
     parser.add_argument('--copy_directory', type=str, default="..\photos_victor")
+    parser.add_argument('--profile', action='store_true', help="Profil CPU et mémoire de chaque étape, écrit dans scripts/temp_files/profile_llm_call")
+    parser.add_argument('--captioning', type=str, default="combined", choices=["combined", "separate"],
+                        help="combined : objets et description en un seul appel au modèle ; separate : un appel pour chacun")
+    parser.add_argument('--cascade', action='store_true',
+                        help="Les quasi-doublons reprennent la description de leur image représentative, les captures d'écran ne sont décrites que par CLIP")
+    parser.add_argument('--hnsw_space', type=str, default=None, choices=["l2", "cosine", "ip"],
+                        help="Métrique de l'index, à la création de la collection (l2 par défaut)")
+    parser.add_argument('--hnsw_m', type=int, default=None, help="Paramètre M de l'index HNSW, à la création de la collection")
+    parser.add_argument('--hnsw_construction_ef', type=int, default=None, help="Paramètre ef_construction de l'index HNSW, à la création de la collection")
+    parser.add_argument('--ollama_endpoints', type=str, nargs='*', default=None,
+                        help="Serveurs Ollama entre lesquels répartir les appels (ex : http://192.168.1.20:11434=2, le nombre après = est la limite de requêtes simultanées)")
+    parser.add_argument('--endpoint_concurrency', type=int, default=1, help="Limite de requêtes simultanées des serveurs qui n'en précisent pas")
+
+    args = parser.parse_args()
+
+    print("\n----------- Arguments --------------")
+    print(args)
+    print("------------------------------------")
+
+    return args
+
+def set_parser_import_time():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--module', type=str, default="image_retrieval")
+
+    args = parser.parse_args()
+
+    print("\n----------- Arguments --------------")
+    print(args)
+    print("------------------------------------")
+
+    return args
+
+def set_parser_thumbnails():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--directory', type=str, default="all_images")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 1024])
+    parser.add_argument('--image_format', type=str, default="WEBP", choices=["WEBP", "JPEG"])
+    parser.add_argument('--workers', type=int, default=None, help="Nombre de processus (par défaut, le nombre de cœurs)")
+
+    args = parser.parse_args()
+
+    print("\n----------- Arguments --------------")
+    print(args)
+    print("------------------------------------")
+
+    return args
+
+def set_parser_retrieval_benchmark():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--documents', type=int, default=10000, help="Nombre de documents synthétiques (ex : 10000 ou 100000)")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--dimensions', type=int, default=256, help="Dimensions de l'embedding local")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default="./scripts/temp_files/retrieval_benchmark.json")
+    parser.add_argument('--baseline', type=str, default=None, help="Résultats de référence : le script se termine en erreur en cas de régression")
+    parser.add_argument('--max_latency_regression', type=float, default=0.2, help="Hausse maximale du p95 par rapport à la référence (0.2 = 20 %%)")
+    parser.add_argument('--max_recall_drop', type=float, default=0.01)
+    parser.add_argument('--keep', action='store_true', help="Garder la collection pour les exécutions suivantes")
+    # Utilisés par le processus de mesure du démarrage à froid
+    parser.add_argument('--cold_start', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--db_name', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--query', type=str, default=None, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    print("\n----------- Arguments --------------")
+    print(args)
+    print("------------------------------------")
+
+    return args
+
+def set_parser_chroma_maintenance():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--db_name', type=str, default="db_photos")
+    parser.add_argument('--hnsw_space', type=str, default=None, choices=["l2", "cosine", "ip"],
+                        help="Métrique de la collection reconstruite (par défaut : celle de la collection actuelle)")
+    parser.add_argument('--hnsw_m', type=int, default=None, help="Nombre de voisins de chaque nœud du graphe HNSW")
+    parser.add_argument('--hnsw_construction_ef', type=int, default=None)
+    parser.add_argument('--hnsw_search_ef', type=int, default=None)
+    parser.add_argument('--queries', type=int, default=100, help="Nombre de requêtes pour mesurer la latence avant et après")
+    parser.add_argument('--k', type=int, default=25)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dry_run', action='store_true', help="Compter les documents dont l'image n'existe plus, sans reconstruire la collection")
+    parser.add_argument('--output', type=str, default=None, help="Fichier json des mesures")
+
+    args = parser.parse_args()
+
+    print("\n----------- Arguments --------------")
+    print(args)
+    print("------------------------------------")
+
+    return args
+
+def set_parser_ollama_stub():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--endpoints', type=int, default=3, help="Nombre de faux serveurs Ollama")
+    parser.add_argument('--endpoint_concurrency', type=int, default=1)
+    parser.add_argument('--images', type=int, default=24)
+    parser.add_argument('--delay', type=float, default=0.5, help="Durée simulée d'un appel au modèle, en secondes")
+    parser.add_argument('--embed_delay', type=float, default=0.05, help="Durée simulée d'un calcul d'embedding, en secondes")
+
+    args = parser.parse_args()
+
+    print("\n----------- Arguments --------------")
+    print(args)
+    print("------------------------------------")
+
+    return args
+
+def set_parser_quality_comparison():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--directory', type=str, default="unsorted_images")
+    parser.add_argument('--blur_threshold', type=float, default=50.0)
 
     args = parser.parse_args()
 
@@ -87,114 +239,93 @@ def get_season(month):
     else:
         return None
 
-def reverse_geocode_lib(lat, lon):
-    try:
-        result = rg.search((lat, lon), mode=1)[0]
-        return f"{result['name']}_{result['cc']}"
-    except Exception as e:
-        print(f"Erreur sur coords ({lat}, {lon}) : {e}")
+SEASONS = {month: get_season(month) for month in range(1, 13)}
+
+def get_timestamp(date_time, date_format="%Y:%m:%d %H:%M:%S"):
+    # Date EXIF -> nombre de secondes (sans fuseau horaire), pour les filtres de dates de Chroma qui ne comparent que des nombres
+    if not date_time:
         return None
-    
-def reverse_geocode_lib_large(lat, lon):
-    loc = []
     try:
-        result = rg.search((lat, lon), mode=1)[0]
-        country = result.get('cc', '')
-        region = result.get('admin1', '')
-        city = result.get('name', '')
-        return f"{country}, {region}, {city}"
-    except Exception as e:
-        print(f"Erreur sur coords ({lat}, {lon}) : {e}")
+        return calendar.timegm(datetime.strptime(str(date_time).strip(), date_format).timetuple())
+    except ValueError:
         return None
 
-def get_localisation(latitude, longitude, cache, type="small"):
-    lat = round(latitude, 3)
-    lon = round(longitude, 3)
-    coords = (lat, lon)
+_geocoding_service = None
 
-    if coords in cache:
-        localisation = cache[coords]
-    else:
-        if type == "small":
-            localisation = reverse_geocode_lib(*coords)
-        elif type == "large":
-            localisation = reverse_geocode_lib_large(*coords)
-        else:
-            localisation = None
-        cache[coords] = localisation
+def get_localisation(latitude, longitude, geocoding_service=None, type="small"):
+    # geocoding_service : GeocodingService partagé entre les appels (données GeoNames chargées une fois, cache disque des lieux).
+    # Un dictionnaire (ancien cache {(lat, lon) : lieu}) est encore accepté : il sert de cache devant un service partagé.
+    global _geocoding_service
+    if isinstance(geocoding_service, geocoding.GeocodingService):
+        return geocoding_service.localise(latitude, longitude, type)
 
-    return localisation
+    if _geocoding_service is None:
+        _geocoding_service = geocoding.GeocodingService()
+    if geocoding_service is None:
+        return _geocoding_service.localise(latitude, longitude, type)
 
+    coords = (round(latitude, 3), round(longitude, 3))
+    if coords not in geocoding_service:
+        geocoding_service[coords] = _geocoding_service.localise(latitude, longitude, type)
+    return geocoding_service[coords]
 
-def create_arborescence_from_csv(csv_file):
-    data = pd.read_csv(csv_file)
-    tree_paths = []
-    cache = {}  # Pour éviter les appels redondants
 
+def create_arborescence(data, geocoding_service=None):
     if 'date_time' not in data.columns or 'latitude' not in data.columns or 'longitude' not in data.columns or 'categories' not in data.columns:
-        print("Le CSV doit contenir les colonnes : date_time, latitude, longitude, categories.")
+        print("Le DataFrame doit contenir les colonnes : date_time, latitude, longitude, categories.")
         return None
 
-    for row in data.itertuples():
+    if geocoding_service is None:
+        geocoding_service = geocoding.GeocodingService()
 
-        date_time = row.date_time.split(":")
-        year = int(date_time[0])
-        month = int(date_time[1])
-        season = get_season(month)
+    # Date EXIF au format "AAAA:MM:JJ HH:MM:SS"
+    date_parts = data['date_time'].astype(str).str.extract(r"^(\d{4}):(\d{1,2})")
+    season = pd.to_numeric(date_parts[1]).map(SEASONS)
+    has_date = date_parts[0].notna() & season.notna()
+    # Chemins construits à partir de chaînes seulement : une colonne entièrement vide (aucune date, aucune coordonnée)
+    # est de type object et ne peut pas être concaténée à des chaînes avec pandas 3
+    base_path = date_parts[0].fillna("").astype(str) + "/" + season.fillna("").astype(str)
 
-        latitude = row.latitude
-        longitude = row.longitude
-        localisation = None
-        if not np.isnan(latitude) and not np.isnan(longitude):
-            localisation = get_localisation(latitude, longitude, cache)
+    # Une seule recherche KD-tree pour toutes les coordonnées distinctes du DataFrame
+    localisation = geocoding_service.localise_dataframe(data, type="small")
+    has_localisation = localisation.notna()
+    localisation = localisation.fillna("").astype(str)
 
-        category = row.categories
+    category = data['categories'].astype(str)
+    tree_paths = base_path + "/" + category
+    tree_paths = tree_paths.mask(has_localisation, base_path + "/" + localisation + "/" + category)
+    # Images sans date : rangées directement dans leur catégorie
+    tree_paths = tree_paths.where(has_date, category)
 
-        if localisation :
-            tree_path = f"{year}/{season}/{localisation}/{category}"
-        else:
-            tree_path = f"{year}/{season}/{category}"
+    return data.assign(folder_path=tree_paths)
 
-        tree_paths.append(tree_path)
 
-    data['folder_path'] = tree_paths
+def create_arborescence_from_csv(csv_file, geocoding_service=None):
+    data = create_arborescence(pd.read_csv(csv_file), geocoding_service)
+    if data is not None:
+        data.to_csv(csv_file, index=False)
 
-    data.to_csv(csv_file, index=False)
 
-
-def create_category_folders_from_csv(csv_file, destination_directory, arborescence=True):
+def create_category_folders(df, destination_directory, arborescence=True, max_workers=8):
 
     if arborescence:
         tree_struct = 'folder_path'
     else :
         tree_struct = 'categories'
 
-    df = pd.read_csv(csv_file)
-
     if tree_struct not in df.columns:
-        print(f"Le CSV ne contient pas de colonne {tree_struct}.")
+        print(f"Le DataFrame ne contient pas de colonne {tree_struct}.")
         return
 
     os.makedirs(destination_directory, exist_ok=True)
 
-    categories = df[tree_struct].dropna().unique().tolist()
+    # Un seul regroupement du DataFrame pour toutes les catégories
+    groups = {category: paths.tolist() for category, paths in df.dropna(subset=[tree_struct]).groupby(tree_struct, sort=False)['path']}
 
-    total_images = len(df['image_name'].unique())
-    i = 0
+    copy_manager = CopyManager(max_workers=max_workers)
+    return copy_manager.copy_groups(groups, destination_directory)
 
-    for category in categories:
-        category_folder = os.path.join(destination_directory, category)
-        print(f"Création du dossier pour la catégorie : {category_folder}")
-        os.makedirs(category_folder, exist_ok=True)
 
-        images_in_category = df[df[tree_struct] == category]['path'].tolist()
+def create_category_folders_from_csv(csv_file, destination_directory, arborescence=True, max_workers=8):
+    return create_category_folders(pd.read_csv(csv_file), destination_directory, arborescence, max_workers)
 
-        for source_path in images_in_category:
-            i += 1
-            if os.path.exists(source_path):
-                destination_path = os.path.join(category_folder, os.path.basename(source_path))
-                shutil.copy(source_path, destination_path)
-                print(f"Etape [4/4] : [{i}/{total_images}]")
-                #print(f"Copié : {source_path} -> {destination_path}")
-            else:
-                print(f"Fichier non trouvé : {source_path}")
\ No newline at end of file
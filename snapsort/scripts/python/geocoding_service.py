@@ -0,0 +1,116 @@
+import os
+import json
+
+import pandas as pd
+
+from lazy_imports import lazy_import
+
+# Les données GeoNames ne sont lues qu'à la première recherche
+rg = lazy_import("reverse_geocoder")
+
+CACHE_PATH = "./scripts/database/geocoding_cache.json"
+
+_geocoder = None
+
+
+def get_geocoder():
+    # Les données GeoNames (et le KD-tree) ne sont chargées qu'une seule fois par processus
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = rg.RGeocoder(mode=1, verbose=False)
+    return _geocoder
+
+
+class GeocodingService:
+    def __init__(self, cache_path=CACHE_PATH, precision=3):
+        """
+        Reverse geocoding par lot, avec un cache disque coordonnées -> lieu.
+
+        :param cache_path: Fichier json du cache persistant.
+        :param precision: Nombre de décimales gardées sur les coordonnées (3 décimales ~ 100 m).
+        """
+        self.cache_path = cache_path
+        self.precision = precision
+        self.cache = self._load_cache()
+
+    def search(self, coords):
+        """
+        Retourne le lieu de chaque coordonnée, en une seule requête KD-tree pour toutes les coordonnées absentes du cache.
+
+        :param coords: Liste de tuples (latitude, longitude) déjà arrondis.
+        :return: Liste de dictionnaires {'name', 'admin1', 'cc'} (None en cas d'erreur).
+        """
+        missing = [coord for coord in dict.fromkeys(coords) if coord not in self.cache]
+        if missing:
+            try:
+                results = get_geocoder().query(missing)
+                for coord, result in zip(missing, results):
+                    self.cache[coord] = {
+                        'name': result.get('name', ''),
+                        'admin1': result.get('admin1', ''),
+                        'cc': result.get('cc', '')
+                    }
+                self.save_cache()
+            except Exception as e:
+                print(f"Erreur lors du reverse geocoding de {len(missing)} coordonnées : {e}")
+
+        return [self.cache.get(coord) for coord in coords]
+
+    def localise(self, latitude, longitude, type="small"):
+        coords = (round(latitude, self.precision), round(longitude, self.precision))
+        place = self.search([coords])[0]
+        return self.format_place(place, type)
+
+    def localise_dataframe(self, df, type="small"):
+        """
+        Localisation de toutes les lignes d'un DataFrame possédant les colonnes latitude et longitude.
+        Les coordonnées arrondies sont dédupliquées avant la recherche.
+
+        :return: Série alignée sur l'index du DataFrame (None pour les images sans coordonnées).
+        """
+        coords = pd.DataFrame({
+            'lat': df['latitude'].astype(float).round(self.precision),
+            'lon': df['longitude'].astype(float).round(self.precision)
+        }, index=df.index).dropna()
+
+        unique_coords = coords.drop_duplicates()
+        places = self.search([(float(lat), float(lon)) for lat, lon in unique_coords.itertuples(index=False, name=None)])
+        mapping = pd.Series([self.format_place(place, type) for place in places],
+                            index=pd.MultiIndex.from_frame(unique_coords), dtype=object)
+
+        localisations = pd.Series(mapping.reindex(pd.MultiIndex.from_frame(coords)).to_numpy(), index=coords.index, dtype=object)
+        return localisations.reindex(df.index)
+
+    @staticmethod
+    def format_place(place, type="small"):
+        if not place:
+            return None
+        if type == "small":
+            return f"{place['name']}_{place['cc']}"
+        elif type == "large":
+            return f"{place['cc']}, {place['admin1']}, {place['name']}"
+        return None
+
+    def save_cache(self):
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        serialized = {f"{lat},{lon}": place for (lat, lon), place in self.cache.items()}
+        temp_path = self.cache_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(serialized, f, ensure_ascii=False)
+        os.replace(temp_path, self.cache_path)
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                serialized = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Cache de géolocalisation illisible, il sera reconstruit : {e}")
+            return {}
+
+        cache = {}
+        for key, place in serialized.items():
+            lat, lon = key.split(",")
+            cache[(float(lat), float(lon))] = place
+        return cache
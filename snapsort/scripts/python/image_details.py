@@ -1,15 +1,19 @@
 from PIL import Image
 import os
 
+from functions import get_timestamp
+
 class ImageDetails:
-    def __init__(self, image_path: str, detected_objects=None, description=None, generated_with=None):
+    def __init__(self, image_path: str, detected_objects=None, description=None, generated_with=None, content_hash=None, image=None):
         self.image_path = image_path
         self.image_name = self._get_image_name()
-        self.image = Image.open(self.image_path)
+        # image : image déjà ouverte (ex : en-tête lu pendant l'import), pour ne pas relire le fichier
+        self.image = image if image is not None else Image.open(self.image_path)
         self.date_time, self.latitude, self.longitude = self._extract_exif_data()
         self.detected_objects = detected_objects
         self.description = description
         self.generated_with = generated_with
+        self.content_hash = content_hash
 
     def __str__(self):
         retval = ''
@@ -31,11 +35,13 @@ class ImageDetails:
             'image_name': self.image_name,
             'image_path': self.image_path,
             'date_time': self.date_time,
+            'date_timestamp': get_timestamp(self.date_time),
             'latitude': self.latitude,
             'longitude': self.longitude,
             'detected_objects': self.get_detected_objects_text(),
             'description': self.description,
-            'generated_with': self.generated_with
+            'generated_with': self.generated_with,
+            'content_hash': self.content_hash
         }
 
         filtered_dict = self.filter_complex_metadata(dict)
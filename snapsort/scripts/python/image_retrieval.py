@@ -4,6 +4,7 @@ import os
 
 from functions import set_parser_image_retrieval
 from chroma_db import ChromaDatabase
+from pipeline_profiler import PipelineProfiler
 
 DIRECTORY_PATH = "./scripts/temp_files"
 
@@ -26,13 +27,23 @@ if __name__ == "__main__":
 
     prompt = args.prompt
     # prompt = "une randonnée avec des arbres jaunes et rouges"
-    database = ChromaDatabase()
+    profiler = PipelineProfiler(DIRECTORY_PATH + "/profile_image_retrieval" if args.profile else None)
+    with profiler.stage("database"):
+        database = ChromaDatabase(hnsw_search_ef=args.hnsw_search_ef)
 
     starting_time = time.time()
     
-    similar_images = database.get_similar_pictures(prompt, printing=False)
+    filters = ChromaDatabase.build_filters(args.date_from, args.date_to, args.localisation, args.country, args.generated_with)
 
-    json_saving(similar_images)    
+    with profiler.stage("search"):
+        if args.page_size is None:
+            similar_images = database.get_similar_pictures(prompt, printing=False, filters=filters)
+        else:
+            similar_images, next_cursor = database.search_page(prompt, filters=filters, cursor=args.cursor, page_size=args.page_size)
+            print(f"Curseur de la page suivante : {next_cursor}")
+
+    with profiler.stage("save"):
+        json_saving(similar_images)    
     
     ending_time = time.time()
     print(f"Temps total pour récupérer les images: {ending_time - starting_time:.2f} sec")
\ No newline at end of file
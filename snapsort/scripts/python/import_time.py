@@ -0,0 +1,60 @@
+import os
+import sys
+import subprocess
+
+from functions import set_parser_import_time
+
+SCRIPTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Budget de temps d'import (ms) des scripts lancés par l'interface, vérifié par tests/test_import_time.py
+IMPORT_BUDGETS_MS = {"image_retrieval": 3000.0, "main": 3000.0}
+# Modules lourds qui ne doivent être chargés qu'à leur première utilisation
+HEAVY_MODULES = ("pandas", "reverse_geocoder", "torch", "transformers", "cv2", "sklearn")
+
+
+def measure_import_time(module):
+    """
+    Importe le module dans un nouvel interpréteur avec -X importtime.
+    Les modules chargés au démarrage de l'interpréteur lui-même (site, encodings...) ne sont pas comptés.
+
+    :return: Temps cumulé (ms) de chaque module de premier niveau importé, et ensemble de tous les modules chargés.
+    """
+    _, startup_modules = _run_importtime("pass")
+    top_level_times, loaded_modules = _run_importtime(f"import {module}")
+    top_level_times = {name: duration for name, duration in top_level_times.items() if name not in startup_modules}
+    return top_level_times, loaded_modules - startup_modules
+
+
+def _run_importtime(code):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=SCRIPTS_DIRECTORY, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Échec de {code} :\n{result.stderr}")
+
+    top_level_times = {}
+    loaded_modules = set()
+    for line in result.stderr.splitlines():
+        # Format : "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        loaded_modules.add(name.strip())
+        # Les sous-imports sont indentés : seuls les imports de premier niveau sont additionnés
+        if not name.startswith("  "):
+            top_level_times[name.strip()] = int(cumulative) / 1000
+    return top_level_times, loaded_modules
+
+
+if __name__ == "__main__":
+    args = set_parser_import_time()
+
+    top_level_times, loaded_modules = measure_import_time(args.module)
+    total_time = sum(top_level_times.values())
+
+    budget = IMPORT_BUDGETS_MS.get(args.module)
+    print(f"Temps d'import de {args.module} : {total_time:.0f} ms" + (f" (budget : {budget:.0f} ms)" if budget is not None else ""))
+    for name, duration in sorted(top_level_times.items(), key=lambda item: item[1], reverse=True)[:10]:
+        print(f"  {name:<40} {duration:8.1f} ms")
+    heavy_loaded = sorted(module for module in HEAVY_MODULES if module in loaded_modules)
+    if heavy_loaded:
+        print(f"Modules lourds chargés au démarrage : {heavy_loaded}")
@@ -0,0 +1,178 @@
+import os
+import uuid
+import shutil
+import hashlib
+import itertools
+from io import BytesIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from image_details import ImageDetails
+from directory_scanner import DirectoryScanner, ImageEntry, scan_images, SCAN_INDEX_PATH
+
+
+class IngestManager:
+    def __init__(self, index_path=SCAN_INDEX_PATH, max_workers=4, chunk_size=1024 * 1024, header_size=128 * 1024):
+        """
+        Import des images : copie, empreinte du contenu et en-tête EXIF en une seule lecture de chaque fichier source.
+        Les résultats sont enregistrés dans l'index du dossier de copie (le même que celui de llm_call.py),
+        avec pour chaque copie sa taille, sa date de modification, son empreinte, ses données EXIF et son fichier source.
+
+        :param index_path: Fichier json de l'index (manifeste de l'import).
+        :param max_workers: Nombre de fichiers lus en même temps (à adapter au support, comme pour CopyManager).
+        :param chunk_size: Taille des blocs lus.
+        :param header_size: Nombre d'octets gardés en mémoire pour lire l'EXIF (le segment EXIF d'un JPEG fait au plus 64 Ko).
+        """
+        self.index_path = index_path
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.header_size = header_size
+
+    def ingest(self, source_directory, destination_directory):
+        """
+        Copie les images du dossier source (sous-dossiers compris) dans le dossier de destination.
+        Une image déjà copiée (même taille et même date) et déjà présente dans l'index n'est pas relue.
+
+        :return: Dictionnaire du nombre d'images copiées, seulement indexées, inchangées et en erreur
+        """
+        os.makedirs(destination_directory, exist_ok=True)
+        scanner = DirectoryScanner(destination_directory, index_path=self.index_path)
+        stats = {"copied": 0, "indexed": 0, "unchanged": 0, "errors": 0}
+        claimed_paths = set()
+
+        def tasks():
+            for entry in scan_images(source_directory, check_magic=False):
+                destination_path = self.get_destination_path(entry, destination_directory, scanner, claimed_paths)
+                destination_entry = self._get_entry(destination_path)
+                is_copied = destination_entry is not None and destination_entry.size == entry.size and destination_entry.mtime == entry.mtime
+                if is_copied and scanner.get_info(destination_entry, "content_hash") is not None:
+                    stats["unchanged"] += 1
+                    continue
+                yield entry, destination_path, not is_copied
+
+        # Nombre borné de fichiers en cours de lecture : la mémoire ne dépend pas du nombre d'images
+        pending = tasks()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = deque(executor.submit(self.ingest_file, *task) for _, task in zip(range(2 * self.max_workers), pending))
+            while futures:
+                result = futures.popleft().result()
+                next_task = next(pending, None)
+                if next_task is not None:
+                    futures.append(executor.submit(self.ingest_file, *next_task))
+                if result is None:
+                    stats["errors"] += 1
+                    continue
+                destination_entry, info, copied = result
+                scanner.update(destination_entry, **info)
+                stats["copied" if copied else "indexed"] += 1
+
+        scanner.save_index()
+        print(f"Import terminé : {stats['copied']} copiées, {stats['indexed']} indexées, "
+              f"{stats['unchanged']} inchangées, {stats['errors']} erreurs")
+        return stats
+
+    def get_destination_path(self, source_entry, destination_directory, scanner, claimed_paths):
+        """
+        Chemin de la copie : nom du fichier source, suivi de _1, _2... si ce nom est déjà pris par une autre image
+        (des sous-dossiers différents peuvent contenir des fichiers de même nom, ex : a/IMG_0001.jpg et b/IMG_0001.jpg).
+        Le fichier source de chaque copie est enregistré dans l'index : une image garde le même nom d'un import à l'autre.
+
+        :param claimed_paths: Chemins déjà attribués pendant cet import (complété par cette fonction).
+        """
+        name, extension = os.path.splitext(os.path.basename(source_entry.path))
+        for index in itertools.count():
+            candidate = os.path.join(destination_directory, f"{name}_{index}{extension}" if index else f"{name}{extension}")
+            if candidate in claimed_paths:
+                continue
+            source_path = scanner.index.get(candidate, {}).get("source_path")
+            if source_path is not None and source_path != source_entry.path:
+                continue
+            if source_path is None:
+                # Nom sans source connue : libre, ou copie d'un import antérieur à l'index (même taille et même date que la source)
+                destination_entry = self._get_entry(candidate)
+                if destination_entry is not None and (destination_entry.size, destination_entry.mtime) != (source_entry.size, source_entry.mtime):
+                    continue
+            claimed_paths.add(candidate)
+            return candidate
+
+    def ingest_file(self, source_entry, destination_path, copy=True):
+        """
+        Lit le fichier source une seule fois : chaque bloc est ajouté à l'empreinte et écrit dans la copie,
+        le début du fichier est gardé pour lire l'EXIF.
+
+        :return: Tuple (ImageEntry de la copie, informations pour l'index, copie effectuée), ou None en cas d'erreur.
+        """
+        file_hash = hashlib.blake2b(digest_size=16)
+        header = bytearray()
+        temp_path = f"{destination_path}.{uuid.uuid4().hex}.tmp" if copy else None
+        try:
+            with open(source_entry.path, "rb") as source:
+                destination = open(temp_path, "wb") if copy else None
+                try:
+                    for chunk in iter(lambda: source.read(self.chunk_size), b""):
+                        file_hash.update(chunk)
+                        if len(header) < self.header_size:
+                            header += chunk[:self.header_size - len(header)]
+                        if destination is not None:
+                            destination.write(chunk)
+                finally:
+                    if destination is not None:
+                        destination.close()
+            if copy:
+                # Même date de modification que la source, comme shutil.copy2, pour reconnaître la copie au prochain import
+                shutil.copystat(source_entry.path, temp_path)
+                os.replace(temp_path, destination_path)
+                print(f"Copié : {source_entry.path} -> {destination_path}")
+        except OSError as e:
+            print(f"Erreur lors de l'import de {source_entry.path} : {e}")
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return None
+
+        info = {"content_hash": file_hash.hexdigest(), "source_path": source_entry.path,
+                "source_size": source_entry.size, "source_mtime": source_entry.mtime}
+        info.update(self.read_exif(destination_path, bytes(header)))
+        return self._get_entry(destination_path), info, copy
+
+    def read_exif(self, image_path, header):
+        """
+        Date et coordonnées GPS lues dans le début du fichier.
+        Seuls les JPEG sont lus ainsi : dans les autres formats, l'EXIF peut se trouver après les données de l'image.
+
+        :return: Dictionnaire {date_time, latitude, longitude}, vide si l'EXIF n'a pas pu être lu.
+        """
+        if not header.startswith(b"\xff\xd8\xff"):
+            return {}
+        try:
+            with Image.open(BytesIO(header)) as image:
+                details = ImageDetails(image_path, image=image)
+        except Exception:
+            return {}
+        return {"date_time": details.date_time, "latitude": details.latitude, "longitude": details.longitude}
+
+    def get_source_metadata(self, source_paths):
+        """
+        Données EXIF déjà lues à l'import, pour les fichiers sources qui n'ont pas changé depuis.
+
+        :return: Dictionnaire {chemin source : (date_time, latitude, longitude)}
+        """
+        scanner = DirectoryScanner(None, index_path=self.index_path)
+        source_paths = set(source_paths)
+        metadata = {}
+        for info in scanner.index.values():
+            source_path = info.get("source_path")
+            if source_path not in source_paths or "date_time" not in info:
+                continue
+            source_entry = self._get_entry(source_path)
+            if source_entry is not None and source_entry.size == info["source_size"] and source_entry.mtime == info["source_mtime"]:
+                metadata[source_path] = (info["date_time"], info["latitude"], info["longitude"])
+        return metadata
+
+    def _get_entry(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return ImageEntry(path, stat.st_size, stat.st_mtime)
@@ -0,0 +1,39 @@
+import sys
+import importlib
+import importlib.util
+
+
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        # Appelé seulement pour les attributs absents du proxy : le module est importé au premier accès
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+    def __repr__(self):
+        return f"<module {self._name!r} (chargé à la première utilisation)>"
+
+
+def lazy_import(name):
+    """
+    Importe un module à la première utilisation d'un de ses attributs.
+    Permet aux scripts lancés par l'interface de démarrer sans attendre le chargement de pandas, torch, etc.
+    quand ils n'en ont pas besoin.
+
+    Le module n'est ajouté à sys.modules qu'à son import réel : un module en attente dans sys.modules serait chargé
+    par tout code qui parcourt sys.modules (ex : inspect.getmodule pendant l'import de torch), parfois au milieu
+    de l'import d'un module dont il dépend (import circulaire).
+
+    :param name: Nom du module (module de premier niveau ou module local du dossier scripts/python).
+    :return: Le module s'il est déjà chargé, sinon un proxy qui le charge au premier accès.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    if importlib.util.find_spec(name) is None:
+        raise ImportError(f"Module introuvable : {name}")
+    return LazyModule(name)
@@ -1,37 +1,102 @@
 import time
-import base64
-from io import BytesIO
-from PIL import Image
 import uuid
 import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.documents import Document
 from langchain_ollama import ChatOllama
 from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
 
 from image_details import ImageDetails
-from functions import get_image_paths, set_parser_fill_database, get_localisation
+from functions import set_parser_fill_database, get_localisation, get_file_hash
 from chroma_db import ChromaDatabase
+from payload_cache import PayloadCache
+from ollama_pool import OllamaPool
+from geocoding_service import GeocodingService
+from directory_scanner import DirectoryScanner, SCAN_INDEX_PATH
+from pipeline_profiler import PipelineProfiler
+from lazy_imports import lazy_import
+
+# torch et CLIP ne sont chargés qu'avec la cascade
+captioning_cascade = lazy_import("captioning_cascade")
+
+PROFILE_PATH = "./scripts/temp_files/profile_llm_call"
 
 class LLMCall:
-    def __init__(self, model="gemma3"):
+    def __init__(self, model="gemma3", payload_cache=None, workers=4, prefetch=8, scanner=None, combined=True, combined_attempts=2, cascade=None,
+                 pool=None):
         self.model = model
-        self.llm = ChatOllama(model=model, temperature=0.2)
-        self.vision_chain = self.prompt_func | self.llm | StrOutputParser()
-        self.object_chain = self.prompt_func | self.llm | JsonOutputParser()
-
+        # OllamaPool : les appels sont répartis sur plusieurs serveurs (None pour le serveur Ollama par défaut, un appel à la fois)
+        self.pool = pool
+        if pool is None:
+            self.llm = ChatOllama(model=model, temperature=0.2)
+            self.chains = {None: self.build_chains(self.llm)}
+        else:
+            self.chains = {endpoint.url: self.build_chains(pool.get_chat_model(endpoint, model, temperature=0.2)) for endpoint in pool.endpoints}
+        # Mode combiné : objets et description en un seul appel, avec repli sur les deux appels séparés après combined_attempts échecs
+        self.combined = combined
+        self.combined_attempts = combined_attempts
+        self.inference_calls = 0
+        self._calls_lock = threading.Lock()
+        # CaptioningCascade : seules les images représentatives sont envoyées au LLM (None pour tout envoyer)
+        self.cascade = cascade
+        self.payload_cache = payload_cache if payload_cache is not None else PayloadCache()
+        self.workers = workers
+        self.prefetch = prefetch
+        self.scanner = scanner
+
+
+    def build_chains(self, llm):
+        return {"description": self.prompt_func | llm | StrOutputParser(),
+                "object": self.prompt_func | llm | JsonOutputParser(),
+                "combined": self.prompt_func | llm | JsonOutputParser()}
+
+    @property
+    def llm_workers(self):
+        # Nombre d'images décrites en même temps : une par place disponible sur les serveurs du pool
+        return 1 if self.pool is None else self.pool.capacity
+
+    def invoke_chain(self, chain, inputs):
+        if self.pool is None:
+            return self.chains[None][chain].invoke(inputs)
+        with self.pool.acquire(self.model) as endpoint:
+            return self.chains[endpoint.url][chain].invoke(inputs)
     
-    def encode_image(self, image_path, max_size=(512, 512), quality=80):
-        image = Image.open(image_path)
-        # Redimensionner l'image
-        image.thumbnail(max_size)
-        # Convertir en bytes avec compression
-        buffer = BytesIO()
-        image.save(buffer, format="JPEG", quality=quality)
-        # Encoder en Base64
-        encoded_string = base64.b64encode(buffer.getvalue()).decode("utf-8")
-
-        return encoded_string
+    def encode_image(self, image_path, content_hash=None):
+        # Image réduite et encodée en base64, préparée une seule fois grâce au cache disque
+        return self.payload_cache.get_payload(image_path, content_hash)
+
+    def get_content_hash(self, image_path):
+        # Empreinte reprise de l'index du dossier si le fichier n'a pas changé (même taille et même date)
+        entry = self.scanner.entries.get(image_path) if self.scanner is not None else None
+        if entry is None:
+            return get_file_hash(image_path)
+        content_hash = self.scanner.get_info(entry, "content_hash")
+        if content_hash is None:
+            content_hash = get_file_hash(image_path)
+            self.scanner.update(entry, content_hash=content_hash)
+        return content_hash
+
+    def prepare_images(self, image_paths, processed_hashes, without_payload=()):
+        # Calcul des empreintes et encodage des images dans un pool de workers, en avance sur les appels au LLM
+        def prepare(image_path):
+            content_hash = self.get_content_hash(image_path)
+            image_b64 = None
+            if content_hash not in processed_hashes and image_path not in without_payload:
+                image_b64 = self.encode_image(image_path, content_hash)
+            return image_path, content_hash, image_b64
+
+        paths = iter(image_paths)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = deque(executor.submit(prepare, path) for _, path in zip(range(self.prefetch), paths))
+            while futures:
+                result = futures.popleft().result()
+                next_path = next(paths, None)
+                if next_path is not None:
+                    futures.append(executor.submit(prepare, next_path))
+                yield result
     
     def get_vision_system_message(self):
         system_message_text = '''
@@ -57,6 +122,25 @@ Vous devez toujours donner vos résultats au format json, par exemple :
 '''
         return system_message_text
     
+    def get_combined_system_message(self):
+        system_message_text = '''
+Vous êtes un expert en analyse d'images et de photos.
+Vous êtes très perspicace dans l'analyse des images et des photos.
+Vous possédez une excellente vision.
+Votre description doit être neutre.
+N'utilise pas d'apastrophe car cela poserait problème pour le json.
+Vous devez toujours donner vos résultats au format json, par exemple :
+
+{
+"objects": [
+{"name": "un objet détecté", "description": "la description de l objet détecté"},
+{"name": "un autre objet détecté", "description": "la description de l autre objet détecté"}
+],
+"description": "la description de l image"
+}
+'''
+        return system_message_text
+
     def prompt_func(self, data):
         text = data["text"]
         image = data["image"]
@@ -81,17 +165,19 @@ Vous devez toujours donner vos résultats au format json, par exemple :
 
     def call_function(self, chain, prompt, image):
         if chain == "object":
-            llm_chain = self.object_chain
             system_message = self.get_object_system_message()
         elif chain == "description":
-            llm_chain = self.vision_chain
             system_message = self.get_vision_system_message()
+        elif chain == "combined":
+            system_message = self.get_combined_system_message()
         else : 
-            print("Mauvaise commande, utiliser 'object' ou 'description' \n") 
+            print("Mauvaise commande, utiliser 'object', 'description' ou 'combined' \n") 
             return -2
         
+        with self._calls_lock:
+            self.inference_calls += 1
         try:
-            llm_response = llm_chain.invoke ({"text":prompt, 
+            llm_response = self.invoke_chain(chain, {"text":prompt, 
                     "image": image, 
                     "system_message_text": system_message})
         except Exception as e:
@@ -100,8 +186,16 @@ Vous devez toujours donner vos résultats au format json, par exemple :
         
         return llm_response
 
-    def analyze_image(self, image_file):
-        image_b64 = self.encode_image(image_file)
+    def analyze_image(self, image_file, content_hash=None, image_b64=None):
+        if image_b64 is None:
+            image_b64 = self.encode_image(image_file, content_hash)
+
+        if self.combined:
+            result = self.analyze_image_combined(image_b64)
+            if result is not None:
+                detected_objects, image_description = result
+                return ImageDetails(image_file, detected_objects, image_description, self.model, content_hash)
+            print("Réponse combinée invalide, analyse en deux appels.")
 
         object_prompt = """Identifie les objets présents dans l'image. Retourne une liste json d'éléments json correspondant aux objets détectés. 
 Inclue uniquement le nom de chaque objet et une courte description de l'objet. 
@@ -120,52 +214,159 @@ Les champs doivent s'appeler 'name' et 'description' respectivement."""
             if image_description != -1 :
                 break
 
-        image_details = ImageDetails(image_file, detected_objects, image_description, self.model)
+        image_details = ImageDetails(image_file, detected_objects, image_description, self.model, content_hash)
         
         return image_details
     
-    def pipeline_calls(self, image_paths, database):
-
-        processed_files = database.get_processed_files()
-        cache = {}
-
-        counter = 1
+    def analyze_image_combined(self, image_b64):
+        """
+        Objets détectés et description de l'image en un seul appel au modèle : l'image n'est encodée et lue par le modèle qu'une fois.
+
+        :return: Tuple (objets détectés, description), ou None si le modèle n'a pas répondu au bon format après combined_attempts essais.
+        """
+        combined_prompt = """Identifie les objets présents dans l'image, puis décris l'image aussi précisément que possible.
+Retourne un objet json avec deux champs :
+- 'objects' : une liste d'éléments json correspondant aux objets détectés, avec uniquement le nom de chaque objet et une courte description de l'objet, dans des champs 'name' et 'description' respectivement.
+- 'description' : la description de l'image."""
+
+        for _ in range(self.combined_attempts):
+            response = self.call_function("combined", combined_prompt, image_b64)
+            if isinstance(response, dict) and isinstance(response.get("objects"), list) and isinstance(response.get("description"), str):
+                detected_objects = [item for item in response["objects"] if isinstance(item, dict) and "name" in item and "description" in item]
+                return detected_objects, response["description"]
+            combined_prompt = combined_prompt + " Ta réponse doit être au format json, fais attention à ne pas utiliser d'apostrophes dans le texte des champs."
+        return None
+
+    def plan_cascade(self, image_paths, processed_hashes, unhashed_files):
+        # Seules les images qui seraient envoyées au LLM passent par la cascade
+        pending, pending_hashes = [], set()
         for image_path in image_paths:
-            image_name = os.path.basename(image_path)
-            print('---------------------------------------------------------------')
-            print(f'{counter} / {len(image_paths)}')
-            print(image_name)
-            print('\n')
-            if image_name in processed_files:
-                print(f'FILE ALREADY PROCESSED, SKIPPED')
-            else:
-                image_details = self.analyze_image(image_path)
-                print(image_details)
-                metadata = image_details.to_dict()
-
-                if image_details.latitude and image_details.longitude :
-                    localisation = get_localisation(image_details.latitude, image_details.longitude, cache, "large")
-                    metadata['localisation'] = localisation  # Ajout de la localisation dans le metadata
-
-                doc = Document(id=str(uuid.uuid4()), page_content=image_details.get_page_content(), metadata=metadata)
-                print(doc)
-                database.db.add_documents([doc])
-                counter += 1
+            content_hash = self.get_content_hash(image_path)
+            if content_hash in processed_hashes or content_hash in pending_hashes or os.path.basename(image_path) in unhashed_files:
+                continue
+            pending.append(image_path)
+            pending_hashes.add(content_hash)
+        return self.cascade.plan(pending)
+
+    def cascade_details(self, image_path, content_hash, decision, captioned):
+        """
+        Description d'une image sans appel au LLM : reprise de la description de l'image représentative, ou étiquettes CLIP.
+        """
+        tags_text = ", ".join(tag for tag, _ in decision["tags"])
+        representative = captioned.get(decision.get("representative"))
+        if decision["mode"] == "inherit" and representative is not None:
+            detected_objects, description = representative
+            image_details = ImageDetails(image_path, detected_objects, description, self.model, content_hash)
+        else:
+            detected_objects = [{"name": tag, "description": f"étiquette CLIP, probabilité {probability:.2f}"} for tag, probability in decision["tags"]]
+            image_details = ImageDetails(image_path, detected_objects, f"Photo : {tags_text}", "clip", content_hash)
+        return image_details
 
+    def pipeline_calls(self, image_paths, database):
 
+        processed_hashes = database.get_processed_hashes()
+        unhashed_files = database.get_unhashed_files()
+        geocoding_service = GeocodingService()
+
+        decisions = self.plan_cascade(image_paths, processed_hashes, unhashed_files) if self.cascade is not None else {}
+        without_payload = {path for path, decision in decisions.items() if decision["mode"] != "llm"}
+        captioned = {}   # Images décrites par le LLM, dont la description peut être reprise par leurs quasi-doublons
+        pending_hashes = set()
+
+        def submit(prepared):
+            # Les appels au LLM partent en avance, un par place libre dans le pool ; les résultats sont enregistrés dans l'ordre des images
+            image_path, content_hash, image_b64 = prepared
+            decision = decisions.get(image_path)
+            future = None
+            if (content_hash not in processed_hashes and content_hash not in pending_hashes
+                    and os.path.basename(image_path) not in unhashed_files and (decision is None or decision["mode"] == "llm")):
+                pending_hashes.add(content_hash)
+                future = executor.submit(self.analyze_image, image_path, content_hash, image_b64)
+            return image_path, content_hash, image_b64, future
+
+        prepared_images = self.prepare_images(image_paths, processed_hashes, without_payload)
+        executor = ThreadPoolExecutor(max_workers=self.llm_workers)
+        analyses = deque(submit(prepared) for _, prepared in zip(range(2 * self.llm_workers), prepared_images))
 
-def process_images(directory):
-    image_paths = get_image_paths(directory)
+        counter = 1
+        try:
+            while analyses:
+                image_path, content_hash, image_b64, future = analyses.popleft()
+                next_prepared = next(prepared_images, None)
+                if next_prepared is not None:
+                    analyses.append(submit(next_prepared))
+                image_name = os.path.basename(image_path)
+                print('---------------------------------------------------------------')
+                print(f'{counter} / {len(image_paths)}')
+                print(image_name)
+                print('\n')
+                if image_name in processed_hashes.get(content_hash, ()) or image_name in unhashed_files:
+                    print(f'FILE ALREADY PROCESSED, SKIPPED')
+                elif content_hash in processed_hashes:
+                    # Même contenu déjà analysé sous un autre nom : on recopie ses métadonnées
+                    database.copy_document(content_hash, image_path)
+                    processed_hashes[content_hash].add(image_name)
+                    print(f'CONTENT ALREADY PROCESSED, METADATA COPIED')
+                else:
+                    decision = decisions.get(image_path)
+                    if decision is not None and decision["mode"] != "llm":
+                        image_details = self.cascade_details(image_path, content_hash, decision, captioned)
+                    else:
+                        image_details = future.result() if future is not None else self.analyze_image(image_path, content_hash, image_b64)
+                        captioned[image_path] = (image_details.detected_objects, image_details.description)
+                    print(image_details)
+                    metadata = image_details.to_dict()
+                    if decision is not None:
+                        metadata['caption_source'] = decision["mode"]
+                        metadata['clip_tags'] = ", ".join(tag for tag, _ in decision["tags"])
+
+                    if image_details.latitude and image_details.longitude :
+                        localisation = get_localisation(image_details.latitude, image_details.longitude, geocoding_service, "large")
+                        if localisation:
+                            metadata['localisation'] = localisation  # Ajout de la localisation dans le metadata
+                            metadata['country'] = localisation.split(", ")[0]  # Code du pays, pour filtrer les recherches
+
+                    doc = Document(id=str(uuid.uuid4()), page_content=image_details.get_page_content(), metadata=metadata)
+                    print(doc)
+                    database.db.add_documents([doc])
+                    processed_hashes.setdefault(content_hash, set()).add(image_name)
+                    counter += 1
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+        if self.scanner is not None:
+            self.scanner.save_index()
+        print(f"Appels au modèle : {self.inference_calls} pour {counter - 1} images analysées")
+        if self.pool is not None:
+            self.pool.print_report()
+
+
+
+def process_images(directory, database, profiler=None, combined=True, cascade=False, ollama_pool=None):
+    """
+    Description des images du dossier par le LLM et ajout dans la base Chroma.
+
+    :return: LLMCall utilisé (nombre d'appels au modèle dans inference_calls).
+    """
+    if profiler is None:
+        profiler = PipelineProfiler()
+
+    scanner = DirectoryScanner(directory, allowed_extensions={".jpg", ".jpeg", ".png"}, index_path=SCAN_INDEX_PATH)
+    with profiler.stage("scan"):
+        image_paths = [entry.path for entry in scanner.scan()]
 
     image_model = "gemma3"
-    llm_call = LLMCall(model=image_model)
+    llm_call = LLMCall(model=image_model, scanner=scanner, combined=combined,
+                       cascade=captioning_cascade.CaptioningCascade() if cascade else None, pool=ollama_pool)
 
     # Example usage
     # image_file = r".\photos_final\20240902_150137.jpg" 
     # image_details = llm_call.analyze_image(image_file)
     # print(image_details)
 
-    llm_call.pipeline_calls(image_paths, database)
+    with profiler.stage("captioning"):
+        llm_call.pipeline_calls(image_paths, database)
+    return llm_call
 
        
 
@@ -173,10 +374,15 @@ if __name__== "__main__":
     args = set_parser_fill_database()
     directory = args.copy_directory
     embedding_model = "mxbai-embed-large"
-    database = ChromaDatabase(embedding_model=embedding_model, new=False)
+    profiler = PipelineProfiler(PROFILE_PATH if args.profile else None)
+    # Sans --ollama_endpoints : serveur Ollama par défaut, comme avant
+    ollama_pool = OllamaPool(args.ollama_endpoints, max_concurrency=args.endpoint_concurrency) if args.ollama_endpoints else None
+    with profiler.stage("database"):
+        database = ChromaDatabase(embedding_model=embedding_model, new=False, hnsw_space=args.hnsw_space, hnsw_m=args.hnsw_m,
+                                  hnsw_construction_ef=args.hnsw_construction_ef, ollama_pool=ollama_pool)
 
     starting_time = time.time()
-    process_images(directory)
+    process_images(directory, database, profiler, combined=args.captioning == "combined", cascade=args.cascade, ollama_pool=ollama_pool)
     ending_time = time.time()
     print(f"Temps total pour traiter les images: {ending_time - starting_time:.2f} sec")
 
@@ -5,8 +5,16 @@ import sys
 sys.stdout.reconfigure(line_buffering=True)
 os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
 
-from functions import create_category_folders_from_csv, create_arborescence_from_csv, set_parser_main, copy_all_images, empty_directory
-from categories_manager import CategoriesManager
+from functions import create_category_folders, create_arborescence, set_parser_main, copy_all_images, empty_directory, get_image_paths
+from checkpoint_manager import CheckpointManager
+from pipeline_profiler import PipelineProfiler
+from lazy_imports import lazy_import
+
+# torch, transformers, OpenCV... ne sont chargés qu'après la lecture des arguments
+categories_manager = lazy_import("categories_manager")
+streaming_ingest = lazy_import("streaming_ingest")
+images_manager = lazy_import("images_manager")
+ingest_manager = lazy_import("ingest_manager")
 
 CLEANING = False
 
@@ -15,24 +23,61 @@ if __name__ == "__main__":
     directory = args.directory
     destination_directory = args.destination_directory
 
+    if args.watch:
+        # Import en continu : pas de fin de traitement, arrêt avec Ctrl+C
+        streaming_ingest.StreamingIngest(directory, destination_directory, args.copy_directory).run()
+        sys.exit(0)
+
+    # Profils écrits à côté du tableau de sortie
+    profiler = PipelineProfiler(os.path.normpath(directory) + "_profile" if args.profile else None)
+
+    # Les checkpoints sont à côté du dossier d'entrée, qui est vidé à la fin du tri
+    checkpoint_directory = os.path.normpath(directory) + "_checkpoints"
+    input_paths = get_image_paths(directory, allowed_extensions="All")
+    checkpoints = CheckpointManager(checkpoint_directory, resume=args.resume, inputs=input_paths)
+
     copy_directory = args.copy_directory
-    copy_all_images(directory, copy_directory)
+    if not checkpoints.is_completed("copy"):
+        with profiler.stage("copy"):
+            copy_all_images(directory, copy_directory, max_workers=args.copy_workers)
+        checkpoints.save("copy", copy_directory)
 
-    call = CategoriesManager(directory=directory)
+    # EXIF déjà lu pendant la copie : les images ne sont pas relues pour le tableau des métadonnées
+    known_metadata = ingest_manager.IngestManager().get_source_metadata(input_paths)
+
+    call = categories_manager.CategoriesManager(directory=directory, checkpoints=checkpoints, workers=args.workers, profiler=profiler,
+                                                embedding_dtype=args.embedding_dtype, pca_dimensions=args.pca_dimensions,
+                                                known_metadata=known_metadata,
+                                                memory_budget=args.memory_budget_mb * 2**20 if args.memory_budget_mb else None)
     starting_time = time.time()
     
-    call.pipeline(starting_time)
+    df = call.pipeline(starting_time)
 
     if CLEANING:
         if os.path.exists(destination_directory):
             shutil.rmtree(destination_directory)
 
-    create_arborescence_from_csv(directory + ".csv")
-    create_category_folders_from_csv(directory + ".csv", destination_directory, arborescence=True)
+    # Le DataFrame est passé directement d'une étape à l'autre, il n'est écrit qu'une seule fois sur le disque
+    with profiler.stage("arborescence"):
+        df = create_arborescence(df)
+    if df is not None:
+        call.dataframe_manager.df = df
+        call.dataframe_manager.save(f"{directory}.{args.output_format}", args.output_format)
+
+        print(f"ETAPE 4 - Copie des images triées :\n")
+        with profiler.stage("albums"):
+            create_category_folders(df, destination_directory, arborescence=True, max_workers=args.copy_workers)
+
+    if args.thumbnails:
+        with profiler.stage("thumbnails"):
+            images_manager.ThumbnailGenerator().generate(copy_directory)
 
     total_time = time.time() - starting_time
     print(f"Temps total d'exécution : {total_time:.2f} secondes")
 
-    empty_directory(directory)
+    # Le dossier d'entrée n'est vidé que si toutes les étapes sont terminées
+    if df is not None:
+        checkpoints.clear()
+        empty_directory(directory)
 
 
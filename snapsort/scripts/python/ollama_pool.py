@@ -0,0 +1,198 @@
+import json
+import time
+import threading
+import urllib.request
+from contextlib import contextmanager
+
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_ENDPOINT = "http://127.0.0.1:11434"
+
+
+class OllamaEndpoint:
+    def __init__(self, url, max_concurrency=1):
+        """
+        Un serveur Ollama du pool.
+
+        :param url: Adresse du serveur (ex : http://192.168.1.20:11434).
+        :param max_concurrency: Nombre maximal de requêtes envoyées en même temps à ce serveur (à accorder avec OLLAMA_NUM_PARALLEL).
+        """
+        self.url = url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self.healthy = None       # None : pas encore vérifié
+        self.models = None        # Modèles disponibles sur le serveur, lus par le health check
+        self.next_check = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.busy_time = 0.0
+
+    @property
+    def load(self):
+        return self.active / self.max_concurrency
+
+    def has_model(self, model):
+        # Sans liste de modèles (serveur pas encore vérifié), on suppose le modèle disponible
+        if model is None or self.models is None:
+            return True
+        return any(name == model or name.split(":")[0] == model for name in self.models)
+
+    def __repr__(self):
+        return f"OllamaEndpoint({self.url}, {self.active}/{self.max_concurrency})"
+
+
+class OllamaPool:
+    def __init__(self, endpoints=None, max_concurrency=1, health_interval=30.0, timeout=5.0):
+        """
+        Pool de serveurs Ollama : chaque requête est envoyée au serveur disponible le moins chargé.
+        Un serveur qui ne répond plus est écarté, puis vérifié de nouveau toutes les health_interval secondes.
+
+        :param endpoints: Adresses des serveurs ; une adresse peut préciser sa propre limite : "http://hôte:11434=2".
+        :param max_concurrency: Limite de requêtes simultanées par serveur, si l'adresse n'en précise pas.
+        :param health_interval: Délai avant de vérifier de nouveau un serveur écarté, en secondes.
+        :param timeout: Délai maximal du health check, en secondes.
+        """
+        self.endpoints = []
+        for spec in endpoints or [DEFAULT_ENDPOINT]:
+            url, _, concurrency = spec.partition("=")
+            self.endpoints.append(OllamaEndpoint(url, int(concurrency) if concurrency else max_concurrency))
+        self.health_interval = health_interval
+        self.timeout = timeout
+        self._condition = threading.Condition()
+
+    @property
+    def capacity(self):
+        # Nombre total de requêtes simultanées possibles : nombre de workers à utiliser pour occuper tous les serveurs
+        return sum(endpoint.max_concurrency for endpoint in self.endpoints)
+
+    def check_health(self, endpoint):
+        """
+        Vérifie qu'un serveur répond (GET /api/tags) et lit la liste de ses modèles.
+
+        :return: True si le serveur répond.
+        """
+        try:
+            with urllib.request.urlopen(f"{endpoint.url}/api/tags", timeout=self.timeout) as response:
+                models = json.loads(response.read().decode("utf-8")).get("models", [])
+            healthy = True
+        except (OSError, ValueError):
+            models, healthy = None, False
+
+        with self._condition:
+            if healthy:
+                endpoint.models = {model.get("name", "") for model in models}
+            elif endpoint.healthy is not False:
+                print(f"Serveur Ollama indisponible : {endpoint.url}")
+            endpoint.healthy = healthy
+            endpoint.next_check = time.monotonic() + self.health_interval
+            self._condition.notify_all()
+        return healthy
+
+    def check_all(self):
+        # Vérifie tous les serveurs en parallèle (un serveur éteint ne retarde pas les autres)
+        threads = [threading.Thread(target=self.check_health, args=(endpoint,)) for endpoint in self.endpoints]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return [endpoint for endpoint in self.endpoints if endpoint.healthy]
+
+    @contextmanager
+    def acquire(self, model=None):
+        """
+        Réserve une place sur le serveur disponible le moins chargé, pendant la durée d'une requête.
+        Attend qu'une place se libère si tous les serveurs sont occupés.
+
+        :param model: Modèle nécessaire à la requête : seuls les serveurs qui l'ont sont choisis.
+        :raise RuntimeError: Aucun serveur disponible n'a le modèle.
+        """
+        endpoint = self._reserve(model)
+        start = time.perf_counter()
+        try:
+            yield endpoint
+        except Exception:
+            with self._condition:
+                endpoint.failures += 1
+            # Erreur du serveur ou du réseau : le serveur est écarté s'il ne répond plus (une réponse mal formée ne l'écarte pas)
+            self.check_health(endpoint)
+            raise
+        finally:
+            with self._condition:
+                endpoint.active -= 1
+                endpoint.requests += 1
+                endpoint.busy_time += time.perf_counter() - start
+                self._condition.notify_all()
+
+    def get_chat_model(self, endpoint, model, **kwargs):
+        from langchain_ollama import ChatOllama
+        return ChatOllama(model=model, base_url=endpoint.url, **kwargs)
+
+    def get_embeddings(self, model):
+        return PooledOllamaEmbeddings(self, model)
+
+    def report(self):
+        with self._condition:
+            return {endpoint.url: {"healthy": endpoint.healthy, "requests": endpoint.requests, "failures": endpoint.failures,
+                                   "busy_s": round(endpoint.busy_time, 3), "max_concurrency": endpoint.max_concurrency}
+                    for endpoint in self.endpoints}
+
+    def print_report(self):
+        for url, info in self.report().items():
+            state = "disponible" if info["healthy"] else "indisponible"
+            print(f"{url} ({state}) : {info['requests']} requêtes, {info['failures']} erreurs, occupé {info['busy_s']:.1f} s")
+
+    def _reserve(self, model):
+        self._refresh_health()
+        with self._condition:
+            while True:
+                candidates = [endpoint for endpoint in self.endpoints if endpoint.healthy is not False and endpoint.has_model(model)]
+                if not candidates:
+                    break
+                available = [endpoint for endpoint in candidates if endpoint.active < endpoint.max_concurrency]
+                if available:
+                    endpoint = min(available, key=lambda e: (e.load, e.requests))
+                    endpoint.active += 1
+                    return endpoint
+                self._condition.wait(timeout=self.health_interval)
+
+        # Tous les serveurs sont écartés : nouvelle vérification avant d'abandonner
+        if any(endpoint.has_model(model) for endpoint in self.check_all()):
+            return self._reserve(model)
+        raise RuntimeError(f"Aucun serveur Ollama disponible pour le modèle {model} : {[endpoint.url for endpoint in self.endpoints]}")
+
+    def _refresh_health(self):
+        # Premier health check de chaque serveur, puis nouvelle vérification des serveurs écartés dont le délai est passé
+        now = time.monotonic()
+        with self._condition:
+            to_check = [endpoint for endpoint in self.endpoints
+                        if endpoint.healthy is not True and endpoint.next_check <= now]
+            for endpoint in to_check:
+                endpoint.next_check = now + self.health_interval
+        for endpoint in to_check:
+            self.check_health(endpoint)
+
+
+class PooledOllamaEmbeddings(Embeddings):
+    def __init__(self, pool, model):
+        """
+        Embeddings Ollama répartis sur les serveurs du pool, utilisables comme embedding_function de Chroma.
+        """
+        self.pool = pool
+        self.model = model
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self.pool.acquire(self.model) as endpoint:
+            return self._get_client(endpoint).embed_documents(texts)
+
+    def embed_query(self, text):
+        with self.pool.acquire(self.model) as endpoint:
+            return self._get_client(endpoint).embed_query(text)
+
+    def _get_client(self, endpoint):
+        with self._lock:
+            if endpoint.url not in self._clients:
+                from langchain_ollama import OllamaEmbeddings
+                self._clients[endpoint.url] = OllamaEmbeddings(model=self.model, base_url=endpoint.url)
+            return self._clients[endpoint.url]
@@ -0,0 +1,161 @@
+import io
+import os
+import json
+import time
+import tempfile
+import threading
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from functions import set_parser_ollama_stub
+
+STUB_RESPONSE = {
+    "objects": [{"name": "arbre", "description": "un arbre"}, {"name": "chemin", "description": "un chemin de terre"}],
+    "description": "Une photo de test : un chemin bordé d arbres.",
+}
+
+
+class StubOllamaServer:
+    def __init__(self, port=0, delay=0.5, models=("gemma3:latest", "mxbai-embed-large:latest"), max_parallel=1, dimensions=8, embed_delay=None):
+        """
+        Faux serveur Ollama local (/api/tags, /api/chat, /api/embed) pour tester le pool sans modèle ni GPU.
+
+        :param port: Port d'écoute (0 : port libre choisi par le système).
+        :param delay: Durée simulée d'un appel au modèle, en secondes.
+        :param max_parallel: Nombre d'appels traités en même temps, comme OLLAMA_NUM_PARALLEL (les autres attendent).
+        :param dimensions: Dimensions des embeddings renvoyés.
+        :param embed_delay: Durée simulée d'un calcul d'embedding (None : même durée qu'un appel au modèle).
+        """
+        self.delay = delay
+        self.embed_delay = delay if embed_delay is None else embed_delay
+        self.models = models
+        self.dimensions = dimensions
+        self.requests = 0
+        self.max_active = 0
+        self._active = 0
+        self._slots = threading.Semaphore(max_parallel)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _run_model(self, delay):
+        with self._slots:
+            with self._lock:
+                self._active += 1
+                self.requests += 1
+                self.max_active = max(self.max_active, self._active)
+            time.sleep(delay)
+            with self._lock:
+                self._active -= 1
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._send({"models": [{"name": name, "model": name} for name in stub.models]})
+                else:
+                    self._send({"error": "not found"}, status=404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self.path == "/api/chat":
+                    stub._run_model(stub.delay)
+                    message = {"role": "assistant", "content": json.dumps(STUB_RESPONSE, ensure_ascii=False)}
+                    response = {"model": body.get("model"), "created_at": "2024-01-01T00:00:00Z", "message": message,
+                                "done": True, "done_reason": "stop"}
+                    # Le client Ollama lit les réponses en flux, une ligne json par morceau
+                    self._send(response, content_type="application/x-ndjson" if body.get("stream", True) else "application/json")
+                elif self.path == "/api/embed":
+                    stub._run_model(stub.embed_delay)
+                    inputs = body.get("input", [])
+                    inputs = [inputs] if isinstance(inputs, str) else inputs
+                    embeddings = [[((len(text) + i) % 7) / 7.0 for i in range(stub.dimensions)] for text in inputs]
+                    self._send({"model": body.get("model"), "embeddings": embeddings})
+                else:
+                    self._send({"error": "not found"}, status=404)
+
+            def _send(self, payload, status=200, content_type="application/json"):
+                data = (json.dumps(payload) + "\n").encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def create_test_images(directory, count):
+    # Images de contenus différents : aucune n'est reprise d'une autre par son empreinte
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        color = (i * 37 % 256, i * 91 % 256, i * 53 % 256)
+        Image.new("RGB", (320, 240), color).save(os.path.join(directory, f"stub_{i:03d}.jpg"))
+
+
+def measure_pipeline(pool, image_count):
+    """
+    Débit du pipeline complet de llm_call.py (process_images : empreintes, payloads, appels au LLM, embeddings et ajout dans Chroma)
+    avec les serveurs du pool, dans un dossier temporaire : base Chroma, index et caches sont neufs à chaque mesure.
+    """
+    from chroma_db import ChromaDatabase
+    from llm_call import process_images
+
+    current_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_directory:
+        os.chdir(work_directory)
+        try:
+            image_directory = os.path.join(work_directory, "images")
+            create_test_images(image_directory, image_count)
+            # Le pipeline affiche chaque image et chaque document : sortie masquée pendant la mesure
+            with redirect_stdout(io.StringIO()):
+                database = ChromaDatabase(db_name="db_stub", ollama_pool=pool)
+                start = time.perf_counter()
+                llm_call = process_images(image_directory, database, ollama_pool=pool)
+                elapsed = time.perf_counter() - start
+            documents = database.db._collection.count()
+        finally:
+            os.chdir(current_directory)
+    return {"images": image_count, "documents": documents, "inference_calls": llm_call.inference_calls,
+            "seconds": elapsed, "images_per_second": image_count / elapsed}
+
+
+if __name__ == "__main__":
+    args = set_parser_ollama_stub()
+
+    from ollama_pool import OllamaPool
+
+    stubs = [StubOllamaServer(delay=args.delay, max_parallel=args.endpoint_concurrency, embed_delay=args.embed_delay).start()
+             for _ in range(args.endpoints)]
+    try:
+        for count in range(1, args.endpoints + 1):
+            pool = OllamaPool([stub.url for stub in stubs[:count]], max_concurrency=args.endpoint_concurrency)
+            result = measure_pipeline(pool, args.images)
+            print(f"{count} serveur(s) : {result['images_per_second']:.2f} images/s "
+                  f"({result['documents']}/{result['images']} images ajoutées à la base, {result['inference_calls']} appels au modèle, "
+                  f"{result['seconds']:.1f} s)")
+            pool.print_report()
+        for stub in stubs:
+            print(f"{stub.url} : {stub.requests} requêtes, au plus {stub.max_active} en même temps")
+    finally:
+        for stub in stubs:
+            stub.stop()
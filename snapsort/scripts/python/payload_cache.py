@@ -0,0 +1,69 @@
+import os
+import base64
+import uuid
+from io import BytesIO
+
+from PIL import Image
+
+from functions import get_file_hash
+
+DIRECTORY_PATH = "./scripts/temp_files/payload_cache"
+
+
+class PayloadCache:
+    def __init__(self, directory=DIRECTORY_PATH, max_size=(512, 512), quality=80):
+        """
+        Cache disque des images réduites envoyées au LLM.
+
+        :param directory: Dossier où sont stockées les images réduites.
+        :param max_size: Taille maximale des images envoyées au LLM.
+        :param quality: Qualité de la compression JPEG.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.quality = quality
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get_payload(self, image_path, content_hash=None):
+        """
+        Retourne l'image réduite encodée en base64, depuis le cache si elle a déjà été préparée.
+
+        :param image_path: Chemin de l'image originale.
+        :param content_hash: Empreinte du contenu de l'image, calculée si elle n'est pas fournie.
+        :return: Image JPEG réduite encodée en base64.
+        """
+        if content_hash is None:
+            content_hash = get_file_hash(image_path)
+        cache_path = self._get_cache_path(content_hash)
+
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                jpeg_bytes = f.read()
+        else:
+            jpeg_bytes = self.resize_image(image_path)
+            self._write(cache_path, jpeg_bytes)
+
+        return base64.b64encode(jpeg_bytes).decode("utf-8")
+
+    def resize_image(self, image_path):
+        image = Image.open(image_path)
+        # Redimensionner l'image
+        image.draft("RGB", self.max_size)
+        image.thumbnail(self.max_size)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        # Convertir en bytes avec compression
+        buffer = BytesIO()
+        image.save(buffer, format="JPEG", quality=self.quality)
+        return buffer.getvalue()
+
+    def _get_cache_path(self, content_hash):
+        width, height = self.max_size
+        return os.path.join(self.directory, f"{content_hash}_{width}x{height}_q{self.quality}.jpg")
+
+    def _write(self, cache_path, jpeg_bytes):
+        # Écriture dans un fichier temporaire puis renommage, pour qu'un worker ne lise jamais un fichier incomplet
+        temp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(jpeg_bytes)
+        os.replace(temp_path, cache_path)
@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def get_rss():
+    # Mémoire résidente actuelle du processus (mémoire Python + mémoire native : torch, OpenCV...), None si elle n'est pas mesurable
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        # Linux sans psutil : deuxième champ de /proc/self/statm, en pages
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def get_peak_rss():
+    # Pic de mémoire résidente depuis le lancement du processus
+    if psutil is not None:
+        peak = getattr(psutil.Process().memory_info(), "peak_wset", None)   # Windows
+        if peak is not None:
+            return peak
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilo-octets sous Linux, octets sous macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        return get_rss()
+
+
+class RssMonitor:
+    def __init__(self, interval=0.005):
+        """
+        Hausse maximale de la mémoire résidente pendant un bloc with, par rapport au début du bloc.
+        La mémoire est échantillonnée toutes les interval secondes : increase vaut 0 si elle n'est pas mesurable.
+        """
+        self.interval = interval
+        self.increase = 0
+        self._baseline = None
+        self._peak = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._baseline = self._peak = get_rss()
+        if self._baseline is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread is None:
+            return False
+        self._stop_event.set()
+        self._thread.join()
+        self._update_peak()
+        self.increase = self._peak - self._baseline
+        return False
+
+    def _sample(self):
+        while not self._stop_event.wait(self.interval):
+            self._update_peak()
+
+    def _update_peak(self):
+        rss = get_rss()
+        if rss is not None and rss > self._peak:
+            self._peak = rss
+
+
+def get_available_memory():
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class PipelineProfiler:
+    def __init__(self, output_directory=None, sampling_interval=0.01):
+        """
+        Profilage étape par étape d'une exécution : profil CPU (cProfile), piles échantillonnées pour les flamegraphs,
+        pic de mémoire Python (tracemalloc) et pic de mémoire résidente.
+
+        :param output_directory: Dossier où écrire les résultats (None pour désactiver le profilage).
+        :param sampling_interval: Intervalle (s) entre deux échantillons de pile et de mémoire.
+        """
+        self.output_directory = output_directory
+        self.sampling_interval = sampling_interval
+        self.summary = []
+        self._stage = None
+
+        if self.enabled:
+            os.makedirs(self.output_directory, exist_ok=True)
+            tracemalloc.start()
+
+    @property
+    def enabled(self):
+        return self.output_directory is not None
+
+    @contextmanager
+    def stage(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def start(self, name):
+        if not self.enabled:
+            return
+
+        self._stage = {
+            "name": name,
+            "stacks": Counter(),
+            "rss_peak": [get_rss()],
+            "stop_event": threading.Event(),
+            "profile": cProfile.Profile(),
+        }
+        self._stage["sampler"] = threading.Thread(target=self._sample, daemon=True,
+                                                  args=(threading.get_ident(), self._stage["stacks"], self._stage["rss_peak"], self._stage["stop_event"]))
+
+        tracemalloc.reset_peak()
+        self._stage["start_time"] = time.perf_counter()
+        self._stage["start_cpu"] = time.process_time()
+        self._stage["sampler"].start()
+        self._stage["profile"].enable()
+
+    def stop(self):
+        if not self.enabled or self._stage is None:
+            return
+
+        stage, self._stage = self._stage, None
+        name, profile = stage["name"], stage["profile"]
+        profile.disable()
+        stage["stop_event"].set()
+        stage["sampler"].join()
+        wall_time = time.perf_counter() - stage["start_time"]
+        cpu_time = time.process_time() - stage["start_cpu"]
+        _, python_peak = tracemalloc.get_traced_memory()
+
+        profile.dump_stats(os.path.join(self.output_directory, f"{name}.pstats"))
+        with open(os.path.join(self.output_directory, f"{name}.txt"), "w", encoding="utf-8") as f:
+            pstats.Stats(profile, stream=f).sort_stats("cumulative").print_stats(50)
+        with open(os.path.join(self.output_directory, f"{name}.collapsed"), "w", encoding="utf-8") as f:
+            for stack, count in stage["stacks"].most_common():
+                f.write(f"{stack} {count}\n")
+
+        self.summary.append({
+            "stage": name,
+            "wall_time_s": round(wall_time, 3),
+            "cpu_time_s": round(cpu_time, 3),
+            "python_peak_bytes": python_peak,
+            "rss_peak_bytes": stage["rss_peak"][0] if stage["rss_peak"][0] is not None else get_peak_rss(),
+        })
+        self.save_summary()
+        print(f"Profil de l'étape {name} : {wall_time:.2f} s, pic mémoire Python {python_peak / 2**20:.1f} Mo")
+
+    def add_summary(self, name, info):
+        # Informations sur l'exécution sans profil CPU (ex : tailles des lots CLIP)
+        if not self.enabled:
+            return
+        self.summary.append({"stage": name, **info})
+        self.save_summary()
+
+    def save_summary(self):
+        with open(os.path.join(self.output_directory, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(self.summary, f, indent=2)
+
+    def _sample(self, thread_id, stacks, rss_peak, stop_event):
+        # Échantillonnage de la pile du thread profilé, au format "collapsed" (flamegraph.pl, speedscope)
+        while not stop_event.wait(self.sampling_interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                stacks[";".join(reversed(stack))] += 1
+
+            rss = get_rss()
+            if rss is not None and (rss_peak[0] is None or rss > rss_peak[0]):
+                rss_peak[0] = rss
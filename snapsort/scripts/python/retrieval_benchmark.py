@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import subprocess
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from functions import set_parser_retrieval_benchmark
+from chroma_db import ChromaDatabase
+
+DATABASE_PATH = "/scripts/temp_files"
+
+# Vocabulaire des documents synthétiques (objets détectés + description, comme les documents de llm_call.py)
+OBJECTS = ["arbre", "voiture", "chien", "chat", "montagne", "plage", "bateau", "vélo", "maison", "église", "pont", "lac", "fleur",
+           "enfant", "table", "gâteau", "neige", "forêt", "rivière", "avion", "train", "musée", "statue", "marché", "restaurant"]
+ADJECTIVES = ["rouge", "bleu", "vert", "jaune", "grand", "petit", "ancien", "moderne", "ensoleillé", "enneigé", "lumineux", "sombre"]
+PLACES = ["ville", "campagne", "bord de mer", "parc", "sentier", "port", "centre-ville", "jardin", "village", "vallée"]
+COUNTRIES = ["CA", "FR", "US", "IT", "ES", "JP"]
+
+
+class HashEmbeddings(Embeddings):
+    def __init__(self, dimensions=256):
+        """
+        Embedding local et déterministe à la place d'Ollama : chaque mot est projeté sur une direction aléatoire fixée par son hash.
+        Deux textes qui partagent des mots sont proches, ce qui suffit à mesurer la latence et le rappel de la recherche.
+        """
+        self.dimensions = dimensions
+        self._word_vectors = {}
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in text.lower().split():
+            vector += self._get_word_vector(word)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def _get_word_vector(self, word):
+        if word not in self._word_vectors:
+            seed = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            self._word_vectors[word] = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+        return self._word_vectors[word]
+
+
+def make_documents(count, seed):
+    rng = random.Random(seed)
+    texts, metadatas = [], []
+    for i in range(count):
+        objects = rng.sample(OBJECTS, 3)
+        text = "\n".join(f"{name} - un {name} {rng.choice(ADJECTIVES)}" for name in objects)
+        text += f"\n\nUne photo d'un {objects[0]} {rng.choice(ADJECTIVES)} dans un {rng.choice(PLACES)}, avec un {objects[1]}."
+        texts.append(text)
+        metadatas.append({"image_name": f"synthetic_{i:07d}.jpg", "country": rng.choice(COUNTRIES),
+                          "date_timestamp": 1577836800 + rng.randrange(5 * 365) * 86400, "generated_with": "benchmark"})
+    return texts, metadatas
+
+
+def make_queries(count, seed):
+    rng = random.Random(seed + 1)
+    return [f"un {rng.choice(OBJECTS)} {rng.choice(ADJECTIVES)} dans un {rng.choice(PLACES)}" for _ in range(count)]
+
+
+def percentiles(latencies):
+    values = np.array(latencies) * 1000
+    return {"p50_ms": float(np.percentile(values, 50)), "p95_ms": float(np.percentile(values, 95)),
+            "p99_ms": float(np.percentile(values, 99)), "mean_ms": float(values.mean())}
+
+
+def populate(database, texts, metadatas, batch_size=1000):
+    ids = [f"doc_{i}" for i in range(len(texts))]
+    for start in range(0, len(texts), batch_size):
+        end = start + batch_size
+        database.db.add_texts(texts[start:end], metadatas=metadatas[start:end], ids=ids[start:end])
+    return ids
+
+
+def exact_search(document_vectors, query_vector, k):
+    # Recherche exacte (force brute) en distance L2, la métrique de la collection
+    distances = ((document_vectors - query_vector) ** 2).sum(axis=1)
+    return set(np.argsort(distances)[:k].tolist())
+
+
+def run_queries(database, embeddings, document_vectors, queries, k, filters=None, allowed=None):
+    latencies, recalls = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results = database.get_similar_pictures(query, threshold=float("inf"), k=k, printing=False, filters=filters, page_size=k)
+        latencies.append(time.perf_counter() - start)
+
+        vectors = document_vectors if allowed is None else document_vectors[allowed]
+        expected = exact_search(vectors, np.array(embeddings.embed_query(query), dtype=np.float32), k)
+        if allowed is not None:
+            expected = {int(allowed[i]) for i in expected}
+        found = {int(doc.id.split("_")[1]) for doc, _ in results}
+        recalls.append(len(found & expected) / max(1, len(expected)))
+    return {**percentiles(latencies), "recall_at_k": float(np.mean(recalls)), "queries": len(queries)}
+
+
+def measure_cold_start(args, db_name, query):
+    # Nouveau processus : ni le client Chroma ni l'index HNSW ne sont déjà en mémoire
+    command = [sys.executable, os.path.abspath(__file__), "--cold_start", "--db_name", db_name, "--dimensions", str(args.dimensions),
+               "--k", str(args.k), "--query", query]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"Mesure du démarrage à froid impossible :\n{result.stderr}")
+        return None
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def cold_start(args):
+    start = time.perf_counter()
+    database = ChromaDatabase(db_name=args.db_name, path=DATABASE_PATH, embedding_function=HashEmbeddings(args.dimensions))
+    open_time = time.perf_counter() - start
+    start = time.perf_counter()
+    database.get_similar_pictures(args.query, threshold=float("inf"), k=args.k, printing=False, page_size=args.k)
+    first_query_time = time.perf_counter() - start
+    print(json.dumps({"open_ms": 1000 * open_time, "first_query_ms": 1000 * first_query_time}))
+
+
+def check_regressions(results, baseline, max_latency_regression, max_recall_drop):
+    failures = []
+    for run in ("unfiltered", "filtered"):
+        if run not in baseline or run not in results:
+            continue
+        p95, baseline_p95 = results[run]["p95_ms"], baseline[run]["p95_ms"]
+        if p95 > baseline_p95 * (1 + max_latency_regression):
+            failures.append(f"{run} : p95 {p95:.2f} ms contre {baseline_p95:.2f} ms")
+        recall, baseline_recall = results[run]["recall_at_k"], baseline[run]["recall_at_k"]
+        if recall < baseline_recall - max_recall_drop:
+            failures.append(f"{run} : recall@k {recall:.4f} contre {baseline_recall:.4f}")
+    return failures
+
+
+if __name__ == "__main__":
+    args = set_parser_retrieval_benchmark()
+    if args.cold_start:
+        cold_start(args)
+        sys.exit(0)
+
+    embeddings = HashEmbeddings(args.dimensions)
+    texts, metadatas = make_documents(args.documents, args.seed)
+    queries = make_queries(args.queries, args.seed)
+
+    db_name = f"benchmark_{args.documents}_{args.seed}"
+    database = ChromaDatabase(db_name=db_name, path=DATABASE_PATH, embedding_function=embeddings)
+    try:
+        # Collection gardée d'une exécution précédente (--keep) : elle n'est pas reconstruite
+        populate_time = None
+        if database.db._collection.count() != len(texts):
+            database.db.delete_collection()
+            database = ChromaDatabase(db_name=db_name, path=DATABASE_PATH, embedding_function=embeddings)
+            start = time.perf_counter()
+            populate(database, texts, metadatas)
+            populate_time = time.perf_counter() - start
+
+        document_vectors = np.array(embeddings.embed_documents(texts), dtype=np.float32)
+        country = COUNTRIES[0]
+        allowed = np.array([i for i, metadata in enumerate(metadatas) if metadata["country"] == country])
+
+        results = {
+            "documents": args.documents,
+            "dimensions": args.dimensions,
+            "k": args.k,
+            "seed": args.seed,
+            "populate_s": populate_time,
+            "cold_start": measure_cold_start(args, db_name, queries[0]),
+            "unfiltered": run_queries(database, embeddings, document_vectors, queries, args.k),
+            "filtered": run_queries(database, embeddings, document_vectors, queries, args.k,
+                                    filters=ChromaDatabase.build_filters(country=country), allowed=allowed),
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(database.path, ignore_errors=True)
+
+    for run in ("unfiltered", "filtered"):
+        print(f"{run} : p50 {results[run]['p50_ms']:.2f} ms, p95 {results[run]['p95_ms']:.2f} ms, p99 {results[run]['p99_ms']:.2f} ms, "
+              f"recall@{args.k} {results[run]['recall_at_k']:.4f}")
+    if results["cold_start"] is not None:
+        print(f"Démarrage à froid : ouverture {results['cold_start']['open_ms']:.1f} ms, première requête {results['cold_start']['first_query_ms']:.1f} ms")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Résultats écrits dans {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        failures = check_regressions(results, baseline, args.max_latency_regression, args.max_recall_drop)
+        for failure in failures:
+            print(f"Régression : {failure}")
+        sys.exit(1 if failures else 0)
@@ -0,0 +1,415 @@
+import os
+import time
+import queue
+import shutil
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from categories_manager import CategoriesManager
+from embeddings_manager import EmbeddingsManager
+from images_manager import ImageCleaner
+from image_details import ImageDetails
+from geocoding_service import GeocodingService
+from functions import create_arborescence
+from copy_manager import get_unique_path
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    # Sans watchdog, le dossier est surveillé par scrutation périodique
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class _WatchHandler(FileSystemEventHandler):
+    def __init__(self, ingest):
+        self.ingest = ingest
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.ingest.notify(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.ingest.notify(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.ingest.notify(event.dest_path)
+
+
+class StreamingIngest(CategoriesManager):
+    def __init__(self, directory, destination_directory, copy_directory, allowed_extensions=None, debounce=2.0, poll_interval=1.0,
+                 batch_size=8, queue_size=32, threshold_clustering=0.55, threshold_category=0.05, n_neighbors=3,
+                 blur_threshold=50.0, phash_threshold=20, day_close_delay=600.0):
+        """
+        Import en continu : les photos déposées dans le dossier surveillé sont triées au fur et à mesure de leur arrivée.
+        Pipeline : EXIF -> embedding -> rattachement à un cluster -> catégorie -> copie dans les albums.
+
+        :param debounce: Délai (s) sans modification avant de considérer un fichier comme complètement écrit.
+        :param poll_interval: Intervalle (s) de scrutation du dossier si watchdog (inotify) n'est pas disponible.
+        :param batch_size: Taille maximale des lots envoyés à CLIP.
+        :param queue_size: Taille des files entre les étapes : quand l'embedding prend du retard, les étapes précédentes attendent.
+        :param day_close_delay: Délai (s) sans nouvelle image d'un jour après lequel ce jour est clos : ses clusters, déjà placés,
+                                sont retirés de la mémoire. Une image de ce jour arrivée plus tard crée un nouveau cluster.
+        """
+        # Pas de parcours initial du dossier ni de DataFrame : seul le modèle CLIP est partagé avec CategoriesManager
+        EmbeddingsManager.__init__(self)
+        if allowed_extensions is None:
+            allowed_extensions = {".jpg", ".jpeg", ".png", ".gif"}
+        self.allowed_extensions = allowed_extensions
+        self.directory = directory
+        self.destination_directory = destination_directory
+        self.copy_directory = copy_directory
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.threshold_clustering = threshold_clustering
+        self.threshold_category = threshold_category
+        self.n_neighbors = n_neighbors
+        self.blur_threshold = blur_threshold
+        self.phash_threshold = phash_threshold
+        self.day_close_delay = day_close_delay
+
+        self.image_cleaner = ImageCleaner()
+        self.geocoding_service = GeocodingService()
+
+        self.exif_queue = queue.Queue(maxsize=queue_size)
+        self.embedding_queue = queue.Queue(maxsize=queue_size)
+        self.placement_queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+
+        self._lock = threading.Lock()
+        self._pending = {}          # chemin -> (taille, date de modification, instant du dernier changement)
+        self._seen = set()          # chemins en cours de traitement
+        self._failed = {}           # chemin -> (taille, date de modification) des images en erreur, laissées dans le dossier surveillé
+        self.recent_by_day = {}     # jour -> dernières images du jour (chemin, embedding, cluster)
+        self.clusters = {}          # identifiant -> informations du cluster
+        self.clusters_by_day = {}   # jour -> identifiants des clusters du jour
+        self.day_activity = {}      # jour -> instant de la dernière image reçue
+        self.placed = {}            # chemin -> copie dans les albums
+        self._copy_paths = None     # chemins déjà utilisés dans le dossier de copie (lus au premier import)
+        self.global_cluster_id = 0
+
+    def run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        os.makedirs(self.destination_directory, exist_ok=True)
+        os.makedirs(self.copy_directory, exist_ok=True)
+
+        en_categories, self.predefined_categories = self.get_predifined_categories()
+        self.category_embeddings = self.get_category_embeddings(en_categories)
+
+        workers = [
+            threading.Thread(target=self._debounce_loop, daemon=True),
+            threading.Thread(target=self._exif_loop, daemon=True),
+            threading.Thread(target=self._embedding_loop, daemon=True),
+            threading.Thread(target=self._placement_loop, daemon=True),
+        ]
+        for worker in workers:
+            worker.start()
+
+        # Photos déjà présentes au lancement
+        self._scan_directory()
+
+        observer = None
+        if Observer is not None:
+            observer = Observer()
+            observer.schedule(_WatchHandler(self), self.directory, recursive=False)
+            observer.start()
+            print(f"Surveillance du dossier {self.directory} (événements système)")
+        else:
+            print(f"Surveillance du dossier {self.directory} (scrutation toutes les {self.poll_interval} s)")
+
+        try:
+            while not self.stop_event.is_set():
+                time.sleep(self.poll_interval)
+                if observer is None:
+                    self._scan_directory()
+        except KeyboardInterrupt:
+            print("Arrêt de l'import en continu")
+        finally:
+            self.stop_event.set()
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+    def notify(self, path):
+        if os.path.splitext(path)[1].lower() not in self.allowed_extensions:
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            if path in self._seen:
+                return
+            # Image en erreur : nouvelle tentative seulement si le fichier a changé (sinon au prochain lancement)
+            if self._failed.get(path) == (stat.st_size, stat.st_mtime):
+                return
+            self._failed.pop(path, None)
+            previous = self._pending.get(path)
+            if previous is None or previous[:2] != (stat.st_size, stat.st_mtime):
+                self._pending[path] = (stat.st_size, stat.st_mtime, time.monotonic())
+
+    def _scan_directory(self):
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    self.notify(entry.path)
+
+    def _debounce_loop(self):
+        # Un fichier est traité quand sa taille et sa date n'ont pas changé depuis `debounce` secondes
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            with self._lock:
+                candidates = [path for path, (_, _, changed) in self._pending.items() if now - changed >= self.debounce]
+            for path in candidates:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    with self._lock:
+                        self._pending.pop(path, None)
+                    continue
+                with self._lock:
+                    size, mtime, _ = self._pending[path]
+                    if (stat.st_size, stat.st_mtime) != (size, mtime):
+                        self._pending[path] = (stat.st_size, stat.st_mtime, time.monotonic())
+                        continue
+                    del self._pending[path]
+                    self._seen.add(path)
+                self._put(self.exif_queue, path)
+            time.sleep(min(self.debounce, 0.5))
+
+    def _exif_loop(self):
+        while not self.stop_event.is_set():
+            path = self._get(self.exif_queue)
+            if path is None:
+                continue
+            copy_path = None
+            try:
+                copy_path = self._copy_source(path)
+                image = ImageDetails(copy_path)
+                quality = self.image_cleaner.get_quality(copy_path)
+                phash = self.image_cleaner.get_phash(copy_path)
+            except Exception as e:
+                if copy_path is not None and os.path.exists(copy_path):
+                    os.remove(copy_path)
+                self._fail(path, f"Erreur lors de la lecture de {path} : {e}")
+                continue
+
+            item = {
+                'source_path': path,
+                'path': copy_path,
+                'image_name': image.image_name,
+                'date_time': image.date_time,
+                'latitude': image.latitude,
+                'longitude': image.longitude,
+                'day': image.date_time.split(" ")[0] if image.date_time else "no_date",
+                'quality': quality,
+                'phash': phash
+            }
+            self._put(self.embedding_queue, item)
+
+    def _copy_source(self, path):
+        # Copie de travail sous un nom libre du dossier de copie (nom_1.jpg...), comme en mode batch :
+        # deux photos de même nom, venant de dossiers différents ou déposées l'une après l'autre, ne s'écrasent pas
+        if self._copy_paths is None:
+            with os.scandir(self.copy_directory) as entries:
+                self._copy_paths = {entry.path for entry in entries}
+        copy_path = get_unique_path(os.path.join(self.copy_directory, os.path.basename(path)), self._copy_paths)
+        shutil.copy2(path, copy_path)
+        return copy_path
+
+    def _embedding_loop(self):
+        # Les images arrivées en même temps sont regroupées en un lot pour CLIP
+        while not self.stop_event.is_set():
+            item = self._get(self.embedding_queue)
+            if item is None:
+                continue
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.embedding_queue.get(timeout=0.2))
+                except queue.Empty:
+                    break
+
+            embeddings = self.image_embedding(paths=[item['path'] for item in batch])
+            if embeddings is None or len(embeddings) != len(batch):
+                # Une image illisible dans le lot : calcul image par image
+                embeddings = [self.image_embedding(paths=[item['path']]) for item in batch]
+                embeddings = [embedding[0] if embedding is not None else None for embedding in embeddings]
+
+            for item, embedding in zip(batch, embeddings):
+                if embedding is None:
+                    self._fail(item['source_path'], f"Erreur lors du calcul de l'embedding de {item['path']}")
+                    continue
+                item['embedding'] = embedding
+                self._put(self.placement_queue, item)
+
+    def _placement_loop(self):
+        while not self.stop_event.is_set():
+            item = self._get(self.placement_queue)
+            if item is None:
+                self._close_days()
+                continue
+            cluster_id = None
+            try:
+                cluster_id = self.attach_to_cluster(item)
+                self.place_cluster(cluster_id)
+                print(f"Importé : {item['image_name']} -> cluster {cluster_id} ({self.clusters[cluster_id]['category']})")
+            except Exception as e:
+                # La photo source n'est supprimée qu'une fois triée : en cas d'erreur, elle reste dans le dossier surveillé
+                self._detach(item, cluster_id)
+                self._fail(item['source_path'], f"Erreur lors du tri de {item['path']} : {e}")
+                continue
+            self._release(item['source_path'])
+            self._close_days()
+
+    def attach_to_cluster(self, item):
+        """
+        Rattache une image au cluster de l'image la plus proche parmi les dernières images du même jour,
+        ou crée un nouveau cluster si aucune n'est assez similaire.
+        """
+        recent = self.recent_by_day.setdefault(item['day'], deque(maxlen=self.n_neighbors))
+        cluster_id = None
+        best_similarity = self.threshold_clustering
+        for path, embedding, recent_cluster_id in recent:
+            similarity = float(np.dot(item['embedding'], embedding))
+            if similarity >= best_similarity:
+                best_similarity = similarity
+                cluster_id = recent_cluster_id
+
+        if cluster_id is None:
+            cluster_id = f"cluster_{self.global_cluster_id}"
+            self.global_cluster_id += 1
+            self.clusters[cluster_id] = {'day': item['day'], 'images': [], 'category': None}
+            self.clusters_by_day.setdefault(item['day'], []).append(cluster_id)
+        self.day_activity[item['day']] = time.monotonic()
+
+        recent.append((item['path'], item['embedding'], cluster_id))
+        self.clusters[cluster_id]['images'].append(item)
+        return cluster_id
+
+    def place_cluster(self, cluster_id):
+        """
+        (Re)calcule la catégorie du cluster et met à jour la copie de ses images dans les albums.
+        Les images floues et les doublons (on garde la meilleure qualité) ne sont pas copiés dans les albums.
+        """
+        cluster = self.clusters[cluster_id]
+        kept = self._clean_images(cluster['images'])
+
+        category = None
+        if kept:
+            best_cat, _ = self.best_cluster_category([np.vstack([item['embedding'] for item in kept])], self.category_embeddings,
+                                                     self.predefined_categories, threshold=self.threshold_category)
+            category = cluster['day'].replace(":", "_") + "_" + best_cat
+            if best_cat == "Autres" or len(cluster['images']) == 1:
+                category = f"Autres/{best_cat}"
+        cluster['category'] = category
+
+        kept_paths = {item['path'] for item in kept}
+        for item in cluster['images']:
+            if item['path'] not in kept_paths and item['path'] in self.placed:
+                os.remove(self.placed.pop(item['path']))
+
+        if not kept:
+            return
+
+        df = pd.DataFrame([{key: item[key] for key in ('image_name', 'path', 'date_time', 'latitude', 'longitude')} for item in kept])
+        df['categories'] = category
+        df = create_arborescence(df, self.geocoding_service)
+        for path, folder_path in zip(df['path'], df['folder_path']):
+            destination_folder = os.path.join(self.destination_directory, folder_path)
+            destination_path = os.path.join(destination_folder, os.path.basename(path))
+            previous_path = self.placed.get(path)
+            if previous_path == destination_path:
+                continue
+            os.makedirs(destination_folder, exist_ok=True)
+            if previous_path is not None and os.path.exists(previous_path):
+                # La catégorie du cluster a changé : l'image est déplacée vers le nouveau dossier
+                os.replace(previous_path, destination_path)
+            else:
+                shutil.copy2(path, destination_path)
+            self.placed[path] = destination_path
+
+    def _clean_images(self, images):
+        kept = []
+        for item in images:
+            if item['quality'] is None or item['quality'] <= self.blur_threshold:
+                continue
+            duplicate_index = None
+            for index, kept_item in enumerate(kept):
+                if item['phash'] is not None and kept_item['phash'] is not None and item['phash'] - kept_item['phash'] < self.phash_threshold:
+                    duplicate_index = index
+                    break
+            if duplicate_index is None:
+                kept.append(item)
+            elif item['quality'] > kept[duplicate_index]['quality']:
+                kept[duplicate_index] = item
+        return kept
+
+    def _detach(self, item, cluster_id):
+        # Retire une image en erreur de son cluster, pour qu'une nouvelle tentative ne l'ajoute pas deux fois
+        if cluster_id is None or cluster_id not in self.clusters:
+            return
+        cluster = self.clusters[cluster_id]
+        cluster['images'] = [image for image in cluster['images'] if image is not item]
+        placed_path = self.placed.pop(item['path'], None)
+        if placed_path is not None and os.path.exists(placed_path):
+            os.remove(placed_path)
+        recent = self.recent_by_day.get(item['day'])
+        if recent is not None:
+            for entry in list(recent):
+                if entry[0] == item['path']:
+                    recent.remove(entry)
+
+    def _close_days(self):
+        # Les jours sans nouvelle image depuis day_close_delay sont clos : leurs clusters (images et embeddings) quittent la mémoire
+        now = time.monotonic()
+        closed_days = [day for day, last_image in self.day_activity.items() if now - last_image >= self.day_close_delay]
+        for day in closed_days:
+            del self.day_activity[day]
+            self.recent_by_day.pop(day, None)
+            for cluster_id in self.clusters_by_day.pop(day, []):
+                for item in self.clusters.pop(cluster_id)['images']:
+                    self.placed.pop(item['path'], None)
+        if closed_days:
+            print(f"Jours clos : {', '.join(closed_days)} ({len(self.clusters)} clusters en mémoire)")
+
+    def _fail(self, source_path, message):
+        print(message)
+        try:
+            stat = os.stat(source_path)
+            signature = (stat.st_size, stat.st_mtime)
+        except OSError:
+            signature = None
+        with self._lock:
+            self._seen.discard(source_path)
+            if signature is not None:
+                self._failed[source_path] = signature
+
+    def _release(self, source_path):
+        # L'image a été triée : elle est retirée du dossier surveillé (comme empty_directory en mode batch)
+        if os.path.exists(source_path):
+            os.remove(source_path)
+        with self._lock:
+            self._seen.discard(source_path)
+
+    def _put(self, target_queue, item):
+        # Bloque tant que l'étape suivante est saturée (contre-pression)
+        while not self.stop_event.is_set():
+            try:
+                target_queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, source_queue):
+        try:
+            return source_queue.get(timeout=0.5)
+        except queue.Empty:
+            return None
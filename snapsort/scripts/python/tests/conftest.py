@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Les scripts s'importent entre eux par leur nom de module (from functions import ...), comme lancés depuis scripts/python
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,57 @@
+import chromadb
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from chroma_db import ChromaDatabase
+
+
+class FakeEmbeddings(Embeddings):
+    # Embeddings déterministes : pas de serveur Ollama
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text)), 1.0, 0.0]
+
+
+@pytest.fixture
+def database_path(tmp_path, monkeypatch):
+    # ChromaDatabase place la base dans le dossier courant + path
+    monkeypatch.chdir(tmp_path)
+    return str(tmp_path / "db" / "db_photos")
+
+
+def open_database(**kwargs):
+    return ChromaDatabase(path="/db", embedding_function=FakeEmbeddings(), **kwargs)
+
+
+def test_search_ef_change_keeps_configuration_and_metadata_in_sync(database_path):
+    client = chromadb.PersistentClient(database_path)
+    client.create_collection("photo_collection", metadata={"hnsw:space": "cosine", "hnsw:search_ef": 100})
+    del client
+
+    database = open_database(hnsw_search_ef=50)
+    collection = database.db._collection
+    assert collection.configuration["hnsw"]["ef_search"] == 50
+    assert collection.metadata["hnsw:search_ef"] == 50
+    assert collection.configuration["hnsw"]["space"] == "cosine"
+
+    reopened = open_database().db._collection
+    assert reopened.configuration["hnsw"]["ef_search"] == 50
+    assert reopened.metadata["hnsw:search_ef"] == 50
+
+
+def test_processed_files_are_scoped_to_the_collection(database_path):
+    client = chromadb.PersistentClient(database_path)
+    other = client.create_collection("other_collection")
+    other.add(ids=["x", "y"], embeddings=[[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]],
+              metadatas=[{"image_name": "autre.jpg", "content_hash": "hash_autre"}, {"image_name": "ancienne.jpg"}])
+    del client
+
+    database = open_database()
+    database.db._collection.add(ids=["a", "b"], embeddings=[[1.0, 1.0, 0.0], [0.0, 1.0, 1.0]],
+                                metadatas=[{"image_name": "photo.jpg", "content_hash": "hash_photo"}, {"image_name": "sans_hash.jpg"}])
+
+    assert database.get_processed_hashes() == {"hash_photo": {"photo.jpg"}}
+    assert database.get_unhashed_files() == {"sans_hash.jpg"}
+    assert sorted(database.get_processed_files()) == ["photo.jpg", "sans_hash.jpg"]
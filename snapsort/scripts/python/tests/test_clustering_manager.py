@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pandas as pd
+import torch
+from PIL import Image
+from transformers import BatchFeature
+
+from clustering_manager import ClusteringManager
+
+
+def test_day_sorting_sends_malformed_dates_to_no_date(tmp_path):
+    paths = []
+    for i, name in enumerate(["a.jpg", "b.jpg", "c.jpg", "d.jpg", "e.jpg", "f.jpg"]):
+        path = tmp_path / name
+        path.write_bytes(b"")
+        # Images sans date triées par date de modification
+        os.utime(path, (1000 + i, 1000 + i))
+        paths.append(str(path))
+    df = pd.DataFrame({"path": paths,
+                       "date_time": ["2021:05:01 12:00:00", "2021:05:01 09:00:00", None, "0000:00:00 00:00:00", "garbage",
+                                     "2021:05:02 08:00:00"]})
+    manager = ClusteringManager(df)
+
+    days = manager.day_sorting()
+
+    assert days == {"2021:05:01": [paths[1], paths[0]], "2021:05:02": [paths[5]], "no_date": [paths[2], paths[3], paths[4]]}
+
+
+class FakeClipProcessor:
+    def __call__(self, images, return_tensors="pt", padding=True):
+        # Couleur moyenne de chaque image : un embedding différent par image, sans modèle CLIP
+        pixels = torch.tensor(np.stack([np.asarray(image, dtype=np.float32).mean(axis=(0, 1)) for image in images]))
+        return BatchFeature({"pixel_values": pixels})
+
+
+class FakeClipModel(torch.nn.Module):
+    def get_image_features(self, pixel_values):
+        return pixel_values + 1.0
+
+
+def test_days_embedding_pairs_paths_with_their_embeddings(tmp_path):
+    colors = {"a.jpg": (255, 0, 0), "b.jpg": None, "c.jpg": (0, 255, 0), "d.jpg": (0, 0, 255)}
+    paths = []
+    for name, color in colors.items():
+        path = tmp_path / name
+        if color is None:
+            path.write_bytes(b"pas une image")
+        else:
+            Image.new("RGB", (16, 16), color).save(path)
+        paths.append(str(path))
+    manager = ClusteringManager(pd.DataFrame({"path": paths, "date_time": ["2021:05:01 10:00:00"] * len(paths)}),
+                                clip_model=FakeClipModel(), clip_processor=FakeClipProcessor())
+
+    day_paths, embeddings = manager.days_embedding({"2021:05:01": paths}, batch_size=4)["2021:05:01"]
+
+    # L'image illisible (b.jpg) est sautée sans décaler les embeddings des images suivantes
+    assert day_paths == [paths[0], paths[2], paths[3]]
+    for path, embedding in zip(day_paths, embeddings):
+        with Image.open(path) as image:
+            expected = np.asarray(image, dtype=np.float32).mean(axis=(0, 1)) + 1.0
+        np.testing.assert_allclose(embedding, expected / np.linalg.norm(expected), rtol=1e-5)
@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+
+from functions import create_arborescence
+
+
+class FakeGeocodingService:
+    def __init__(self, localisations):
+        # Lieu de chaque ligne (None pour une image sans coordonnées)
+        self.localisations = localisations
+
+    def localise_dataframe(self, df, type="small"):
+        return pd.Series(self.localisations, index=df.index, dtype=object)
+
+
+def make_frame(date_times, has_gps):
+    count = len(date_times)
+    coordinate = 48.85 if has_gps else None
+    return pd.DataFrame({"date_time": date_times, "latitude": [coordinate] * count, "longitude": [coordinate] * count,
+                         "categories": [f"categorie_{i}" for i in range(count)], "path": [f"image_{i}.jpg" for i in range(count)]})
+
+
+def test_arborescence_without_any_coordinates():
+    data = make_frame(["2021:05:01 10:00:00", "2021:12:24 20:00:00"], has_gps=False)
+    result = create_arborescence(data, FakeGeocodingService([None, None]))
+    assert result["folder_path"].tolist() == ["2021/Printemps/categorie_0", "2021/Hiver/categorie_1"]
+
+
+def test_arborescence_without_any_date_or_coordinates():
+    data = make_frame([None, float("nan")], has_gps=False)
+    result = create_arborescence(data, FakeGeocodingService([None, None]))
+    assert result["folder_path"].tolist() == ["categorie_0", "categorie_1"]
+
+
+@pytest.mark.parametrize("localisations, expected", [
+    (["Paris_FR", None], ["2021/Printemps/Paris_FR/categorie_0", "categorie_1"]),
+    (["Paris_FR", "Lyon_FR"], ["2021/Printemps/Paris_FR/categorie_0", "categorie_1"]),
+])
+def test_arborescence_mixed_rows(localisations, expected):
+    data = make_frame(["2021:05:01 10:00:00", None], has_gps=True)
+    result = create_arborescence(data, FakeGeocodingService(localisations))
+    assert result["folder_path"].tolist() == expected
@@ -0,0 +1,12 @@
+import pytest
+
+from import_time import IMPORT_BUDGETS_MS, HEAVY_MODULES, measure_import_time
+
+
+@pytest.mark.parametrize("module, budget_ms", sorted(IMPORT_BUDGETS_MS.items()))
+def test_import_time_budget(module, budget_ms):
+    top_level_times, loaded_modules = measure_import_time(module)
+
+    heavy_loaded = sorted(name for name in HEAVY_MODULES if name in loaded_modules)
+    assert not heavy_loaded, f"{module} charge au démarrage des modules qui devraient l'être à la première utilisation : {heavy_loaded}"
+    assert sum(top_level_times.values()) <= budget_ms
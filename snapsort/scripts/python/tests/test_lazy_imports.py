@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+SCRIPTS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code):
+    # Nouvel interpréteur : les modules déjà chargés par pytest ne faussent pas le test
+    return subprocess.run([sys.executable, "-c", code], cwd=SCRIPTS_DIRECTORY, capture_output=True, text=True)
+
+
+def test_lazy_module_is_loaded_on_first_use():
+    result = run_python("import sys\n"
+                        "from lazy_imports import lazy_import\n"
+                        "colorsys = lazy_import('colorsys')\n"
+                        "assert 'colorsys' not in sys.modules\n"
+                        "assert colorsys.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)\n"
+                        "assert 'colorsys' in sys.modules\n")
+    assert result.returncode == 0, result.stderr
+
+
+def test_pending_lazy_modules_are_not_loaded_by_sys_modules_scans():
+    # inspect.getmodule parcourt sys.modules (comme pendant l'import de torch) : un module en attente ne doit pas être chargé
+    result = run_python("import sys, inspect\n"
+                        "from lazy_imports import lazy_import\n"
+                        "colorsys = lazy_import('colorsys')\n"
+                        "inspect.getmodule(compile('pass', 'inconnu.py', 'exec'), 'inconnu.py')\n"
+                        "assert 'colorsys' not in sys.modules\n")
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+from PIL import Image
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from llm_call import LLMCall
+from payload_cache import PayloadCache
+
+OBJECTS = [{"name": "arbre", "description": "un arbre"}, {"name": "chemin", "description": "un chemin de terre"}]
+DESCRIPTION = "Un chemin bordé d arbres."
+COMBINED_RESPONSE = json.dumps({"objects": OBJECTS, "description": DESCRIPTION}, ensure_ascii=False)
+
+
+def make_llm_call(tmp_path, responses, combined=True):
+    # Les réponses du modèle sont rendues dans l'ordre, sans serveur Ollama
+    llm_call = LLMCall(payload_cache=PayloadCache(directory=str(tmp_path / "payloads")), combined=combined)
+    llm_call.chains = {None: llm_call.build_chains(FakeListChatModel(responses=responses))}
+    return llm_call
+
+
+@pytest.fixture
+def image_paths(tmp_path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"image_{i}.jpg"
+        Image.new("RGB", (64, 48), (40 * i, 120, 200)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def test_combined_mode_makes_one_call_per_image(tmp_path, image_paths):
+    llm_call = make_llm_call(tmp_path, [COMBINED_RESPONSE])
+    for path in image_paths:
+        details = llm_call.analyze_image(path, image_b64="iVBORw0KGgo=")
+        assert details.detected_objects == OBJECTS
+        assert details.description == DESCRIPTION
+    assert llm_call.inference_calls == len(image_paths)
+
+
+def test_split_mode_makes_two_calls_per_image(tmp_path, image_paths):
+    llm_call = make_llm_call(tmp_path, [json.dumps(OBJECTS, ensure_ascii=False), DESCRIPTION], combined=False)
+    for path in image_paths:
+        details = llm_call.analyze_image(path, image_b64="iVBORw0KGgo=")
+        assert details.detected_objects == OBJECTS
+        assert details.description == DESCRIPTION
+    assert llm_call.inference_calls == 2 * len(image_paths)
+
+
+def test_fallback_to_split_mode_after_failed_combined_attempts(tmp_path, image_paths):
+    # Deux réponses combinées invalides (json illisible, puis json sans les champs attendus), puis les deux appels séparés
+    responses = ["pas du json", "[]", json.dumps(OBJECTS, ensure_ascii=False), DESCRIPTION]
+    llm_call = make_llm_call(tmp_path, responses)
+    details = llm_call.analyze_image(image_paths[0], image_b64="iVBORw0KGgo=")
+    assert llm_call.combined_attempts == 2
+    assert llm_call.inference_calls == 2 + 2
+    assert details.detected_objects == OBJECTS
+    assert details.description == DESCRIPTION
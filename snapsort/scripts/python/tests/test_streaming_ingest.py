@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from streaming_ingest import StreamingIngest
+
+CATEGORIES = ["Plage", "Montagne", "Autres"]
+
+
+@pytest.fixture
+def ingest(tmp_path, monkeypatch):
+    # Cache de géolocalisation et dossiers de travail dans le dossier temporaire
+    monkeypatch.chdir(tmp_path)
+    ingest = StreamingIngest(str(tmp_path / "watched"), str(tmp_path / "albums"), str(tmp_path / "copies"))
+    for directory in (ingest.directory, ingest.destination_directory, ingest.copy_directory):
+        os.makedirs(directory, exist_ok=True)
+    # Embeddings des catégories factices : le modèle CLIP n'est pas chargé
+    ingest.predefined_categories = CATEGORIES
+    ingest.category_embeddings = np.eye(len(CATEGORIES))
+    return ingest
+
+
+def make_item(ingest, name, embedding, date_time="2021:05:01 10:00:00"):
+    path = os.path.join(ingest.copy_directory, name)
+    Image.new("RGB", (64, 48), (120, 80, len(name))).save(path)
+    return {'source_path': os.path.join(ingest.directory, name), 'path': path, 'image_name': name, 'date_time': date_time,
+            'latitude': None, 'longitude': None, 'day': date_time.split(" ")[0], 'quality': 100.0, 'phash': None,
+            'embedding': np.asarray(embedding, dtype=float)}
+
+
+def test_place_cluster_without_gps(ingest):
+    items = [make_item(ingest, "a.jpg", [1.0, 0.0, 0.0]), make_item(ingest, "b.jpg", [0.9, 0.1, 0.0])]
+    cluster_ids = {ingest.attach_to_cluster(item) for item in items}
+    assert len(cluster_ids) == 1
+
+    cluster_id = cluster_ids.pop()
+    ingest.place_cluster(cluster_id)
+
+    folder = os.path.join(ingest.destination_directory, "2021", "Printemps", "2021_05_01_Plage")
+    assert ingest.clusters[cluster_id]['category'] == "2021_05_01_Plage"
+    assert sorted(os.listdir(folder)) == ["a.jpg", "b.jpg"]
+    assert ingest.placed[items[0]['path']] == os.path.join(folder, "a.jpg")
+
+
+def test_same_named_sources_get_distinct_copies(ingest, tmp_path):
+    # Copie déjà présente d'un import précédent
+    Image.new("RGB", (64, 48), (0, 0, 0)).save(os.path.join(ingest.copy_directory, "IMG_0001.jpg"))
+    sources = []
+    for folder, color in (("a", (255, 0, 0)), ("b", (0, 0, 255))):
+        os.makedirs(tmp_path / "sources" / folder)
+        source = str(tmp_path / "sources" / folder / "IMG_0001.jpg")
+        Image.new("RGB", (64, 48), color).save(source)
+        sources.append(source)
+
+    copies = [ingest._copy_source(source) for source in sources]
+
+    assert [os.path.basename(path) for path in copies] == ["IMG_0001_1.jpg", "IMG_0001_2.jpg"]
+    for source, copy_path in zip(sources, copies):
+        with Image.open(source) as expected, Image.open(copy_path) as copied:
+            assert copied.getpixel((0, 0)) == expected.getpixel((0, 0))
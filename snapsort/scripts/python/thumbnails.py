@@ -0,0 +1,13 @@
+import time
+
+from functions import set_parser_thumbnails
+from images_manager import ThumbnailGenerator
+
+if __name__ == "__main__":
+    args = set_parser_thumbnails()
+
+    starting_time = time.time()
+    generator = ThumbnailGenerator(sizes=args.sizes, image_format=args.image_format, workers=args.workers)
+    manifest = generator.generate(args.directory)
+    print(f"Manifeste des miniatures : {generator.manifest_path} ({len(manifest)} images)")
+    print(f"Temps total pour créer les miniatures : {time.time() - starting_time:.2f} sec")